@@ -0,0 +1,871 @@
+# pipeline_bench.py
+# Benchmarks for pipeline_project against a local MongoDB (never production).
+# - Seeds synthetic journals / userdetails / locations into a scratch database,
+#   with production-like shapes (coordinate formats, missing fields, non-US parks).
+# - --backend mongomock runs without a mongod (JOIN_ENGINE=bulk only: mongomock lacks $convert).
+# - Drive calls go to FakeDriveHttp, a file-backed stand-in for the Drive v3 REST API.
+# - Usage:
+#     export BENCH_MONGO_URI="mongodb://localhost:27017"
+#     python pipeline_bench.py join --rows 100000
+#     python pipeline_bench.py startup --backend mongomock
+#     python pipeline_bench.py memory --rows 1000000
+#     python pipeline_bench.py suite --sizes 10000,100000,1000000 --json bench.json --compare last.json
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+import httplib2
+import pandas as pd
+from pymongo import MongoClient
+from bson import ObjectId
+
+import pipeline_project as pp
+
+BENCH_DB = "NC_bench_db"
+SEED_BATCH = 10000
+US_STATE_LIST = sorted(pp.US_STATES)
+CA_PROVINCES = ["ON", "BC", "QC", "AB", "NS"]
+OTHER_COUNTRIES = ["Mexico", "United Kingdom", "India", "Australia"]
+US_COUNTRY_SPELLINGS = ["US", "USA", "U.S.", "United States", "usa ", "", None]
+
+def _coordinates(rng: random.Random):
+    """Coordinates in one of the formats found in `locations`, or missing."""
+    lat, lng = rng.uniform(25, 60), rng.uniform(-130, -60)
+    r = rng.random()
+    if r < 0.4:
+        return {"lat": lat, "lng": lng}
+    if r < 0.6:
+        return {"latitude": lat, "longitude": lng}
+    if r < 0.85:
+        return {"type": "Point", "coordinates": [lng, lat]}
+    return None
+
+def location_doc(rng: random.Random, i: int) -> dict:
+    """One `locations` document: mostly US parks, some Canadian and other countries, with gaps."""
+    r = rng.random()
+    if r < 0.75:
+        st = rng.choice(US_STATE_LIST)
+        loc = {"name": f"Park {i}", "city": f"City {i % 97}", "stateInitials": st,
+               "zip": f"{rng.randint(10000, 99999)}", "address": f"{i} Trail Rd, City {i % 97}, {st}"}
+        country = rng.choice(US_COUNTRY_SPELLINGS)
+        if country is not None:
+            loc["country"] = country
+    elif r < 0.9:
+        prov = rng.choice(CA_PROVINCES)
+        loc = {"name": f"Parc {i}", "city": f"Ville {i % 31}", "state": prov, "zip": "M5V 2T6",
+               "country": "Canada", "address": f"{i} Rue Principale, {prov}"}
+    else:
+        loc = {"name": f"Reserve {i}", "country": rng.choice(OTHER_COUNTRIES), "address": f"{i} High Street"}
+    for field in ("city", "zip", "address"):
+        if field in loc and rng.random() < 0.05:
+            del loc[field]
+    coords = _coordinates(rng)
+    if coords:
+        loc["coordinates"] = coords
+    p = rng.random()
+    if p < 0.7:
+        loc["parkNumber"] = f"P{i}"
+    elif p < 0.9:
+        loc["category"] = [f"C{i % 13}", "trail"]
+    return loc
+
+def _ref(rng: random.Random, ids: list):
+    """A reference to one of `ids` as stored in journals: mostly valid, some dangling or malformed."""
+    r = rng.random()
+    if r < 0.95:
+        return str(rng.choice(ids))
+    if r < 0.98:
+        return str(ObjectId())
+    return rng.choice([None, "", "not-an-object-id"])
+
+def journal_doc(rng: random.Random, t: datetime, users: list, locations: list) -> dict:
+    doc = {"_id": ObjectId.from_datetime(t), "start_time": t,
+           "end_time": None if rng.random() < 0.02 else t + timedelta(minutes=rng.randint(5, 180))}
+    for field, ids in (("uid", users), ("locationId", locations)):
+        ref = _ref(rng, ids)
+        if ref is not None:
+            doc[field] = ref
+    if rng.random() < 0.9:
+        doc["activity"] = rng.choice(["walk", "hike", "sit", "bird watching", ""])
+    if rng.random() < 0.5:
+        doc["notes"] = rng.choice(["", "Saw a heron", "Windy, 12°C", "Trail closed past the bridge"])
+    return doc
+
+def seed(db, n_journals: int, n_users: int = None, n_locations: int = None, rng_seed: int = 0) -> None:
+    """Drop and re-create the three source collections with synthetic documents."""
+    rng = random.Random(rng_seed)
+    n_users = n_users or max(1, n_journals // 20)
+    n_locations = n_locations or max(1, n_journals // 50)
+    for name in (pp.JOURNALS_COL, pp.USERS_COL, pp.LOCATIONS_COL):
+        db[name].drop()
+
+    users = []
+    for i in range(n_users):
+        u = {"_id": ObjectId(), "name": f"User {i}", "email": f"user{i}@example.com"}
+        if rng.random() < 0.03:
+            del u[rng.choice(["name", "email"])]
+        users.append(u)
+    db[pp.USERS_COL].insert_many(users)
+    user_ids = [u["_id"] for u in users]
+
+    locations = [dict(location_doc(rng, i), _id=ObjectId()) for i in range(n_locations)]
+    db[pp.LOCATIONS_COL].insert_many(locations)
+    location_ids = [loc["_id"] for loc in locations]
+
+    # _ids carry the start time, like journals written as they happen
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for lo in range(0, n_journals, SEED_BATCH):
+        docs = [journal_doc(rng, start + timedelta(minutes=7 * i), user_ids, location_ids)
+                for i in range(lo, min(lo + SEED_BATCH, n_journals))]
+        db[pp.JOURNALS_COL].insert_many(docs)
+
+def connect(backend: str = "mongod"):
+    """The bench database on a local mongod (BENCH_MONGO_URI) or in-process mongomock."""
+    if backend == "mongomock":
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("--backend mongomock needs `pip install mongomock`")
+        return mongomock.MongoClient(tz_aware=True)[BENCH_DB]
+    uri = os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017")
+    return MongoClient(uri, tz_aware=True)[BENCH_DB]
+
+# --- Fake Drive ---
+
+class FakeDriveHttp:
+    """
+    File-backed stand-in for the Drive v3 REST API at the HTTP layer, for
+    `build("drive", "v3", http=FakeDriveHttp(root))`. Covers what the pipeline calls:
+    files.list (name / name contains / parents queries), files.get (metadata, and
+    alt=media with Range) and resumable files.create / files.update.
+    Content lives in `root/<id>`, metadata in `root/index.json`. fail() injects HTTP
+    errors or transport exceptions into upload / download requests.
+    """
+
+    BASE = "https://www.googleapis.com"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._index = os.path.join(root, "index.json")
+        self.files = json.load(open(self._index)) if os.path.exists(self._index) else {}
+        self.sessions = {}
+        self.requests = 0
+        self.faults = []
+
+    def _save(self):
+        with open(self._index, "w") as f:
+            json.dump(self.files, f)
+
+    def add_folder(self, folder_id: str, name: str = "bench") -> str:
+        self.files[folder_id] = {"id": folder_id, "name": name, "parents": [],
+                                 "mimeType": "application/vnd.google-apps.folder"}
+        self._save()
+        return folder_id
+
+    @staticmethod
+    def _reply(status: int, body=b"", **headers):
+        if isinstance(body, dict):
+            body, headers["content-type"] = json.dumps(body).encode(), "application/json"
+        headers = {k.replace("_", "-"): str(v) for k, v in headers.items()}
+        return httplib2.Response(dict(headers, status=str(status))), body
+
+    def _error(self, status: int, message: str, reason: str = None):
+        errors = [{"reason": reason, "message": message}] if reason else []
+        return self._reply(status, {"error": {"code": status, "message": message, "errors": errors}})
+
+    def fail(self, kind: str, times: int = 1, status: int = 503, reason: str = None, error: Exception = None,
+             after: int = 0):
+        """
+        Make `times` requests of `kind` ("upload": session start and chunks, "download":
+        media reads), once `after` of them went through, answer HTTP `status` with error
+        `reason` (as Drive does for 403 rate limits), or raise `error` as the transport would.
+        """
+        self.faults.append({"kind": kind, "times": times, "status": status, "reason": reason, "error": error,
+                            "after": after})
+
+    def _fault(self, kind: str):
+        for fault in self.faults:
+            if fault["kind"] != kind or fault["times"] <= 0:
+                continue
+            if fault["after"] > 0:
+                fault["after"] -= 1
+            else:
+                fault["times"] -= 1
+                if fault["error"] is not None:
+                    raise fault["error"]
+                return self._error(fault["status"], f"injected {kind} failure", fault["reason"])
+            return None
+        return None
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        self.requests += 1
+        url = urlsplit(uri)
+        params = dict(parse_qsl(url.query))
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        data = body.read() if hasattr(body, "read") else body or b""
+        data = data.encode() if isinstance(data, str) else data
+
+        kind = "upload" if url.path.startswith("/upload/") else "download" if params.get("alt") == "media" else None
+        fault = self._fault(kind) if kind else None
+        if fault:
+            return fault
+        if url.path.startswith("/upload/session/"):
+            return self._upload_chunk(url.path.rsplit("/", 1)[1], data, headers)
+        if url.path.startswith("/upload/drive/v3/files"):
+            fid = url.path[len("/upload/drive/v3/files"):].strip("/") or None
+            if fid and fid not in self.files:
+                return self._error(404, f"File not found: {fid}")
+            session = f"s{len(self.sessions)}"
+            self.sessions[session] = {"id": fid, "meta": json.loads(data) if data else {}, "data": bytearray()}
+            return self._reply(200, location=f"{self.BASE}/upload/session/{session}")
+        if url.path == "/drive/v3/files" and method == "GET":
+            return self._reply(200, {"files": self._list(params)})
+        if url.path.startswith("/drive/v3/files/"):
+            fid = url.path.rsplit("/", 1)[1]
+            if fid not in self.files:
+                return self._error(404, f"File not found: {fid}")
+            if params.get("alt") == "media":
+                return self._media(fid, headers.get("range"))
+            return self._reply(200, self.files[fid])
+        return self._error(400, f"FakeDriveHttp does not implement {method} {url.path}")
+
+    def _list(self, params: dict) -> list:
+        q = params.get("q", "")
+        name = re.search(r"name='((?:[^'\\]|\\.)*)'", q)
+        contains = re.search(r"name contains '((?:[^'\\]|\\.)*)'", q)
+        parent = re.search(r"'([^']*)' in parents", q)
+        files = [f for f in self.files.values()
+                 if (not name or f["name"] == name.group(1).replace("\\'", "'"))
+                 and (not contains or contains.group(1).replace("\\'", "'") in f["name"])
+                 and (not parent or parent.group(1) in f.get("parents", []))]
+        if params.get("orderBy") == "name desc":
+            files.sort(key=lambda f: f["name"], reverse=True)
+        return files[:int(params.get("pageSize", 100))]
+
+    def _media(self, fid: str, range_header):
+        with open(os.path.join(self.root, fid), "rb") as f:
+            content = f.read()
+        size = len(content)
+        if not range_header:
+            return self._reply(200, content, content_length=size)
+        lo, hi = (int(x) for x in range_header.split("=", 1)[1].split("-"))
+        if lo >= size:
+            return self._reply(416, b"", content_range=f"bytes */{size}")
+        part = content[lo:hi + 1]
+        return self._reply(206, part, content_range=f"bytes {lo}-{lo + len(part) - 1}/{size}")
+
+    def _upload_chunk(self, session_id: str, data: bytes, headers: dict):
+        session = self.sessions[session_id]
+        session["data"] += data
+        total = headers.get("content-range", "bytes */*").rsplit("/", 1)[1]
+        if total == "*" or len(session["data"]) < int(total):
+            if not session["data"]:
+                return self._reply(308, b"")
+            return self._reply(308, b"", range=f"bytes=0-{len(session['data']) - 1}")
+        fid = session["id"] or f"f{len(self.files) + 1:05d}"
+        with open(os.path.join(self.root, fid), "wb") as f:
+            f.write(session["data"])
+        meta = self.files.get(fid, {"id": fid, "name": session["meta"].get("name", fid),
+                                    "parents": session["meta"].get("parents", [])})
+        meta.update(size=str(len(session["data"])), md5Checksum=hashlib.md5(session["data"]).hexdigest(),
+                    modifiedTime=datetime.now(timezone.utc).isoformat())
+        self.files[fid] = meta
+        del self.sessions[session_id]
+        self._save()
+        return self._reply(200, meta)
+
+def fake_drive(root: str):
+    """A Drive v3 client whose requests go to FakeDriveHttp(root)."""
+    http = FakeDriveHttp(root)
+    return pp.drive_service(http=http), http
+
+def bench_drive(root: str, size_mb: int = 3) -> list:
+    """
+    DriveTransfer against FakeDriveHttp with injected failures: transient ones (5xx,
+    403 rate limits, dropped connections, DNS) are retried and the content arrives
+    intact; fatal ones (403 permissions, local PermissionError) fail without a retry;
+    the attempt cap and the time budget give up. Asserts each outcome.
+    """
+    payload = os.urandom(size_mb * 1024 * 1024)
+    path = os.path.join(root, "drive-payload.xlsx")
+    with open(path, "wb") as f:
+        f.write(payload)
+    transient = [
+        ("none", []),
+        ("5xx", [dict(status=503, times=2), dict(status=500)]),
+        # Mid-transfer: the upload resumes from the bytes Drive confirmed, the download from its offset
+        ("5xx mid-transfer", [dict(status=503, after=2)]),
+        ("403 rate limit", [dict(status=403, reason="userRateLimitExceeded", times=2)]),
+        ("429", [dict(status=429)]),
+        ("connection reset", [dict(error=ConnectionResetError("reset by peer"), after=2)]),
+        ("dns", [dict(error=httplib2.ServerNotFoundError("Unable to find the server"))]),
+        ("timeout", [dict(error=socket.timeout("timed out"))]),
+    ]
+    results = []
+    for case, faults in transient:
+        drive, http = fake_drive(os.path.join(root, case.replace(" ", "-")))
+        http.add_folder("bench-folder")
+        for kind in ("upload", "download"):
+            for fault in faults:
+                http.fail(kind, **fault)
+        sleeps = []
+        transfer = pp.DriveTransfer(chunk_mb=1, sleep=sleeps.append)
+        (fid, data), secs = _timed(lambda: (lambda fid: (fid, transfer.download(drive, fid)))(
+            transfer.upload(drive, path, "payload.xlsx", "bench-folder")))
+        retries = sum(m["retries"] for m in transfer.metrics)
+        expected = 2 * sum(f.get("times", 1) for f in faults)
+        assert data == payload, f"drive [{case}]: downloaded content differs"
+        assert retries == expected == len(sleeps), f"drive [{case}]: {retries} retries, expected {expected}"
+        results.append({"case": f"drive [{case}]", "size": len(payload), "rows": sum(m["chunks"] for m in transfer.metrics),
+                        "seconds": secs, "retries": retries})
+
+    fatal = [
+        ("403 forbidden", dict(status=403, reason="insufficientFilePermissions"), {}, "failed"),
+        ("local PermissionError", dict(error=PermissionError("denied")), {}, "failed"),
+        ("attempt cap", dict(status=503, times=100), dict(max_attempts=3), "gave up after 3 attempts"),
+        ("time budget", dict(status=502, times=1000), dict(max_attempts=1000, max_seconds=0.3, base_delay=0.05), "gave up"),
+    ]
+    for case, fault, options, message in fatal:
+        drive, http = fake_drive(os.path.join(root, case.replace(" ", "-")))
+        http.add_folder("bench-folder")
+        http.fail("upload", **fault)
+        sleeps = []
+        # The time budget case sleeps for real: elapsed time is what it bounds
+        sleep = (lambda s: (sleeps.append(s), time.sleep(s))) if case == "time budget" else sleeps.append
+        transfer = pp.DriveTransfer(chunk_mb=1, sleep=sleep, **options)
+        t0 = time.perf_counter()
+        try:
+            transfer.upload(drive, path, "payload.xlsx", "bench-folder")
+            raise AssertionError(f"drive [{case}]: upload succeeded")
+        except pp.DriveTransferError as e:
+            assert message in str(e), f"drive [{case}]: unexpected error {e}"
+        secs = time.perf_counter() - t0
+        if message == "failed":
+            assert not sleeps, f"drive [{case}]: fatal error was retried"
+        elif case == "attempt cap":
+            assert len(sleeps) == 2, f"drive [{case}]: {len(sleeps)} backoff sleeps, expected 2"
+        else:
+            assert secs < 0.3 + 1.0, f"drive [{case}]: took {secs:.2f}s with a 0.3s budget"
+        results.append({"case": f"drive [{case}]", "size": len(payload), "rows": 0, "seconds": secs,
+                        "retries": len(sleeps)})
+    return results
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+def _collect(db, join_engine: str, batch_size: int, transform: str = "client") -> pd.DataFrame:
+    chunks = [c[pp.FINAL_COLS] for c, _ in pp.fetch_chunks(db, None, batch_size, join_engine, transform)]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=pp.FINAL_COLS)
+
+def bench_join(db, batch_size: int) -> list:
+    """Time fetch+clean with the server-side $lookup engine vs the bulk cached join."""
+    results, frames = [], {}
+    for engine in ("lookup", "bulk"):
+        frames[engine], secs = _timed(lambda: _collect(db, engine, batch_size))
+        results.append({"case": f"fetch+clean [{engine}]", "rows": len(frames[engine]), "seconds": secs})
+    pd.testing.assert_frame_equal(frames["lookup"], frames["bulk"], check_dtype=False)
+    return results
+
+def bench_flat(db, batch_size: int) -> list:
+    """
+    JOIN_ENGINE=flat: build and no-op refresh of journals_flat, fetch+clean from it vs
+    $lookup, then an incremental refresh after new journals and a renamed user / moved
+    location, and one after a journal passed by the watermark while in progress
+    finishes; rows must match the $lookup engine each time.
+    """
+    for name in (pp.FLAT_COL, f"{pp.FLAT_COL}_{pp.USERS_COL}", f"{pp.FLAT_COL}_{pp.LOCATIONS_COL}"):
+        db.drop_collection(name)
+    db[pp.STATE_COL].delete_one({"_id": pp.FLAT_COL})
+    results = []
+    for case in ("build", "noop"):
+        _, secs = _timed(lambda: pp.refresh_flat_view(db))
+        results.append({"case": f"flat refresh [{case}]", "rows": db[pp.FLAT_COL].estimated_document_count(),
+                        "seconds": secs})
+    frames = {}
+    for engine in ("lookup", "flat"):
+        frames[engine], secs = _timed(lambda: _collect(db, engine, batch_size))
+        results.append({"case": f"fetch+clean [{engine}]", "rows": len(frames[engine]), "seconds": secs})
+    pd.testing.assert_frame_equal(frames["lookup"], frames["flat"], check_dtype=False)
+
+    rng = random.Random(1)
+    users = [u["_id"] for u in db[pp.USERS_COL].find({}, {"_id": 1}).limit(5)]
+    db[pp.USERS_COL].update_many({"_id": {"$in": users}}, {"$set": {"name": "Renamed User"}})
+    db[pp.LOCATIONS_COL].update_one({}, {"$set": {"city": "Moved City"}})
+    now = datetime.now(timezone.utc)
+    db[pp.JOURNALS_COL].insert_many([
+        {**{k: v for k, v in j.items() if k != "_id"}, "_id": ObjectId.from_datetime(now + timedelta(seconds=i)),
+         "activity": rng.choice(["walk", "hike"])}
+        for i, j in enumerate(db[pp.JOURNALS_COL].find({"end_time": {"$ne": None}}).limit(100))])
+    _, secs = _timed(lambda: pp.refresh_flat_view(db))
+    results.append({"case": "flat refresh [incremental]", "rows": 100, "seconds": secs})
+    pd.testing.assert_frame_equal(_collect(db, "lookup", batch_size), _collect(db, "flat", batch_size),
+                                  check_dtype=False)
+
+    # An older journal still in progress at a refresh, finished after it
+    template = {k: v for k, v in db[pp.JOURNALS_COL].find_one({"end_time": {"$ne": None}}).items() if k != "_id"}
+    later = now + timedelta(hours=1)
+    in_progress = ObjectId.from_datetime(later)
+    db[pp.JOURNALS_COL].insert_many([{**template, "_id": in_progress, "end_time": None},
+                                     {**template, "_id": ObjectId.from_datetime(later + timedelta(seconds=1))}])
+    pp.refresh_flat_view(db)
+    db[pp.JOURNALS_COL].update_one({"_id": in_progress}, {"$set": {"end_time": later + timedelta(minutes=30)}})
+    _, secs = _timed(lambda: pp.refresh_flat_view(db))
+    results.append({"case": "flat refresh [finished late]", "rows": 1, "seconds": secs})
+    assert db[pp.FLAT_COL].count_documents({"_id": in_progress}) == 1, "journal finished late is not in the view"
+    pd.testing.assert_frame_equal(_collect(db, "lookup", batch_size), _collect(db, "flat", batch_size),
+                                  check_dtype=False)
+    return results
+
+def bench_transform(db, batch_size: int) -> list:
+    """Parity + timing of TRANSFORM=server (normalised in the pipeline) vs clean() in Python."""
+    results, frames = [], {}
+    for transform in ("client", "server"):
+        frames[transform], secs = _timed(lambda: _collect(db, "lookup", batch_size, transform))
+        results.append({"case": f"fetch+clean [{transform}]", "rows": len(frames[transform]), "seconds": secs})
+    pd.testing.assert_frame_equal(frames["client"], frames["server"], check_dtype=False)
+    return results
+
+def bench_plan(db, batch_size: int) -> list:
+    """Explain-based check that both full and incremental fetches are _id range scans."""
+    last = str(db[pp.JOURNALS_COL].find_one(sort=[("_id", 1)])["_id"])
+    results = []
+    for case, last_oid in (("plan [full]", None), ("plan [inc]", last)):
+        ok, secs = _timed(lambda: pp.check_fetch_plan(db, last_oid, batch_size))
+        assert ok, f"{case}: fetch does not use the _id index"
+        results.append({"case": case, "rows": 0, "seconds": secs})
+    return results
+
+def bench_backfill(db, uri: str, batch_size: int, workers: int = 4) -> list:
+    """Serial full fetch vs parallel_backfill over `workers` processes; asserts identical rows."""
+    serial, t_serial = _timed(lambda: _collect(db, "lookup", batch_size))
+    def parallel():
+        chunks = [c[pp.FINAL_COLS] for c, _ in pp.parallel_backfill(uri, db, workers, batch_size)]
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=pp.FINAL_COLS)
+    par, t_par = _timed(parallel)
+    pd.testing.assert_frame_equal(serial, par, check_dtype=False)
+    return [{"case": "full fetch [serial]", "rows": len(serial), "seconds": t_serial},
+            {"case": f"full fetch [{workers} workers]", "rows": len(par), "seconds": t_par}]
+
+def bench_overlap(db, batch_size: int, workers: int = 2) -> list:
+    """Sequential fetch_chunks vs the staged executor; asserts identical chunks, prints stage clocks."""
+    serial, t_serial = _timed(lambda: _collect(db, "lookup", batch_size))
+    clocks = pp.stage_clocks("fetch", "clean", "write")
+    def staged():
+        chunks = [c[pp.FINAL_COLS] for c, _ in pp.fetch_chunks_staged(db, None, batch_size, workers=workers, clocks=clocks)]
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=pp.FINAL_COLS)
+    overlapped, t_staged = _timed(staged)
+    pd.testing.assert_frame_equal(serial, overlapped, check_dtype=False)
+    for clock in clocks.values():
+        print(clock.summary())
+    return [{"case": "fetch+clean [sequential]", "rows": len(serial), "seconds": t_serial},
+            {"case": f"fetch+clean [staged x{workers}]", "rows": len(overlapped), "seconds": t_staged}]
+
+def bench_stream(db, rows: int, flush_rows: int = 500) -> list:
+    """
+    RUN_MODE=stream's change feed on a local replica set: inserts finished journals, plus
+    unfinished ones whose end_time is set afterwards, and checks every one arrives in a
+    micro-batch. Prints insert → batch latency percentiles.
+    """
+    coll = db[pp.JOURNALS_COL]
+    rng = random.Random(7)
+    users = [d["_id"] for d in db[pp.USERS_COL].find({}, {"_id": 1})]
+    locations = [d["_id"] for d in db[pp.LOCATIONS_COL].find({}, {"_id": 1})]
+    written_at, expected = {}, set()
+
+    def writer():
+        start = datetime.now(timezone.utc)
+        for i in range(rows):
+            doc = journal_doc(rng, start + timedelta(seconds=i), users, locations)
+            end = doc["end_time"] or doc["start_time"] + timedelta(minutes=30)
+            late = i % 4 == 0  # finished later: end_time arrives as an update
+            doc["end_time"] = None if late else end
+            coll.insert_one(doc)
+            if late:
+                coll.update_one({"_id": doc["_id"]}, {"$set": {"end_time": end}})
+            written_at[doc["_id"]] = time.perf_counter()
+            expected.add(doc["_id"])
+
+    thread = threading.Thread(target=writer)
+    seen, latencies = set(), []
+    t0 = time.perf_counter()
+    for batch, _ in pp.iter_change_batches(coll, None, flush_rows, flush_seconds=0.5,
+                                           max_seconds=max(30.0, rows / 100), on_open=lambda _: thread.start()):
+        now = time.perf_counter()
+        for oid in batch:
+            seen.add(oid)
+            latencies.append(now - written_at.get(oid, now))
+        if not thread.is_alive() and expected <= seen:
+            break
+    secs = time.perf_counter() - t0
+    thread.join()
+    assert expected <= seen, f"{len(expected - seen)} journals never reached a batch"
+    latencies.sort()
+    print(f"insert → batch latency: p50 {latencies[len(latencies) // 2]:.3f}s, "
+          f"p95 {latencies[int(len(latencies) * 0.95)]:.3f}s, max {latencies[-1]:.3f}s")
+    return [{"case": "stream [write → batch]", "rows": len(seen), "seconds": secs}]
+
+def _cold_seconds(code: str, repeat: int = 3) -> float:
+    """Median wall time of `code` in a fresh interpreter (nothing imported or cached yet)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    timer = f"import time; t0 = time.perf_counter(); {code}; print(time.perf_counter() - t0)"
+    times = sorted(float(subprocess.run([sys.executable, "-c", timer], cwd=here, capture_output=True,
+                                        text=True, check=True).stdout.split()[-1]) for _ in range(repeat))
+    return times[len(times) // 2]
+
+def bench_startup(uri: str = None) -> list:
+    """
+    Import time of pipeline_project (heavy dependencies lazy) vs importing them up front,
+    Drive client setup cold vs rebuilt in a warm process, and (with a mongod) a new
+    MongoClient per run vs the pooled client from pp.clients.
+    """
+    heavy = "pp.pd.DataFrame; pp.pymongo.MongoClient; pp.openpyxl.Workbook; pp.gapi_discovery.build"
+    results = [
+        {"case": "import [lazy]", "rows": 0, "seconds": _cold_seconds("import pipeline_project")},
+        {"case": "import [all dependencies]", "rows": 0,
+         "seconds": _cold_seconds(f"import pipeline_project as pp; {heavy}")},
+        {"case": "drive client [cold]", "rows": 0,
+         "seconds": _cold_seconds("import httplib2, pipeline_project as pp; pp.drive_service(http=httplib2.Http())")},
+    ]
+    _, secs = _timed(lambda: pp.drive_service(http=httplib2.Http()))
+    results.append({"case": "drive client [rebuild]", "rows": 0, "seconds": secs})
+    if uri:
+        def fresh():
+            client = MongoClient(uri, tz_aware=True)
+            client.admin.command("ping")
+            client.close()
+        _, secs = _timed(fresh)
+        results.append({"case": "mongo connect+ping [new]", "rows": 0, "seconds": secs})
+        pp.clients.mongo(uri).admin.command("ping")
+        _, secs = _timed(lambda: pp.clients.mongo(uri).admin.command("ping"))
+        results.append({"case": "mongo connect+ping [pooled]", "rows": 0, "seconds": secs})
+        pp.clients.close()
+    return results
+
+def raw_chunks(rows: int, batch_size: int, rng_seed: int = 0):
+    """
+    PROJECT_COLS chunks as iter_raw_chunks yields them, without a database (for sizes a
+    scratch mongod would take long to seed). Users and locations come from the same
+    generators as seed(); every string is a fresh object, as when BSON is decoded.
+    """
+    rng = random.Random(rng_seed)
+    users = [pp._user_row({"name": f"User {i}", "email": f"user{i}@example.com"})
+             for i in range(max(1, rows // 20))]
+    places = [pp._location_row(location_doc(rng, i)) for i in range(max(1, rows // 50))]
+    fresh = lambda row: {k: v.encode().decode() if isinstance(v, str) else v for k, v in row.items()}
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for lo in range(0, rows, batch_size):
+        docs = []
+        for i in range(lo, min(lo + batch_size, rows)):
+            t = start + timedelta(minutes=7 * i)
+            minutes = rng.randint(5, 180)
+            docs.append({"journal_id": str(ObjectId.from_datetime(t)), "Timestamp": t,
+                         "End Date Time": t + timedelta(minutes=minutes), "n_Duration": float(minutes),
+                         **fresh(rng.choice(users)), **fresh(rng.choice(places)),
+                         "n_activity": rng.choice(["walk", "hike", "sit", "bird watching", ""]).encode().decode(),
+                         "n_notes": rng.choice(["", "Saw a heron", "Windy, 12°C", f"Visit {i}"]).encode().decode()})
+        yield pd.DataFrame(docs, columns=pp.PROJECT_COLS)
+
+def _assemble(rows: int, batch_size: int, compact: bool) -> pd.DataFrame:
+    """run_once's path from raw chunks to the output frame and its _keys."""
+    chunks = []
+    for raw in raw_chunks(rows, batch_size):
+        cleaned = pp.clean(raw)
+        if compact:
+            pp.compact_frame(cleaned, pp.STAGING_COLS)
+        chunks.append(cleaned[pp.STAGING_COLS])
+    out = pp.concat_frames(chunks)
+    chunks = None
+    pp.output_keys(out)
+    return out
+
+def _memory_run(rows: int, batch_size: int, compact: bool) -> dict:
+    """One mode in this (fresh) process: peak RSS and the output frame's own size."""
+    out, secs = _timed(lambda: _assemble(rows, batch_size, compact))
+    return {"seconds": secs, "peak_rss_mb": pp._peak_rss_mb(),
+            "frame_mb": round(out.memory_usage(deep=True).sum() / 2 ** 20, 1)}
+
+def bench_memory(rows: int, batch_size: int) -> list:
+    """
+    Peak RSS of cleaning and assembling `rows` rows with object columns vs COMPACT_FRAMES,
+    each in a fresh interpreter; first asserts that both give the same workbook values.
+    """
+    small = {compact: _assemble(min(rows, 5000), batch_size, compact) for compact in (False, True)}
+    assert pp.row_hashes(small[False]).equals(pp.row_hashes(small[True])), "COMPACT_FRAMES changes row hashes"
+    with tempfile.TemporaryDirectory(prefix="nc-bench-mem-") as tmp:
+        written = []
+        for compact, out in small.items():
+            path = os.path.join(tmp, f"{compact}.xlsx")
+            pp.write_output(path, out[pp.FINAL_COLS], None)
+            written.append(pd.read_excel(path, dtype=object))
+        pd.testing.assert_frame_equal(*written)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for compact in (False, True):
+        code = f"import json, pipeline_bench as b; print(json.dumps(b._memory_run({rows}, {batch_size}, {compact})))"
+        out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True)
+        run = json.loads(out.stdout.split("\n")[-2])
+        results.append({"case": f"clean+assemble [{'compact' if compact else 'object'}]", "rows": rows, **run})
+    return results
+
+def _write_excel(path: str, rows: int, batch_size: int, writer: str) -> None:
+    """Rewrite-mode serialisation of `rows` fresh rows: one to_excel of the assembled
+    frame (OUTPUT_WRITER=frame) or chunk by chunk through StreamingOutputWriter."""
+    last_oid = str(ObjectId())
+    if writer == "frame":
+        out = _assemble(rows, batch_size, False)
+        pp.write_output(path, out[pp.FINAL_COLS], last_oid, pp.output_keys(out))
+        return
+    stream = pp.StreamingOutputWriter(path)
+    for raw in raw_chunks(rows, batch_size):
+        stream.write(pp.clean(raw)[pp.STAGING_COLS])
+    stream.close(last_oid)
+
+def _excel_run(rows: int, batch_size: int, writer: str) -> dict:
+    """One writer in this (fresh) process: time and peak RSS of clean + serialise."""
+    with tempfile.TemporaryDirectory(prefix="nc-bench-xlsx-") as tmp:
+        path = os.path.join(tmp, "out.xlsx")
+        _, secs = _timed(lambda: _write_excel(path, rows, batch_size, writer))
+        return {"seconds": secs, "peak_rss_mb": pp._peak_rss_mb()}
+
+def bench_excel(sizes: list, batch_size: int) -> list:
+    """
+    OUTPUT_WRITER=frame (to_excel of the whole frame) vs stream (openpyxl write_only,
+    chunk by chunk), each size and writer in a fresh interpreter; first asserts that
+    both give the same sheets apart from the random watermark.
+    """
+    with tempfile.TemporaryDirectory(prefix="nc-bench-xlsx-") as tmp:
+        sheets = []
+        for writer in ("frame", "stream"):
+            path = os.path.join(tmp, f"{writer}.xlsx")
+            _write_excel(path, min(min(sizes), 5000), min(batch_size, 1000), writer)
+            sheets.append(pd.read_excel(path, sheet_name=None, dtype=object))
+        assert list(sheets[0]) == list(sheets[1]), "writers produce different sheets"
+        for name in ("Sheet1", pp.KEYS_SHEET):
+            pd.testing.assert_frame_equal(sheets[0][name], sheets[1][name])
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for rows in sizes:
+        for writer in ("frame", "stream"):
+            code = f"import json, pipeline_bench as b; print(json.dumps(b._excel_run({rows}, {batch_size}, {writer!r})))"
+            out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True)
+            run = json.loads(out.stdout.split("\n")[-2])
+            results.append({"case": f"clean+xlsx [{writer}]", "rows": rows, **run})
+    return results
+
+def bench_summary(rows: int, batch_size: int) -> list:
+    """
+    SUMMARY_SHEETS: full recompute over `rows` history rows plus one new batch vs folding
+    only the batch into the stored aggregates; asserts both give the same tables.
+    """
+    chunks = [pp.clean(raw)[pp.STAGING_COLS] for raw in raw_chunks(rows + batch_size, batch_size)]
+    history, batch = pd.concat(chunks[:-1], ignore_index=True), chunks[-1]
+    stored = pp.summarise(history)
+    full, full_secs = _timed(lambda: pp.summarise(pd.concat([history, batch], ignore_index=True)))
+    inc, inc_secs = _timed(lambda: pp.combine_summaries(stored, pp.summarise(batch)))
+    for sheet in pp.SUMMARY_SHEETS:
+        pd.testing.assert_frame_equal(full[sheet], inc[sheet], check_dtype=False)
+    return [{"case": "summary [full]", "rows": rows + len(batch), "seconds": full_secs},
+            {"case": "summary [incremental]", "rows": len(batch), "seconds": inc_secs}]
+
+def country_inputs(n: int, noise_ratio: float = 0.0, rng_seed: int = 0):
+    """(address, state, loc_country) Series of real-shaped values, a `noise_ratio` share random."""
+    rng = random.Random(rng_seed)
+    noise = list("abcxyzCANYTXal ,.-_0123456789\t\néßıÉ") + ["CA", "ny", "Tx", "US", "u.s."]
+    def rand():
+        return "".join(rng.choice(noise) for _ in range(rng.randint(0, 12)))
+    addresses = ["123 Main St, Austin, TX 78701", "Toronto, ON M5V", "Park 4, City 7 ", "1 Rue de Paris, Lyon",
+                 "ca90210", "", None] + [f"{i} Trail Rd, Springfield {rng.choice(sorted(pp.US_STATES))}" for i in range(500)]
+    states = ["CA", " ny ", "ON", "", "BC", None]
+    countries = ["", "US", " usa ", "Canada", "United States of America", "U.S.", "None", None]
+    cols = ([], [], [])
+    for _ in range(n):
+        real = rng.random() >= noise_ratio
+        for col, pool in zip(cols, (addresses, states, countries)):
+            col.append(rng.choice(pool) if real else rand())
+    return tuple(pd.Series(c, dtype=object) for c in cols)
+
+def bench_country(rows: int) -> list:
+    """decide_country per row vs decide_country_vec; asserts identical output."""
+    # Property check on random + real-shaped inputs
+    address, state, loc_country = country_inputs(min(rows, 100000), noise_ratio=0.5, rng_seed=1)
+    expected = [pp.decide_country(a, s, c) for a, s, c in zip(address, state, loc_country)]
+    mismatches = [i for i, (a, b) in enumerate(zip(expected, pp.decide_country_vec(address, state, loc_country))) if a != b]
+    assert not mismatches, f"decide_country_vec differs at rows {mismatches[:10]}"
+
+    address, state, loc_country = country_inputs(rows)
+    scalar, t_scalar = _timed(lambda: [pp.decide_country(a, s, c) for a, s, c in zip(address, state, loc_country)])
+    vec, t_vec = _timed(lambda: pp.decide_country_vec(address, state, loc_country))
+    assert scalar == vec.tolist()
+    return [{"case": "decide_country [scalar]", "rows": rows, "seconds": t_scalar},
+            {"case": "decide_country [vectorised]", "rows": rows, "seconds": t_vec}]
+
+def bench_suite(db, sizes: list, join_engine: str, batch_size: int, drive_root: str) -> list:
+    """
+    Per size: seed, then time the fetch (agg_pipeline / bulk join + paging), clean,
+    decide_country, Excel serialisation and the watermark round-trip through Drive
+    (upload, then a fresh DriveWorkbook download + watermark read).
+    """
+    drive, http = fake_drive(drive_root)
+    path = os.path.join(drive_root, "bench-out.xlsx")
+    results = []
+    for size in sizes:
+        seed(db, size)
+
+        def fetch_raw():
+            chunks, last = [], None
+            for raw, last in pp.iter_raw_chunks(db, None, batch_size, join_engine):
+                chunks.append(raw)
+            return pd.concat(chunks, ignore_index=True), last
+        (raw, last_oid), secs = _timed(fetch_raw)
+        results.append({"case": f"fetch [{join_engine}]", "size": size, "rows": len(raw), "seconds": secs})
+
+        out, secs = _timed(lambda: pp.clean(raw))
+        results.append({"case": "clean", "size": size, "rows": len(out), "seconds": secs})
+
+        _, secs = _timed(lambda: pp.decide_country_vec(raw["Address"], raw["State"], raw["LocCountry"]))
+        results.append({"case": "decide_country", "size": size, "rows": len(raw), "seconds": secs})
+
+        _, secs = _timed(lambda: pp.write_output(path, out[pp.FINAL_COLS], last_oid))
+        results.append({"case": "excel write", "size": size, "rows": len(out), "seconds": secs})
+
+        def round_trip():
+            name = f"bench-{size}.xlsx"
+            pp.upload_excel(drive, path, name, "bench-folder")
+            book = pp.DriveWorkbook(drive, name, "bench-folder")
+            try:
+                return book.watermark()
+            finally:
+                book.close()
+        requests_before = http.requests
+        watermark, secs = _timed(round_trip)
+        assert watermark == last_oid, f"watermark round-trip returned {watermark}, expected {last_oid}"
+        results.append({"case": "watermark round-trip", "size": size, "rows": len(out), "seconds": secs,
+                        "drive_requests": http.requests - requests_before})
+    return results
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def save_results(path: str, results: list, **meta) -> None:
+    """Results plus the commit they were measured at, for --compare in a later run."""
+    doc = dict(meta, commit=_git_commit(), created_at=datetime.now(timezone.utc).isoformat(), results=results)
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2)
+
+def load_baseline(path: str) -> dict:
+    with open(path) as f:
+        doc = json.load(f)
+    print(f"Baseline: {path} (commit {doc.get('commit') or '?'}, {doc.get('created_at', '?')})")
+    return {(r["case"], r.get("size", r["rows"])): r["seconds"] for r in doc["results"]}
+
+def _print_table(results: list, baseline: dict = None) -> None:
+    memory = any("peak_rss_mb" in r for r in results)
+    frames = any("frame_mb" in r for r in results)
+    retries = any("retries" in r for r in results)
+    header = f"{'case':<32} {'size':>9} {'rows':>10} {'seconds':>10} {'rows/s':>12}"
+    header += f" {'peak MB':>9}" if memory else ""
+    header += f" {'frame MB':>9}" if frames else ""
+    header += f" {'retries':>9}" if retries else ""
+    print(header + (f" {'vs base':>9}" if baseline else ""))
+    for r in results:
+        size = r.get("size", r["rows"])
+        rate = r["rows"] / r["seconds"] if r["seconds"] else 0.0
+        line = f"{r['case']:<32} {size:>9} {r['rows']:>10} {r['seconds']:>10.3f} {rate:>12.0f}"
+        if memory:
+            line += f" {r.get('peak_rss_mb') or 0:>9.1f}"
+        if frames:
+            line += f" {r.get('frame_mb') or 0:>9.1f}"
+        if retries:
+            line += f" {r.get('retries', 0):>9}"
+        if baseline:
+            base = baseline.get((r["case"], size))
+            line += f" {r['seconds'] / base:>8.2f}x" if base else f" {'-':>9}"
+        print(line)
+
+def main():
+    ap = argparse.ArgumentParser(description="Nature Counter pipeline benchmarks")
+    ap.add_argument("bench", choices=["suite", "join", "plan", "country", "transform", "backfill", "overlap", "stream",
+                                      "startup", "memory", "excel", "flat", "summary", "drive"])
+    ap.add_argument("--rows", type=int, default=10000)
+    ap.add_argument("--sizes", default="10000,100000,1000000", help="suite/excel: comma-separated journal counts")
+    ap.add_argument("--backend", choices=["mongod", "mongomock"], default="mongod")
+    ap.add_argument("--join-engine", choices=["lookup", "bulk"], default="lookup", help="suite: fetch engine")
+    ap.add_argument("--batch-size", type=int, default=pp.FETCH_BATCH_SIZE)
+    ap.add_argument("--workers", type=int, default=4, help="processes (backfill) / clean threads (overlap)")
+    ap.add_argument("--no-seed", action="store_true", help="reuse the already seeded database")
+    ap.add_argument("--json", help="write results (with the git commit) to this file")
+    ap.add_argument("--compare", help="results file of an earlier run to compare against")
+    args = ap.parse_args()
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    if args.bench == "country":
+        results = bench_country(args.rows)
+    elif args.bench == "memory":
+        results = bench_memory(args.rows, args.batch_size)
+    elif args.bench == "summary":
+        results = bench_summary(args.rows, args.batch_size)
+    elif args.bench == "drive":
+        with tempfile.TemporaryDirectory(prefix="nc-bench-drive-") as drive_root:
+            results = bench_drive(drive_root)
+    elif args.bench == "excel":
+        results = bench_excel([int(s) for s in args.sizes.split(",") if s.strip()], args.batch_size)
+    elif args.bench == "startup":
+        results = bench_startup(os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017")
+                                if args.backend == "mongod" else None)
+    elif args.bench == "suite":
+        join_engine = args.join_engine
+        if args.backend == "mongomock" and join_engine == "lookup":
+            print("mongomock has no $convert: using --join-engine bulk")
+            join_engine = "bulk"
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        with tempfile.TemporaryDirectory(prefix="nc-bench-drive-") as drive_root:
+            results = bench_suite(connect(args.backend), sizes, join_engine, args.batch_size, drive_root)
+    else:
+        if args.backend != "mongod":
+            raise SystemExit(f"{args.bench} needs a mongod ($lookup/$convert); use suite or country with mongomock")
+        uri = os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017")
+        db = connect(args.backend)
+        if not args.no_seed:
+            seed(db, args.rows)
+        if args.bench == "stream":
+            results = bench_stream(db, args.rows)
+        elif args.bench == "join":
+            results = bench_join(db, args.batch_size)
+        elif args.bench == "transform":
+            results = bench_transform(db, args.batch_size)
+        elif args.bench == "flat":
+            results = bench_flat(db, args.batch_size)
+        elif args.bench == "backfill":
+            results = bench_backfill(db, uri, args.batch_size, args.workers)
+        elif args.bench == "overlap":
+            results = bench_overlap(db, args.batch_size, args.workers)
+        else:
+            results = bench_plan(db, args.batch_size)
+
+    _print_table(results, baseline)
+    if args.json:
+        save_results(args.json, results, bench=args.bench, backend=args.backend)
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@
 # Set these in your environment or .env file (DO NOT commit credentials!)
 
 import os
-from pipeline_project import run_once
+from pipeline_project import load_targets, run_batch, run_once
 
 # --- Load from environment variables (SECURE) ---
 # Example setup:
@@ -24,8 +24,12 @@ DRIVE_SA_JSON   = os.getenv("DRIVE_SA_JSON", "")
 OUTPUT_NAME     = os.getenv("OUTPUT_NAME", "NC-DA-Journal-Data.xlsx")
 RUN_MODE        = os.getenv("RUN_MODE", "inc")   # "full" or "inc"
 
+# Optional: JSON list of targets (NAME, DB_NAME, JOURNAL_FILTER, DRIVE_FOLDER_ID, OUTPUT_NAME)
+# run concurrently in this process; the settings above are their defaults.
+TARGETS_PATH    = os.getenv("TARGETS_PATH", "")
+
 if __name__ == "__main__":
-    if not MONGO_URI or not DRIVE_FOLDER_ID:
+    if not MONGO_URI or not (DRIVE_FOLDER_ID or TARGETS_PATH):
         print("ERROR: MONGO_URI and DRIVE_FOLDER_ID must be set in environment variables!")
         print("Example:")
         print('  export MONGO_URI="mongodb+srv://..."')
@@ -40,4 +44,7 @@ if __name__ == "__main__":
         "SA_JSON_PATH": SA_JSON_PATH,
         "DRIVE_SA_JSON": DRIVE_SA_JSON,
     }
+    if TARGETS_PATH:
+        results = run_batch(load_targets({"TARGETS_PATH": TARGETS_PATH}), cfg)
+        exit(1 if any(r["status"] == "FAILED" for r in results) else 0)
     run_once(cfg)
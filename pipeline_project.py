@@ -9,24 +9,87 @@
 #     (C) else blank
 # - Modes: cfg["RUN_MODE"] == "full" (backfill) or "inc" (incremental)
 
+from __future__ import annotations
+
+import abc
+import importlib
+import importlib.util
 import io
 import os
 import json
+import hashlib
 import logging
+import random
 import re
-from typing import Optional, Tuple, Dict
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+import multiprocessing
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional, Tuple, Dict, Iterator, List, Callable
 
-import pandas as pd
-from pymongo import MongoClient
 from bson import ObjectId
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
+
+class _LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name, self._module = name, None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# pandas, pymongo, openpyxl and googleapiclient make up most of the import time;
+# they load when a run first needs them, not when this module (or a spawn worker) is imported
+pd = _LazyModule("pandas")
+openpyxl = _LazyModule("openpyxl")
+pymongo = _LazyModule("pymongo")
+pymongo_errors = _LazyModule("pymongo.errors")
+service_account = _LazyModule("google.oauth2.service_account")
+gapi_discovery = _LazyModule("googleapiclient.discovery")
+gapi_errors = _LazyModule("googleapiclient.errors")
+gapi_http = _LazyModule("googleapiclient.http")
+google_auth_errors = _LazyModule("google.auth.exceptions")
+httplib2 = _LazyModule("httplib2")
+bson_json = _LazyModule("bson.json_util")
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 log = logging.getLogger("nc-pipeline")
 
+# Per-thread run context: the target a batch worker is running (prefixed to its log
+# lines) and the report of the last run_once on this thread
+_run_context = threading.local()
+
+class _TargetLogFilter(logging.Filter):
+    def filter(self, record):
+        target = getattr(_run_context, "target", None)
+        if target:
+            record.msg = f"[{target}] {record.msg}"
+        return True
+
+log.addFilter(_TargetLogFilter())
+
+def _in_run_context(fn):
+    """`fn` for a worker thread: it logs with the calling thread's target prefix."""
+    target = getattr(_run_context, "target", None)
+
+    def run(*args, **kwargs):
+        _run_context.target = target
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _run_context.target = None
+    return run
+
 DB_NAME = "NC_dev_db"
 JOURNALS_COL, USERS_COL, LOCATIONS_COL = "journals", "userdetails", "locations"
 
@@ -35,6 +98,16 @@ AL AK AZ AR CA CO CT DC DE FL GA HI ID IL IN IA KS KY LA MA MD ME MI MN MO MS MT
 NC ND NE NH NJ NM NV NY OH OK OR PA RI SC SD TN TX UT VA VT WA WI WV WY PR GU VI
 """.split())
 
+US_COUNTRY_NAMES = {"US", "USA", "U.S.", "UNITED STATES", "UNITED STATES OF AMERICA"}
+
+# A US state code as a whole token of an upper-cased address (tokens are runs of letters).
+# Alternation is grouped by first letter (AL|AK|AR|AZ → A[KLRZ]) so non-matches fail fast.
+_STATE_ALTERNATION = "|".join(
+    first + "[" + "".join(sorted(c[1] for c in US_STATES if c[0] == first)) + "]"
+    for first in sorted({c[0] for c in US_STATES})
+)
+US_STATE_TOKEN_RE = re.compile(r"(?<![A-Za-z])(?:" + _STATE_ALTERNATION + r")(?![A-Za-z])")
+
 # Updated Columns per user request
 FINAL_COLS = [
     "Status", "User Name", "User email", "Timestamp", "n_Duration", "End Date Time",
@@ -42,12 +115,40 @@ FINAL_COLS = [
     "n_park_nbr", "n_activity", "n_notes"
 ]
 
+# Documents per cursor batch / DataFrame chunk. Peak memory of a fetch is bounded
+# by this, not by the size of the collection.
+FETCH_BATCH_SIZE = 5000
+
+# Columns emitted by agg_pipeline's $project stage (and by the bulk join engine), in order
+PROJECT_COLS = [
+    "journal_id", "Timestamp", "End Date Time", "n_Duration", "User Name", "User email",
+    "n_Name", "City", "State", "Zip", "LocCountry", "Address", "n_Place",
+    "n_Lati", "n_Long", "n_park_nbr", "n_activity", "n_notes"
+]
+
+# Bulk join engine: fields pulled per collection and LRU size of the dimension caches
+JOURNAL_FIELDS  = {"_id": 1, "uid": 1, "locationId": 1, "start_time": 1, "end_time": 1, "activity": 1, "notes": 1}
+USER_FIELDS     = {"name": 1, "email": 1}
+LOCATION_FIELDS = {"name": 1, "city": 1, "stateInitials": 1, "state": 1, "zip": 1, "country": 1,
+                   "address": 1, "coordinates": 1, "parkNumber": 1, "category": 1}
+DIM_CACHE_SIZE = 50000
+
 def _require(cfg: Dict, key: str) -> str:
     v = cfg.get(key) or os.getenv(key)
     if not v:
         raise SystemExit(f"Missing required setting: {key}")
     return v
 
+def _setting(cfg: Dict, key: str, default: str = "") -> str:
+    return cfg.get(key) or os.getenv(key, default)
+
+def _journal_filter(cfg: Dict) -> Optional[dict]:
+    """JOURNAL_FILTER: a dict in cfg, or MongoDB Extended JSON (so {"$oid": ...} works) in cfg/env."""
+    v = cfg.get("JOURNAL_FILTER") or os.getenv("JOURNAL_FILTER", "")
+    if isinstance(v, dict):
+        return v or None
+    return bson_json.loads(v) if v.strip() else None
+
 def _ensure_sa_file(cfg: Dict) -> str:
     """
     Returns path to service account JSON.
@@ -57,17 +158,87 @@ def _ensure_sa_file(cfg: Dict) -> str:
     sa_inline = cfg.get("DRIVE_SA_JSON") or os.getenv("DRIVE_SA_JSON")
     sa_path   = cfg.get("SA_JSON_PATH")  or os.getenv("SA_JSON_PATH", "drive-sa.json")
     if sa_inline:
-        with open(sa_path, "w") as f:
-            f.write(sa_inline)
+        # Unchanged content is not rewritten: concurrent runs (run_batch) may be reading it
+        current = None
+        if os.path.exists(sa_path):
+            with open(sa_path) as f:
+                current = f.read()
+        if current != sa_inline:
+            with open(sa_path, "w") as f:
+                f.write(sa_inline)
     if not os.path.exists(sa_path):
         raise SystemExit(f"Service account JSON not found at SA_JSON_PATH: {sa_path}")
     return sa_path
 
-def _drive_client(sa_path: str):
-    creds = Credentials.from_service_account_file(sa_path, scopes=["https://www.googleapis.com/auth/drive"])
-    drive = build("drive", "v3", credentials=creds)
-    sa_email = json.load(open(sa_path))["client_email"]
-    return drive, sa_email
+def drive_service(credentials=None, http=None):
+    """Drive v3 client built from the discovery document bundled with googleapiclient (no fetch, no cache file)."""
+    return gapi_discovery.build("drive", "v3", credentials=credentials, http=http,
+                                static_discovery=True, cache_discovery=False)
+
+def _drive_credentials(sa_path: str):
+    creds = service_account.Credentials.from_service_account_file(sa_path, scopes=["https://www.googleapis.com/auth/drive"])
+    with open(sa_path) as f:
+        sa_email = json.load(f)["client_email"]
+    return creds, sa_email
+
+# --- Clients (built once per process, shared by every run) ---
+
+# Wire compressors pymongo supports, and the module each needs (pymongo warns about missing ones)
+MONGO_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+def available_compressors(wanted: str) -> str:
+    """The compressors of comma-separated `wanted` whose module is installed, in order."""
+    names = [c.strip().lower() for c in wanted.split(",") if c.strip()]
+    return ",".join(c for c in names if c in MONGO_COMPRESSOR_MODULES
+                    and importlib.util.find_spec(MONGO_COMPRESSOR_MODULES[c]))
+
+class ClientManager:
+    """
+    Lazily built Mongo and Drive clients, reused by every run in the process (a scheduler
+    loop, stream mode's catch-up runs, backfills by range) instead of reconnecting and
+    rebuilding the Drive service per call. MongoClient is thread-safe and pools its
+    connections. A Drive service's HTTP transport is not, so each thread gets its own
+    service on the same credentials (one access token for all of them).
+    """
+
+    def __init__(self):
+        self._mongo = {}
+        self._drive = {}
+        self._credentials = {}
+        self._lock = threading.Lock()
+
+    def mongo(self, uri: str, max_pool_size: int = 10, compressors: str = "zstd,snappy"):
+        key = (uri, max_pool_size, compressors)
+        with self._lock:
+            if key not in self._mongo:
+                options = {"tz_aware": True, "maxPoolSize": max_pool_size}
+                if available_compressors(compressors):
+                    options["compressors"] = available_compressors(compressors)
+                self._mongo[key] = pymongo.MongoClient(uri, **options)
+            return self._mongo[key]
+
+    def drive(self, sa_path: str):
+        """(drive, service account email) for the service account file `sa_path`, for this thread."""
+        key = (sa_path, threading.get_ident())
+        with self._lock:
+            if key not in self._drive:
+                if sa_path not in self._credentials:
+                    self._credentials[sa_path] = _drive_credentials(sa_path)
+                creds, sa_email = self._credentials[sa_path]
+                self._drive[key] = (drive_service(creds), sa_email)
+            return self._drive[key]
+
+    def close(self):
+        with self._lock:
+            for client in self._mongo.values():
+                client.close()
+            for drive, _ in self._drive.values():
+                drive.close()
+            self._mongo.clear()
+            self._drive.clear()
+            self._credentials.clear()
+
+clients = ClientManager()
 
 def _escape_q(s: str) -> str:
     return s.replace("'", "\\'")
@@ -77,43 +248,347 @@ def find_file_id(drive, name: str, folder: str) -> Optional[str]:
     r = drive.files().list(q=q, fields="files(id)", pageSize=1).execute()
     return r["files"][0]["id"] if r.get("files") else None
 
-def upload_excel(drive, local_path: str, dest_name: str, folder: str) -> None:
-    fid = find_file_id(drive, dest_name, folder)
-    media = MediaFileUpload(local_path, mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", resumable=True)
-    req = drive.files().update(fileId=fid, media_body=media) if fid else \
-          drive.files().create(body={"name": dest_name, "parents": [folder]}, media_body=media, fields="id")
-    while True:
-        try:
-            _, resp = req.next_chunk()
-            if resp:
+# --- Drive Transfers (bounded retries) ---
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DRIVE_RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+DRIVE_RETRY_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "backendError", "internalError"}
+
+class DriveTransferError(Exception):
+    pass
+
+def _transport_errors() -> tuple:
+    """Network-level failures: dropped connections, timeouts, DNS and token-refresh transport errors.
+    Other OSErrors (a missing file, no permission) are local and fatal."""
+    return (ConnectionError, TimeoutError, socket.timeout, socket.gaierror, socket.herror,
+            httplib2.ServerNotFoundError, google_auth_errors.TransportError)
+
+def _is_retryable(e: Exception) -> bool:
+    """Transient: 408/429/5xx, 403 rate limits, and network-level errors. Everything else is fatal."""
+    if isinstance(e, gapi_errors.HttpError):
+        if int(e.resp.status) in DRIVE_RETRY_STATUSES:
+            return True
+        reasons = {d.get("reason") for d in (e.error_details or []) if isinstance(d, dict)}
+        return int(e.resp.status) == 403 and bool(reasons & DRIVE_RETRY_REASONS)
+    return isinstance(e, _transport_errors())
+
+class DriveTransfer:
+    """
+    Drives a resumable upload/download chunk by chunk. Transient errors are retried
+    with exponential backoff and full jitter, bounded by `max_attempts` consecutive
+    failures and `max_seconds` per transfer; fatal errors (e.g. 403/404) fail at once.
+    Per-transfer metrics (bytes, chunks, retries, seconds) are kept in `self.metrics`.
+    """
+
+    def __init__(self, max_attempts: int = 6, max_seconds: float = 300.0, chunk_mb: int = 8,
+                 base_delay: float = 1.0, max_delay: float = 32.0, sleep=time.sleep):
+        self.max_attempts = max_attempts
+        self.max_seconds = max_seconds
+        # Resumable chunks must be a multiple of 256 KiB
+        self.chunksize = max(1, chunk_mb * 4) * 256 * 1024
+        self.base_delay, self.max_delay = base_delay, max_delay
+        self.sleep = sleep
+        self.metrics = []
+
+    @classmethod
+    def from_cfg(cls, cfg: Dict) -> "DriveTransfer":
+        return cls(max_attempts=int(_setting(cfg, "DRIVE_MAX_ATTEMPTS", "6")),
+                   max_seconds=float(_setting(cfg, "DRIVE_MAX_SECONDS", "300")),
+                   chunk_mb=int(_setting(cfg, "DRIVE_CHUNK_MB", "8")))
+
+    def _run(self, kind: str, name: str, next_chunk, nbytes):
+        start = time.monotonic()
+        m = {"kind": kind, "name": name, "bytes": 0, "chunks": 0, "retries": 0, "seconds": 0.0}
+        failures = 0
+        while True:
+            try:
+                _, result = next_chunk()
+            except Exception as e:
+                elapsed = time.monotonic() - start
+                if not _is_retryable(e):
+                    raise DriveTransferError(f"Drive {kind} of {name} failed: {e}") from e
+                failures += 1
+                m["retries"] += 1
+                if failures >= self.max_attempts or elapsed >= self.max_seconds:
+                    raise DriveTransferError(
+                        f"Drive {kind} of {name} gave up after {failures} attempts / {elapsed:.0f}s: {e}") from e
+                delay = min(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (failures - 1))),
+                            self.max_seconds - elapsed)
+                log.warning("Drive %s retry %d/%d in %.1fs: %s", kind, failures, self.max_attempts, delay, e)
+                self.sleep(delay)
+                continue
+            failures = 0
+            m["chunks"] += 1
+            if result:
                 break
-        except HttpError as e:
-            log.warning("Drive upload retry: %s", e)
-
-def download_excel(drive, name: str, folder: str) -> pd.DataFrame:
-    fid = find_file_id(drive, name, folder)
-    if not fid:
-        return pd.DataFrame()
-    buf = io.BytesIO()
-    req = drive.files().get_media(fileId=fid)
-    downloader = MediaIoBaseDownload(buf, req)
-    done = False
-    while True:
+        m["bytes"], m["seconds"] = nbytes(), round(time.monotonic() - start, 3)
+        self.metrics.append(m)
+        log.info("Drive %s %s: %d bytes, %d chunks, %d retries, %.2fs",
+                 kind, name, m["bytes"], m["chunks"], m["retries"], m["seconds"])
+        return result
+
+    def upload(self, drive, local_path: str, dest_name: str, folder: str, file_id: Optional[str] = None) -> str:
+        """Create or update `dest_name` in `folder`; returns the Drive file id."""
+        media = gapi_http.MediaFileUpload(local_path, mimetype=XLSX_MIME, resumable=True, chunksize=self.chunksize)
+        req = drive.files().update(fileId=file_id, media_body=media) if file_id else \
+              drive.files().create(body={"name": dest_name, "parents": [folder]}, media_body=media, fields="id")
+        resp = self._run("upload", dest_name, req.next_chunk, lambda: os.path.getsize(local_path))
+        return resp.get("id", file_id)
+
+    def download(self, drive, fid: str, name: str = "") -> bytes:
+        buf = io.BytesIO()
+        downloader = gapi_http.MediaIoBaseDownload(buf, drive.files().get_media(fileId=fid), chunksize=self.chunksize)
+        self._run("download", name or fid, downloader.next_chunk, lambda: buf.tell())
+        return buf.getvalue()
+
+def upload_excel(drive, local_path: str, dest_name: str, folder: str, file_id: Optional[str] = None,
+                 transfer: Optional[DriveTransfer] = None) -> str:
+    """Create or update `dest_name` in `folder`; returns the Drive file id."""
+    fid = file_id or find_file_id(drive, dest_name, folder)
+    return (transfer or DriveTransfer()).upload(drive, local_path, dest_name, folder, fid)
+
+def partition_name(output_name: str, when: datetime) -> str:
+    """Monthly partition of the output file, e.g. NC-DA-Journal-Data-2026-10.xlsx."""
+    stem, ext = os.path.splitext(output_name)
+    return f"{stem}-{when:%Y-%m}{ext}"
+
+def find_latest_partition(drive, output_name: str, folder: str) -> Optional[Tuple[str, str]]:
+    """(name, id) of the newest monthly partition of `output_name` in `folder`, if any."""
+    stem, ext = os.path.splitext(output_name)
+    q = f"name contains '{_escape_q(stem)}-' and '{folder}' in parents and trashed=false"
+    r = drive.files().list(q=q, fields="files(id,name)", orderBy="name desc", pageSize=100).execute()
+    pattern = re.compile(re.escape(stem) + r"-\d{4}-\d{2}" + re.escape(ext) + "$")
+    for f in r.get("files", []):
+        if pattern.match(f["name"]):
+            return f["name"], f["id"]
+    return None
+
+# Drive metadata that identifies a workbook version in the local cache
+WORKBOOK_META_FIELDS = "id,name,headRevisionId,modifiedTime,md5Checksum"
+
+class DriveWorkbook:
+    """
+    Run-scoped handle on the output workbook in Drive.
+    Resolves the file id once, downloads the bytes once (kept in memory) and loads
+    them once with openpyxl; the watermark and the data sheet both come from that load.
+    With `cache_dir`, the last downloaded or uploaded version is kept on disk together
+    with its Drive metadata (WORKBOOK_META_FIELDS). A single files().get on the cached
+    file id then tells whether that copy is still current, so an unchanged workbook
+    is neither looked up by name nor downloaded again.
+    """
+
+    def __init__(self, drive, name: str, folder: str, transfer: Optional[DriveTransfer] = None,
+                 cache_dir: Optional[str] = None):
+        self.drive, self.name, self.folder = drive, name, folder
+        self.transfer = transfer or DriveTransfer()
+        self.cache_dir = cache_dir
+        self._file_id = None
+        self._meta = None
+        self._resolved = False
+        self._content = None
+        self._book = None
+
+    @property
+    def file_id(self) -> Optional[str]:
+        if not self._resolved:
+            # The cached id is checked (and its metadata fetched) in the same call
+            cached_id = self._cache_meta().get("id")
+            self._meta = self._drive_meta(cached_id) if cached_id else None
+            if self._meta is None and self.cache_dir:
+                q = f"name='{_escape_q(self.name)}' and '{self.folder}' in parents and trashed=false"
+                r = self.drive.files().list(q=q, fields=f"files({WORKBOOK_META_FIELDS})", pageSize=1).execute()
+                self._meta = r["files"][0] if r.get("files") else None
+            if self.cache_dir:
+                self._file_id = self._meta["id"] if self._meta else None
+            else:
+                self._file_id = find_file_id(self.drive, self.name, self.folder)
+            self._resolved = True
+        return self._file_id
+
+    @file_id.setter
+    def file_id(self, fid: str):
+        if fid != self._file_id:
+            self._meta = None
+        self._file_id, self._resolved = fid, True
+
+    def _drive_meta(self, fid: str) -> Optional[dict]:
+        """Current metadata of `fid`; None if it is gone, trashed or no longer this workbook."""
         try:
-            _, done = downloader.next_chunk()
-            if done: break
-        except HttpError:
-            break
-    buf.seek(0)
-    try:
-        return pd.read_excel(buf, dtype=str)
-    except Exception:
-        return pd.DataFrame()
+            meta = self.drive.files().get(fileId=fid, fields=f"{WORKBOOK_META_FIELDS},parents,trashed").execute()
+        except gapi_errors.HttpError as e:
+            if int(e.resp.status) == 404:
+                return None
+            raise
+        if meta.get("trashed") or meta.get("name", self.name) != self.name \
+                or self.folder not in meta.get("parents", [self.folder]):
+            return None
+        return {k: meta.get(k) for k in WORKBOOK_META_FIELDS.split(",")}
+
+    def _cache_path(self, ext: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.folder}-{self.name}{ext}")
+
+    def _cache_meta(self) -> dict:
+        if not (self.cache_dir and os.path.exists(self._cache_path(".json"))):
+            return {}
+        with open(self._cache_path(".json")) as f:
+            return json.load(f)
+
+    def _cached(self) -> Optional[bytes]:
+        cached = self._cache_meta()
+        if not cached or cached.get("id") != self.file_id or not os.path.exists(self._cache_path("")):
+            return None
+        if self._meta is None:
+            self._meta = self._drive_meta(self.file_id) or {}
+        revision = self._meta.get("headRevisionId")
+        if self._meta.get("md5Checksum") != cached.get("md5Checksum") or \
+                (cached.get("headRevisionId") and revision != cached["headRevisionId"]):
+            log.info("🔄 %s changed in Drive since it was cached (revision %s → %s)",
+                     self.name, cached.get("headRevisionId"), revision)
+            return None
+        with open(self._cache_path(""), "rb") as f:
+            data = f.read()
+        if hashlib.md5(data).hexdigest() != cached.get("md5Checksum"):
+            return None
+        if revision and not cached.get("headRevisionId"):
+            self._store_cache(data, self._meta)
+        return data
+
+    def _store_cache(self, data: bytes, meta: Optional[dict]):
+        if not (self.cache_dir and self.file_id):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = dict(meta or {}, id=self.file_id, md5Checksum=hashlib.md5(data).hexdigest())
+        for ext, payload, mode in (("", data, "wb"), (".json", json.dumps(meta), "w")):
+            with open(self._cache_path(ext) + ".tmp", mode) as f:
+                f.write(payload)
+            os.replace(self._cache_path(ext) + ".tmp", self._cache_path(ext))
+
+    def content(self) -> Optional[bytes]:
+        if self._content is None and self.file_id:
+            self._content = self._cached()
+            if self._content is not None:
+                log.info("💾 %s unchanged in Drive, using the cached copy", self.name)
+            else:
+                self._content = self.transfer.download(self.drive, self.file_id, self.name)
+                self._store_cache(self._content, self._meta)
+        return self._content
+
+    def book(self):
+        if self._book is None and self.content():
+            self._book = openpyxl.load_workbook(io.BytesIO(self.content()), read_only=True, data_only=True)
+        return self._book
+
+    def _rows(self, sheet: str) -> list:
+        book = self.book()
+        if book is None or sheet not in book.sheetnames:
+            return []
+        rows = list(book[sheet].iter_rows(values_only=True))
+        while rows and all(v is None for v in rows[-1]):
+            rows.pop()
+        return rows
+
+    def data_sheet(self) -> Optional[str]:
+        book = self.book()
+        names = [n for n in book.sheetnames if not n.startswith("_")] if book else []
+        return names[0] if names else None
+
+    def _watermark_field(self, field: str) -> Optional[str]:
+        rows = self._rows("_watermark")
+        if len(rows) < 2 or field not in rows[0]:
+            return None
+        v = rows[1][rows[0].index(field)]
+        return str(v) if v is not None else None
+
+    def watermark(self) -> Optional[str]:
+        return self._watermark_field("last_oid")
+
+    def digest(self) -> Optional[str]:
+        """output_digest stored with the watermark (None for files written before digests)."""
+        return self._watermark_field("digest")
+
+    def iter_rows(self, header: List[str]) -> Iterator[Tuple[tuple, tuple]]:
+        """
+        Stream (data row, (journal_id, row_hash)) pairs without building a frame. Rows are
+        in `header` order with values as str (like data_frame()) and "" for columns the
+        sheet lacks; trailing empty rows are skipped, as in data_frame() and keys().
+        Keys follow the rows' ID_COL (see align_keys).
+        """
+        sheet = self.data_sheet()
+        if not sheet:
+            return
+        book = self.book()
+        keys = book[KEYS_SHEET].iter_rows(min_row=2, max_col=2, values_only=True) \
+            if KEYS_SHEET in book.sheetnames else iter(())
+        rows = book[sheet].iter_rows(values_only=True)
+        names = list(next(rows, ()))
+        pos = [names.index(c) if c in names else None for c in header]
+        id_pos = names.index(ID_COL) if ID_COL in names else None
+        hashes = None
+        if id_pos is not None:
+            hashes = {k[0]: k[1] if len(k) > 1 else None for k in keys if k and k[0]}
+            keys = book[KEYS_SHEET].iter_rows(min_row=2, max_col=2, values_only=True) \
+                if KEYS_SHEET in book.sheetnames else iter(())
+        blanks = []
+        for r in rows:
+            k = tuple(next(keys, ()))[:2]
+            k += (None,) * (2 - len(k))
+            jid = r[id_pos] if id_pos is not None and id_pos < len(r) else None
+            if jid:
+                k = (str(jid), hashes.get(str(jid)))
+            if all(v is None for v in r):
+                blanks.append(k)
+                continue
+            for blank in blanks:
+                yield tuple(None if p is not None else "" for p in pos), blank
+            blanks = []
+            yield tuple("" if p is None else (None if p >= len(r) or r[p] is None else str(r[p]))
+                        for p in pos), k
+
+    def statuses(self) -> Dict[str, Optional[str]]:
+        """Status of each keyed data row by journal_id: the column is edited by hand in Drive."""
+        return {key[0]: values[0] or None for values, key in self.iter_rows(["Status"]) if key[0]}
+
+    def summaries(self) -> Optional[Dict[str, pd.DataFrame]]:
+        """The summary sheets' running aggregates (see read_summaries), if the workbook has them."""
+        return read_summaries(self.book())
+
+    def keys(self) -> pd.DataFrame:
+        """Keys (KEY_COLS) of the data rows in sheet order (see align_keys); missing keys are None."""
+        sheet = self.data_sheet()
+        rows = self._rows(sheet) if sheet else []
+        names, data = (list(rows[0]), rows[1:]) if rows else ([], [])
+        id_pos = names.index(ID_COL) if ID_COL in names else None
+        ids = [r[id_pos] if id_pos is not None and id_pos < len(r) else None for r in data]
+        keys = [tuple(r[:2]) + (None,) * (2 - len(r[:2])) for r in self._rows(KEYS_SHEET)[1:]]
+        return pd.DataFrame(align_keys(ids, keys), columns=KEY_COLS, dtype=object)
+
+    def data_frame(self) -> pd.DataFrame:
+        """Data sheet as strings (same shape as `pd.read_excel(..., dtype=str)`)."""
+        sheet = self.data_sheet()
+        rows = self._rows(sheet) if sheet else []
+        if not rows:
+            return pd.DataFrame()
+        header = list(rows[0])
+        df = pd.DataFrame([r[:len(header)] for r in rows[1:]], columns=header, dtype=object)
+        return df.where(df.isna(), df.astype(str))
+
+    def close(self):
+        if self._book is not None:
+            self._book.close()
+        self._book = self._content = None
+
+    def set_content(self, content: bytes):
+        """Adopt `content` (e.g. the bytes just uploaded) as the current version."""
+        self.close()
+        self._content = content
+        # Our own upload: Drive's new revision id is filled in when the next run validates it
+        self._meta = None
+        self._store_cache(content, None)
 
 def decide_country(address: str, state: str, loc_country: str) -> str:
     c = (loc_country or "").strip()
     if c:
-        if c.upper() in {"US", "USA", "U.S.", "UNITED STATES", "UNITED STATES OF AMERICA"}:
+        if c.upper() in US_COUNTRY_NAMES:
             return "USA"
         return c
     if (state or "").strip().upper() in US_STATES:
@@ -124,9 +599,48 @@ def decide_country(address: str, state: str, loc_country: str) -> str:
         return "USA"
     return ""
 
-def agg_pipeline(match: dict):
-    return [
-        {"$match": match},
+def _as_text(s: pd.Series) -> pd.Series:
+    # object dtype so .str uses Python's strip/upper, exactly like decide_country
+    return s.where(s.notna(), "").astype(str).astype(object)
+
+def _per_distinct(s: pd.Series, fn):
+    """Apply a vectorised `fn` to the distinct values of `s` only; broadcast back as an array."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    return fn(_as_text(pd.Series(uniques, dtype=object))).to_numpy()[codes]
+
+def decide_country_vec(address: pd.Series, state: pd.Series, loc_country: pd.Series) -> pd.Series:
+    """
+    Vectorised decide_country over aligned Series; identical result row for row.
+    String work runs once per distinct value: journals repeat the same few locations.
+    """
+    def normalise(c):
+        c = c.str.strip()
+        c[c.str.upper().isin(US_COUNTRY_NAMES)] = "USA"
+        return c
+
+    out = _per_distinct(loc_country, normalise)
+    todo = out == ""
+    out[todo & _per_distinct(state, lambda st: st.str.strip().str.upper().isin(US_STATES))] = "USA"
+    todo &= out == ""
+    if todo.any():
+        out[todo & _per_distinct(address, lambda a: a.str.upper().str.contains(US_STATE_TOKEN_RE))] = "USA"
+    return pd.Series(out, index=loc_country.index, dtype=object)
+
+def _range_head(match: dict, limit: Optional[int]) -> list:
+    # $match + $sort on native _id first: an indexed range scan on `_id`, no blocking sort
+    head = [{"$match": match}, {"$sort": {"_id": 1}}]
+    if limit:
+        head.append({"$limit": limit})
+    return head
+
+def agg_pipeline(match: dict, limit: Optional[int] = None, transform: str = "client"):
+    """
+    transform="client": rows shaped like PROJECT_COLS, finished by clean() in Python.
+    transform="server": clean()'s normalisation is done here; rows carry exactly
+    FINAL_COLS plus the native `_id` used for paging/watermarks.
+    """
+    tail = server_transform_stages() if transform == "server" else []
+    return _range_head(match, limit) + [
         {"$addFields": {
             "uid_obj": {"$convert": {"input": "$uid", "to": "objectId", "onError": None, "onNull": None}},
             "loc_obj": {"$convert": {"input": "$locationId", "to": "objectId", "onError": None, "onNull": None}},
@@ -191,9 +705,187 @@ def agg_pipeline(match: dict):
             "n_activity": {"$ifNull": ["$activity", ""]},
             "n_notes": {"$ifNull": ["$notes", ""]}
         }},
-        {"$sort": {"journal_id": 1}}
+    ] + tail
+
+# --- Server-side Transform (TRANSFORM=server) ---
+# Same output as clean(), computed by MongoDB after the $project stage above.
+
+def _iso_string(field: str) -> dict:
+    """Same text as datetime.isoformat() for the UTC datetimes a tz_aware client returns."""
+    return {"$switch": {"branches": [
+        {"case": {"$ne": [{"$type": field}, "date"]}, "then": {"$ifNull": [{"$toString": field}, ""]}},
+        {"case": {"$eq": [{"$millisecond": field}, 0]},
+         "then": {"$dateToString": {"date": field, "format": "%Y-%m-%dT%H:%M:%S+00:00"}}},
+    ], "default": {"$dateToString": {"date": field, "format": "%Y-%m-%dT%H:%M:%S.%L000+00:00"}}}}
+
+def _rounded(field: str, places: int) -> dict:
+    return {"$round": [{"$convert": {"input": field, "to": "double", "onError": None, "onNull": None}}, places]}
+
+def server_transform_stages() -> list:
+    text = lambda field: {"$toString": {"$ifNull": [field, ""]}}
+    address_for_check = {"$cond": [{"$gt": [{"$strLenCP": text("$Address")}, 0]}, text("$Address"), text("$n_Place")]}
+    country = {"$let": {"vars": {"c": {"$trim": {"input": text("$LocCountry")}}}, "in": {"$switch": {"branches": [
+        # (A) loc.country present → US variants become "USA", others unchanged
+        {"case": {"$in": [{"$toUpper": "$$c"}, sorted(US_COUNTRY_NAMES)]}, "then": "USA"},
+        {"case": {"$ne": ["$$c", ""]}, "then": "$$c"},
+        # (B) state is a US code, or the address contains one as a whole token
+        {"case": {"$in": [{"$toUpper": {"$trim": {"input": text("$State")}}}, sorted(US_STATES)]}, "then": "USA"},
+        {"case": {"$regexMatch": {"input": {"$toUpper": address_for_check}, "regex": US_STATE_TOKEN_RE.pattern}},
+         "then": "USA"},
+    ], "default": ""}}}}
+    # Runs of 2+ whitespace → one space (like str.replace(r"\s{2,}", " ")), then strip " ,"
+    place = {"$trim": {"chars": " ,", "input": {"$reduce": {
+        "input": {"$regexFindAll": {"input": text("$n_Place"), "regex": r"(\s{2,})|\S+|\s"}},
+        "initialValue": "",
+        "in": {"$concat": ["$$value", {"$cond": [
+            {"$eq": [{"$arrayElemAt": ["$$this.captures", 0]}, None]}, "$$this.match", " "]}]},
+    }}}}
+    return [
+        {"$addFields": {
+            "Status": {"$literal": ""},
+            "Country": country,
+            "n_Place": place,
+            "n_Lati": _rounded("$n_Lati", 6),
+            "n_Long": _rounded("$n_Long", 6),
+            "Timestamp": _iso_string("$Timestamp"),
+            "End Date Time": _iso_string("$End Date Time"),
+        }},
+        {"$project": {"_id": {"$toObjectId": "$journal_id"}, **{c: 1 for c in FINAL_COLS}}},
     ]
 
+def server_rows(raw: pd.DataFrame) -> pd.DataFrame:
+    """Finish a TRANSFORM=server chunk: only column bookkeeping is left for the client."""
+    raw["journal_id"] = raw.pop("_id").astype(str)
+    for c in FINAL_COLS:
+        if c not in raw.columns:
+            raw[c] = ""
+    return raw
+
+# --- Bulk Join Engine (JOIN_ENGINE=bulk) ---
+# Pulls only journal fields, then resolves users/locations with one `$in` query per
+# batch and joins in pandas, instead of two `$lookup` sub-pipelines per journal.
+
+def journal_pipeline(match: dict, limit: Optional[int] = None):
+    return _range_head(match, limit) + [{"$project": JOURNAL_FIELDS}]
+
+def _to_oid(v) -> Optional[ObjectId]:
+    """Mirror of `$convert: {to: "objectId", onError: null}` for uid/locationId."""
+    if isinstance(v, ObjectId):
+        return v
+    if isinstance(v, str) and len(v) == 24:
+        try:
+            return ObjectId(v)
+        except Exception:
+            return None
+    return None
+
+def _coalesce(*vals):
+    for v in vals:
+        if v is not None:
+            return v
+    return None
+
+def _user_row(u: dict) -> dict:
+    return {
+        "User Name": _coalesce(u.get("name"), ""),
+        "User email": _coalesce(u.get("email"), ""),
+    }
+
+def _location_row(loc: dict) -> dict:
+    """Same expressions as the location part of agg_pipeline's $project stage."""
+    coords = loc.get("coordinates")
+    coords = coords if isinstance(coords, dict) else {}
+    geo = coords.get("coordinates")
+    geo = geo if isinstance(geo, list) else []
+    category = loc.get("category")
+    state = _coalesce(loc.get("stateInitials"), loc.get("state"), "")
+    return {
+        "n_Name": _coalesce(loc.get("name"), ""),
+        "City": _coalesce(loc.get("city"), ""),
+        "State": state,
+        "Zip": _coalesce(loc.get("zip"), ""),
+        "LocCountry": _coalesce(loc.get("country"), ""),
+        "Address": _coalesce(loc.get("address"), ""),
+        "n_Place": f"{_coalesce(loc.get('name'), '')}, {_coalesce(loc.get('city'), '')} {state}",
+        "n_Lati": _coalesce(coords.get("lat"), coords.get("latitude"), geo[1] if len(geo) > 1 else None),
+        "n_Long": _coalesce(coords.get("lng"), coords.get("longitude"), geo[0] if geo else None),
+        "n_park_nbr": _coalesce(loc.get("parkNumber"),
+                                category[0] if isinstance(category, list) and category else None),
+    }
+
+# Values for journals whose user/location does not resolve ($unwind preserveNullAndEmptyArrays)
+_MISSING_USER = _user_row({})
+_MISSING_LOCATION = _location_row({})
+
+class DimensionCache:
+    """
+    In-process LRU cache of projected dimension rows (users or locations) keyed by _id.
+    Lives across batches; misses are resolved with a single `$in` query per batch.
+    Unresolvable ids are cached as None so they are not re-queried.
+    """
+
+    def __init__(self, coll, fields: dict, to_row, maxsize: int = DIM_CACHE_SIZE):
+        self.coll = coll
+        self.fields = fields
+        self.to_row = to_row
+        self.maxsize = maxsize
+        self.rows = OrderedDict()
+        self.hits = self.misses = self.queries = 0
+
+    def get_many(self, ids) -> Dict[ObjectId, Optional[dict]]:
+        found, missing = {}, []
+        for i in set(ids):
+            if i in self.rows:
+                self.rows.move_to_end(i)
+                found[i] = self.rows[i]
+                self.hits += 1
+            else:
+                missing.append(i)
+        if missing:
+            self.misses += len(missing)
+            self.queries += 1
+            fetched = {d["_id"]: self.to_row(d) for d in self.coll.find({"_id": {"$in": missing}}, self.fields)}
+            for i in missing:
+                found[i] = self.rows[i] = fetched.get(i)
+            while len(self.rows) > self.maxsize:
+                self.rows.popitem(last=False)
+        return found
+
+def dimension_caches(db, maxsize: int = DIM_CACHE_SIZE) -> Tuple[DimensionCache, DimensionCache]:
+    return (DimensionCache(db[USERS_COL], USER_FIELDS, _user_row, maxsize),
+            DimensionCache(db[LOCATIONS_COL], LOCATION_FIELDS, _location_row, maxsize))
+
+def _dimension_frame(rows: Dict[ObjectId, Optional[dict]], columns: List[str]) -> pd.DataFrame:
+    rows = {k: v for k, v in rows.items() if v is not None}
+    return pd.DataFrame.from_dict(rows, orient="index", columns=columns) if rows else pd.DataFrame(columns=columns)
+
+def bulk_join(journals: List[dict], users: DimensionCache, locations: DimensionCache) -> pd.DataFrame:
+    """
+    Join one batch of journal docs against the cached dimensions in pandas.
+    Produces the same columns (PROJECT_COLS) as agg_pipeline's $project stage.
+    """
+    j = pd.DataFrame(journals)
+    for c in JOURNAL_FIELDS:
+        if c not in j.columns:
+            j[c] = None
+    j["uid_obj"] = [_to_oid(v) for v in j["uid"]]
+    j["loc_obj"] = [_to_oid(v) for v in j["locationId"]]
+
+    u = _dimension_frame(users.get_many(x for x in j["uid_obj"] if x is not None), list(_MISSING_USER))
+    l = _dimension_frame(locations.get_many(x for x in j["loc_obj"] if x is not None), list(_MISSING_LOCATION))
+    j = j.join(u, on="uid_obj").join(l, on="loc_obj")
+    for c, v in {**_MISSING_USER, **_MISSING_LOCATION}.items():
+        j[c] = j[c].astype(object).where(j[c].notna(), v)
+
+    start = pd.to_datetime(j["start_time"], utc=True, errors="coerce")
+    end = pd.to_datetime(j["end_time"], utc=True, errors="coerce")
+    j["n_Duration"] = ((end - start) / pd.Timedelta(milliseconds=1) / 60000).round(2)
+    j["journal_id"] = j["_id"].astype(str)
+    j["n_activity"] = j["activity"].where(j["activity"].notna(), "")
+    j["n_notes"] = j["notes"].where(j["notes"].notna(), "")
+    j = j.rename(columns={"start_time": "Timestamp", "end_time": "End Date Time"})
+    return j[PROJECT_COLS].reset_index(drop=True)
+
 def _to_str_timestamp(x):
     if x is None:
         return ""
@@ -202,21 +894,24 @@ def _to_str_timestamp(x):
     except Exception:
         return str(x)
 
+def _text_col(df: pd.DataFrame, name: str) -> pd.Series:
+    """Column `name` as str, or an all-"" column if absent (no per-row Python list)."""
+    if name in df.columns:
+        return df[name].astype(str)
+    return pd.Series("", index=df.index, dtype=object)
+
 def clean(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalise a raw chunk (PROJECT_COLS) into FINAL_COLS + journal_id, in place: callers drop the raw chunk."""
     if df is None or df.empty:
         return pd.DataFrame(columns=FINAL_COLS)
-    df = df.copy()
 
-    addr_src  = df.get("Address", pd.Series([""]*len(df), index=df.index)).astype(str)
-    place_src = df.get("n_Place", pd.Series([""]*len(df), index=df.index)).astype(str)
+    addr_src  = _text_col(df, "Address")
+    place_src = _text_col(df, "n_Place")
     address_for_check = addr_src.where(addr_src.str.len() > 0, place_src)
 
-    state_series       = df.get("State", pd.Series([""]*len(df), index=df.index)).astype(str)
-    loc_country_series = df.get("LocCountry", pd.Series([""]*len(df), index=df.index)).astype(str)
-    df["Country"] = [
-        decide_country(addr, st, lc)
-        for addr, st, lc in zip(address_for_check, state_series, loc_country_series)
-    ]
+    state_series       = _text_col(df, "State")
+    loc_country_series = _text_col(df, "LocCountry")
+    df["Country"] = decide_country_vec(address_for_check, state_series, loc_country_series)
 
     df["n_Lati"]  = pd.to_numeric(df.get("n_Lati"), errors="coerce").round(6)
     df["n_Long"]  = pd.to_numeric(df.get("n_Long"), errors="coerce").round(6)
@@ -240,217 +935,2058 @@ def clean(df: pd.DataFrame) -> pd.DataFrame:
     # But here 'df' is the cleaned chunk.
     return df
 
-# --- Watermark Logic (Excel-Based) ---
+# --- Compact Frames (COMPACT_FRAMES=true) ---
+# Cleaned chunks are held until the output is written, so on backfills their
+# representation decides peak memory. Low-cardinality columns become categoricals
+# (small integer codes plus one copy of each value) and other all-string columns
+# Arrow-backed strings (one buffer instead of a Python object per cell). Values, and
+# so the written workbook, are unchanged; coordinates stay float64 because float32
+# cannot hold 6 decimals of a longitude.
+
+CATEGORY_COLS = ["State", "Country", "City", "n_park_nbr", "n_activity", "User Name"]
+
+def _arrow_string_dtype():
+    if importlib.util.find_spec("pyarrow") is None:
+        return None
+    return pd.StringDtype("pyarrow")
+
+def compact_frame(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Convert `df`'s text columns (or only `columns`) in place, see above; returns `df`."""
+    string_dtype = _arrow_string_dtype()
+    for c in columns or df.columns:
+        s = df[c]
+        if c in CATEGORY_COLS:
+            if not isinstance(s.dtype, pd.CategoricalDtype):
+                df[c] = s.astype("category")
+        elif string_dtype is not None and s.dtype == object \
+                and pd.api.types.infer_dtype(s, skipna=True) in ("string", "empty"):
+            # Mixed columns (e.g. numeric Zip codes) stay object so cells keep their Excel type
+            df[c] = s.astype(string_dtype)
+    return df
 
-def get_watermark_from_excel(excel_path: str) -> Optional[str]:
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
     """
-    Read watermark from a hidden sheet named '_watermark' in the Excel file.
-    Returns the last_oid or None if not found.
+    pd.concat that keeps categoricals categorical. Plain concat turns categoricals whose
+    categories differ (every chunk has its own) into object columns; those are rebuilt
+    from the union of the frames' categories.
     """
+    out = pd.concat(frames, ignore_index=True)
+    for c in CATEGORY_COLS:
+        parts = [f[c] for f in frames if c in f.columns]
+        if len(parts) < len(frames) or isinstance(out[c].dtype, pd.CategoricalDtype) \
+                or not any(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            continue
+        try:
+            out[c] = pd.api.types.union_categoricals(
+                [p if isinstance(p.dtype, pd.CategoricalDtype) else p.astype("category") for p in parts],
+                ignore_order=True)
+        except TypeError:
+            pass  # categories of different types (e.g. int and str park numbers): stays object
+    return out
+
+# --- Parquet Staging Store (STAGING_DIR) ---
+# System of record when enabled: a Parquet dataset partitioned by month of Timestamp
+# (month=YYYY-MM/part-<run>.parquet). The Excel file becomes an export of it.
+
+STAGING_FLOAT_COLS = ["n_Duration", "n_Lati", "n_Long"]
+STAGING_COLS = FINAL_COLS + ["journal_id"]
+
+def _arrow():
     try:
-        with pd.ExcelFile(excel_path) as xls:
-            if "_watermark" in xls.sheet_names:
-                df = pd.read_excel(xls, sheet_name="_watermark")
-                if not df.empty and "last_oid" in df.columns:
-                    return str(df["last_oid"].iloc[0])
-    except Exception as e:
-        log.warning("Could not read watermark from Excel: %s", e)
-    return None
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("STAGING_DIR needs pyarrow: pip install pyarrow")
+    return pa, pc, pq
+
+def new_run_id() -> str:
+    """Timestamp plus a random suffix: runs started in the same second get distinct part files."""
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
 
-def save_watermark_to_excel(excel_path: str, last_oid: str):
+class ParquetStore:
     """
-    Save watermark to a hidden sheet named '_watermark' in the Excel file.
+    Append-only Parquet dataset. A run writes one file per month it touches (one row
+    group per chunk); existing files are never rewritten. Watermark and dedup reads
+    only touch the journal_id column, memory-mapped.
     """
-    if not last_oid:
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._writers = {}
+        self._known = None
+
+    def _files(self) -> List[str]:
+        # Files being written start with "." and are invisible until closed
+        return sorted(os.path.join(d, f) for d, _, files in os.walk(self.root)
+                      for f in files if f.endswith(".parquet") and not f.startswith("."))
+
+    def _read(self, columns: List[str], files: Optional[List[str]] = None):
+        pa, _, pq = _arrow()
+        files = self._files() if files is None else files
+        if not files:
+            return None
+        return pa.concat_tables([pq.read_table(f, columns=columns, memory_map=True) for f in files])
+
+    def journal_ids(self) -> set:
+        t = self._read(["journal_id"])
+        return set() if t is None else {v for v in t.column("journal_id").to_pylist() if v}
+
+    def last_oid(self) -> Optional[str]:
+        _, pc, _ = _arrow()
+        t = self._read(["journal_id"])
+        # 24-char lowercase hex ids sort like the ObjectIds themselves
+        return None if t is None else pc.max(t.column("journal_id")).as_py()
+
+    def is_empty(self) -> bool:
+        return not self._files()
+
+    def _table(self, df: pd.DataFrame):
+        pa, _, _ = _arrow()
+        df = df.reindex(columns=STAGING_COLS)
+        data = {}
+        for c in STAGING_COLS:
+            if c in STAGING_FLOAT_COLS:
+                data[c] = pa.array(pd.to_numeric(df[c], errors="coerce"), type=pa.float64(), from_pandas=True)
+            else:
+                col = df[c].astype(object)
+                data[c] = pa.array(col.where(col.isna(), col.astype(str)), type=pa.string(), from_pandas=True)
+        return pa.table(data)
+
+    def write(self, df: pd.DataFrame, run_id: str) -> int:
+        """Append the rows of `df` not already stored (by journal_id). Returns rows written."""
+        _, _, pq = _arrow()
+        if self._known is None:
+            self._known = self.journal_ids()
+        if "journal_id" in df.columns:
+            df = df[~df["journal_id"].isin(self._known)]
+            self._known.update(df["journal_id"].dropna())
+        if df.empty:
+            return 0
+        months = df["Timestamp"].astype(str).str[:7].where(lambda m: m.str.match(r"\d{4}-\d{2}$"), "none")
+        for month, part in df.groupby(months):
+            if month not in self._writers:
+                d = os.path.join(self.root, f"month={month}")
+                os.makedirs(d, exist_ok=True)
+                tmp = os.path.join(d, f".part-{run_id}.parquet")
+                table = self._table(part)
+                self._writers[month] = (pq.ParquetWriter(tmp, table.schema), tmp)
+                self._writers[month][0].write_table(table)
+            else:
+                self._writers[month][0].write_table(self._table(part))
+        return len(df)
+
+    def commit(self):
+        """Close this run's files and make them visible to readers; never replaces a committed file."""
+        parts = [(tmp, os.path.join(os.path.dirname(tmp), os.path.basename(tmp)[1:])) for _, tmp in self._writers.values()]
+        taken = [path for _, path in parts if os.path.exists(path)]
+        if taken:
+            self.abort()
+            raise RuntimeError(f"Staging part file already exists (run id reused?): {taken[0]}")
+        for writer, _ in self._writers.values():
+            writer.close()
+        for tmp, path in parts:
+            os.replace(tmp, path)
+        self._writers = {}
+
+    def abort(self):
+        for writer, tmp in self._writers.values():
+            writer.close()
+            os.remove(tmp)
+        self._writers = {}
+
+    def _export_marker(self) -> str:
+        return os.path.join(self.root, "_exported.json")
+
+    def _exported(self) -> dict:
+        if not os.path.exists(self._export_marker()):
+            return {}
+        with open(self._export_marker()) as f:
+            return json.load(f)
+
+    def pending_export(self) -> bool:
+        """True if rows were staged after the last successful Excel upload."""
+        return self.last_oid() != self._exported().get("last_oid")
+
+    def exported_digest(self) -> Optional[str]:
+        """output_digest of the last workbook uploaded from this store."""
+        return self._exported().get("digest")
+
+    def mark_exported(self, last_oid: Optional[str], digest: Optional[str] = None):
+        with open(self._export_marker(), "w") as f:
+            json.dump({"last_oid": last_oid, "digest": digest}, f)
+
+    def read(self, window_months: int = 0) -> pd.DataFrame:
+        """Stored rows (STAGING_COLS) in journal_id (= _id) order; only the newest `window_months` if > 0."""
+        files = self._files()
+        if window_months > 0:
+            months = sorted({os.path.basename(os.path.dirname(f)) for f in files} - {"month=none"})
+            keep = set(months[-window_months:])
+            files = [f for f in files if os.path.basename(os.path.dirname(f)) in keep]
+        t = self._read(STAGING_COLS, files)
+        if t is None:
+            return pd.DataFrame(columns=STAGING_COLS)
+        df = t.to_pandas()
+        return df.sort_values("journal_id", kind="stable", na_position="first", ignore_index=True)[STAGING_COLS]
+
+# --- Watermark Logic (Excel-Based) ---
+
+# Hidden sheet next to the data: journal_id and content hash of each data row, in sheet order
+KEYS_SHEET = "_keys"
+KEY_COLS = ["journal_id", "row_hash"]
+
+# Hidden last column of the data sheet: the row's journal_id. Unlike '_keys' it moves with
+# the row when the sheet is sorted or rows are deleted in Drive, so rows are found by it.
+ID_COL = "journal_id"
+
+# Row hashes cover the data, not the manually maintained Status
+HASH_COLS = [c for c in FINAL_COLS if c != "Status"]
+
+# Rows per slice when hashing, bounding the temporary all-str copy of the output
+HASH_SLICE_ROWS = 100000
+
+def row_hashes(df: pd.DataFrame) -> pd.Series:
+    """64-bit content hash of each row over HASH_COLS, as 16 hex digits (same for any dtypes of the values)."""
+    parts = []
+    for start in range(0, len(df), HASH_SLICE_ROWS):
+        values = df.iloc[start:start + HASH_SLICE_ROWS].reindex(columns=HASH_COLS).astype(object)
+        values = values.where(values.notna(), "").astype(str)
+        parts.append(pd.util.hash_pandas_object(values, index=False))
+    hashes = pd.concat(parts) if parts else pd.Series([], index=df.index[:0], dtype="uint64")
+    return hashes.map("{:016x}".format)
+
+def output_keys(rows: pd.DataFrame) -> pd.DataFrame:
+    """_keys sheet content for `rows` (which carry journal_id)."""
+    return pd.DataFrame({"journal_id": rows["journal_id"].astype(str).to_numpy(),
+                         "row_hash": row_hashes(rows).to_numpy()})
+
+def align_keys(ids: list, keys: List[tuple]) -> List[tuple]:
+    """
+    (journal_id, row_hash) of each data row, given its ID_COL value in `ids` and the
+    positional '_keys' rows `keys`: the hash is the one recorded for that journal_id,
+    wherever the row has moved. Rows without an id (written before the column existed)
+    keep their positional key.
+    """
+    hashes = {k[0]: k[1] for k in keys if k[0]}
+    return [(str(jid), hashes.get(str(jid))) if jid else (keys[i] if i < len(keys) else (None, None))
+            for i, jid in enumerate(ids)]
+
+def output_digest(hashes, last_oid: Optional[str]) -> str:
+    """Digest of a whole output: its row hashes in sheet order plus the watermark."""
+    return hashlib.sha1(("".join(h or "-" for h in hashes) + (last_oid or "")).encode()).hexdigest()
+
+def drop_unchanged(rows: pd.DataFrame, known) -> pd.DataFrame:
+    """`rows` minus those whose (journal_id, row_hash) is already in the `known` keys (frame or set of pairs)."""
+    if rows.empty or len(known) == 0:
+        return rows
+    keys = output_keys(rows)
+    seen = known if isinstance(known, set) else set(zip(known["journal_id"], known["row_hash"]))
+    fresh = [k not in seen for k in zip(keys["journal_id"], keys["row_hash"])]
+    return rows[fresh]
+
+def carry_statuses(out: pd.DataFrame, statuses: Dict[str, Optional[str]]) -> pd.DataFrame:
+    """`out` (with journal_id) with the Status its rows have in the Drive workbook (see
+    DriveWorkbook.statuses); rows not in the workbook keep their own."""
+    if not statuses:
+        return out
+    in_book = out["journal_id"].isin(list(statuses))
+    out["Status"] = out["Status"].astype(object).where(~in_book, out["journal_id"].map(statuses))
+    return out
+
+# --- Summary Sheets (SUMMARY_SHEETS=incremental|full) ---
+# Visits, total n_Duration and first/last Timestamp per user, park, state and month,
+# written after the data sheet in the same upload. The sheets are also the running
+# aggregates: an incremental run reads them back and folds in only the rows it adds.
+
+SUMMARY_SHEETS = {"By User": "User email", "By Park": "n_park_nbr", "By State": "State", "By Month": "Month"}
+SUMMARY_COLS = ["Visits", "Total Duration", "First Visit", "Last Visit"]
+SUMMARY_BATCH_ROWS = 50000
+
+def _summary_key(s: pd.Series) -> pd.Series:
+    return s.astype(object).where(s.notna(), "").astype(str)
+
+def _earliest(frame: pd.DataFrame, key: str, col: str, last: bool = False) -> pd.Series:
+    """Per-`key` min (or max) of the ISO timestamp strings in `col`. Sorting once and taking
+    each group's first/last stays vectorised, where groupby min/max on strings does not."""
+    g = frame.sort_values(col, kind="stable").groupby(key, sort=True)[col]
+    return g.last() if last else g.first()
+
+def summarise(rows: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Full recompute: one table (key + SUMMARY_COLS, sorted by key) per summary sheet over `rows`."""
+    ts = _summary_key(rows["Timestamp"])
+    ts = ts.where(ts != "")
+    duration = pd.to_numeric(rows["n_Duration"], errors="coerce")
+    tables = {}
+    for sheet, col in SUMMARY_SHEETS.items():
+        key = _summary_key(ts.str[:7] if col == "Month" else rows[col])
+        frame = pd.DataFrame({col: key.values, "d": duration.values, "t": ts.values})
+        g = frame.groupby(col, sort=True)
+        tables[sheet] = pd.DataFrame({"Visits": g.size(), "Total Duration": g["d"].sum().round(2),
+                                      "First Visit": _earliest(frame, col, "t"),
+                                      "Last Visit": _earliest(frame, col, "t", last=True)}).reset_index()
+    return tables
+
+def combine_summaries(a: Dict[str, pd.DataFrame], b: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Fold the summaries of two disjoint sets of rows into those of their union."""
+    tables = {}
+    for sheet, col in SUMMARY_SHEETS.items():
+        frame = pd.concat([a[sheet], b[sheet]], ignore_index=True)
+        g = frame.groupby(col, sort=True)
+        tables[sheet] = pd.DataFrame({"Visits": g["Visits"].sum(), "Total Duration": g["Total Duration"].sum().round(2),
+                                      "First Visit": _earliest(frame, col, "First Visit"),
+                                      "Last Visit": _earliest(frame, col, "Last Visit", last=True)}).reset_index()
+    return tables
+
+def retract_summaries(tables: Dict[str, pd.DataFrame], rows: pd.DataFrame) -> Optional[Dict[str, pd.DataFrame]]:
+    """
+    Summaries without `rows` (rows being replaced). Counts and sums are subtracted; a
+    first/last visit cannot be, so None is returned when a removed row held one of them
+    and the caller recomputes from the whole sheet.
+    """
+    removed = summarise(rows)
+    out = {}
+    for sheet, col in SUMMARY_SHEETS.items():
+        t = tables[sheet].set_index(col)
+        r = removed[sheet].set_index(col)
+        if not r.index.isin(t.index).all():
+            return None
+        held = t.loc[r.index]
+        if (r["First Visit"].eq(held["First Visit"]) | r["Last Visit"].eq(held["Last Visit"])).any():
+            return None
+        t.loc[r.index, "Visits"] -= r["Visits"]
+        t.loc[r.index, "Total Duration"] = (t.loc[r.index, "Total Duration"] - r["Total Duration"]).round(2)
+        out[sheet] = t[t["Visits"] > 0].reset_index()
+    return out
+
+def read_summaries(book) -> Optional[Dict[str, pd.DataFrame]]:
+    """Summary tables stored in an openpyxl book; None unless every summary sheet is there."""
+    if not book or any(sheet not in book.sheetnames for sheet in SUMMARY_SHEETS):
+        return None
+    tables = {}
+    for sheet, col in SUMMARY_SHEETS.items():
+        rows = [r[:5] for r in book[sheet].iter_rows(min_row=2, values_only=True) if any(v is not None for v in r)]
+        t = pd.DataFrame(rows, columns=[col] + SUMMARY_COLS)
+        t[col] = _summary_key(t[col])
+        t["Visits"] = t["Visits"].astype("int64")
+        t["Total Duration"] = pd.to_numeric(t["Total Duration"], errors="coerce").astype(float)
+        tables[sheet] = t
+    return tables
+
+def write_summaries(book, tables: Dict[str, pd.DataFrame]) -> None:
+    """(Re)create the summary sheets right after the data sheet; works on write_only books too."""
+    for i, (sheet, col) in enumerate(SUMMARY_SHEETS.items(), 1):
+        index = i
+        if sheet in book.sheetnames:
+            index = book.sheetnames.index(sheet)
+            book.remove(book[sheet])
+        ws = book.create_sheet(sheet, index)
+        ws.append([col] + SUMMARY_COLS)
+        for row in _sheet_values(tables[sheet], [col] + SUMMARY_COLS).itertuples(index=False, name=None):
+            ws.append(row)
+
+def _sheet_frame(ws, header: list) -> pd.DataFrame:
+    """Data rows of an openpyxl sheet (below the header) as a frame with `header` columns."""
+    rows = ws.iter_rows(min_row=2, max_col=len(header), values_only=True)
+    return pd.DataFrame([tuple(r) + (None,) * (len(header) - len(r)) for r in rows], columns=header)
+
+def _update_summaries(book, ws, header: list, mode: str, added: pd.DataFrame,
+                      removed: Optional[pd.DataFrame] = None) -> None:
+    """
+    SUMMARY_SHEETS for an openpyxl book whose data sheet `ws` already holds the change:
+    incremental folds in `added` (and takes out `removed`) when the book has summaries,
+    otherwise (mode full, first run, or a first/last visit replaced) recomputes from `ws`.
+    """
+    if mode == "none":
         return
-    
-    try:
-        # Read existing sheets
-        with pd.ExcelFile(excel_path) as xls:
-            sheets = {sheet: pd.read_excel(xls, sheet_name=sheet) for sheet in xls.sheet_names if sheet != "_watermark"}
-        
-        # Add watermark sheet
-        watermark_df = pd.DataFrame({"last_oid": [last_oid]})
-        
-        # Write all sheets back
-        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
-            for sheet_name, df in sheets.items():
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-            watermark_df.to_excel(writer, sheet_name="_watermark", index=False)
-            
-            # Hide the watermark sheet
-            workbook = writer.book
-            if "_watermark" in workbook.sheetnames:
-                workbook["_watermark"].sheet_state = "hidden"
-        
-        log.info("💾 Saved watermark to Excel: %s", last_oid)
-    except Exception as e:
-        log.warning("Could not save watermark to Excel: %s", e)
+    tables = read_summaries(book) if mode == "incremental" else None
+    if tables is not None and not added.empty:
+        tables = combine_summaries(tables, summarise(added))
+    if tables is not None and removed is not None and not removed.empty:
+        tables = retract_summaries(tables, removed)
+    if tables is None:
+        tables = summarise(_sheet_frame(ws, header))
+    write_summaries(book, tables)
+
+def write_output(excel_path: str, out: pd.DataFrame, last_oid: Optional[str],
+                 keys: Optional[pd.DataFrame] = None,
+                 summaries: Optional[Dict[str, pd.DataFrame]] = None) -> None:
+    """
+    Write the data sheet and the hidden '_watermark' sheet in one ExcelWriter pass,
+    so a single upload commits rows and watermark together. With `keys` (KEY_COLS,
+    one per row of `out`) the hidden ID_COL, the '_keys' sheet and the output digest
+    are written too, and with `summaries` the summary sheets.
+    """
+    with pd.ExcelWriter(excel_path, engine="openpyxl") as writer:
+        if keys is not None:
+            out = out.assign(**{ID_COL: keys["journal_id"].to_numpy()})
+        out.to_excel(writer, sheet_name="Sheet1", index=False)
+        if keys is not None:
+            _hide_id_column(writer.book["Sheet1"], len(out.columns))
+        if summaries is not None:
+            write_summaries(writer.book, summaries)
+        if keys is not None:
+            keys.to_excel(writer, sheet_name=KEYS_SHEET, index=False)
+            writer.book[KEYS_SHEET].sheet_state = "hidden"
+        if last_oid:
+            wm = {"last_oid": [last_oid]}
+            if keys is not None:
+                wm["digest"] = [output_digest(keys["row_hash"], last_oid)]
+            pd.DataFrame(wm).to_excel(writer, sheet_name="_watermark", index=False)
+            writer.book["_watermark"].sheet_state = "hidden"
+
+class StreamingOutputWriter:
+    """
+    Constant-memory counterpart of write_output (OUTPUT_WRITER=stream). openpyxl's
+    write_only mode streams every appended row to the sheet XML instead of building a
+    cell object per value, so rows can be written chunk by chunk as they are cleaned.
+    Produces the same sheets: the data sheet with its hidden ID_COL, hidden '_keys' and
+    hidden '_watermark' with the digest (hashed incrementally). The file appears on close();
+    abort() discards a writer that will not be closed.
+    """
+
+    def __init__(self, excel_path: str, header: List[str] = FINAL_COLS):
+        self.excel_path, self.header = excel_path, list(header)
+        self.book = openpyxl.Workbook(write_only=True)
+        self.data = self.book.create_sheet("Sheet1")
+        _hide_id_column(self.data, len(self.header) + 1)
+        self.data.append(self.header + [ID_COL])
+        self.keys = self.book.create_sheet(KEYS_SHEET)
+        self.keys.sheet_state = "hidden"
+        self.keys.append(KEY_COLS)
+        self._digest = hashlib.sha1()
+        self.rows = 0
+        self.summaries, self._unsummarised = None, []
+        self.closed = False
+
+    def summarise(self, base: Optional[Dict[str, pd.DataFrame]] = None) -> None:
+        """Fold every row appended from now on into summary sheets starting from `base`."""
+        self._flush_summaries()
+        self.summaries = base if base is not None else summarise(pd.DataFrame(columns=self.header))
 
-def get_watermark(drive, folder_id: str, excel_name: str) -> Optional[str]:
+    def _flush_summaries(self) -> None:
+        if self.summaries is not None and self._unsummarised:
+            batch = pd.DataFrame(self._unsummarised, columns=self.header)
+            self.summaries = combine_summaries(self.summaries, summarise(batch))
+        self._unsummarised = []
+
+    def append(self, values: tuple, key: tuple = (None, None)) -> None:
+        """One data row (in header order) and its (journal_id, row_hash)."""
+        self.data.append(tuple(values) + (key[0],))
+        self.keys.append(key)
+        self._digest.update((key[1] or "-").encode())
+        self.rows += 1
+        if self.summaries is not None:
+            self._unsummarised.append(values)
+            if len(self._unsummarised) >= SUMMARY_BATCH_ROWS:
+                self._flush_summaries()
+
+    def write(self, rows: pd.DataFrame) -> None:
+        """Append `rows` (header columns + journal_id)."""
+        if rows.empty:
+            return
+        keys = output_keys(rows).itertuples(index=False, name=None)
+        for values, key in zip(_sheet_values(rows, self.header).itertuples(index=False, name=None), keys):
+            self.append(values, key)
+
+    def close(self, last_oid: Optional[str]) -> Optional[str]:
+        """Write the summaries and watermark and save; returns the output digest (same as output_digest)."""
+        self._flush_summaries()
+        if self.summaries is not None:
+            write_summaries(self.book, self.summaries)
+        digest = None
+        if last_oid:
+            self._digest.update(last_oid.encode())
+            digest = self._digest.hexdigest()
+            wm = self.book.create_sheet("_watermark")
+            wm.sheet_state = "hidden"
+            wm.append(["last_oid", "digest"])
+            wm.append([last_oid, digest])
+        self.book.save(self.excel_path)
+        self.closed = True
+        return digest
+
+    def abort(self) -> None:
+        """Discard the output (no-op once closed): the sheets' temp files, which only save()
+        removes otherwise, and a partially saved file."""
+        if self.closed:
+            return
+        for ws in self.book.worksheets:
+            if ws._writer is None:
+                continue
+            if not ws.closed:
+                ws.close()
+            if os.path.exists(ws._writer.out):
+                ws._writer.cleanup()
+        if os.path.exists(self.excel_path):
+            os.remove(self.excel_path)
+
+def append_output(excel_path: str, content: Optional[bytes], new_rows: pd.DataFrame,
+                  last_oid: Optional[str], summary: str = "none") -> int:
     """
-    Download Excel file and try to read watermark from hidden sheet.
+    Append `new_rows` to the data sheet of the existing workbook `content` and update
+    the hidden '_watermark' sheet, without rebuilding the history through pandas.
+    openpyxl still loads and saves the whole workbook, so the cost grows with the file;
+    OUTPUT_ROTATE=month is what bounds it.
+    If `new_rows` carry journal_id, it goes to ID_COL and their keys to '_keys' as well.
+    `summary` is the SUMMARY_SHEETS mode (see _update_summaries).
+    Returns the number of data rows in the written file.
+    """
+    with_keys = "journal_id" in new_rows.columns
+    if not content:
+        write_output(excel_path, new_rows[FINAL_COLS], last_oid, output_keys(new_rows) if with_keys else None,
+                     summarise(new_rows) if summary != "none" else None)
+        return len(new_rows)
+
+    book = openpyxl.load_workbook(io.BytesIO(content))
+    ws, header = _output_sheet(book, with_ids=with_keys)
+    keys_ws, keys = _keys_sheet(book, ws, header)
+    for row in _sheet_values(new_rows, header).itertuples(index=False, name=None):
+        ws.append(row)
+    if with_keys:
+        for jid, h in output_keys(new_rows).itertuples(index=False, name=None):
+            keys.append((jid, h))
+            keys_ws.cell(row=len(keys) + 1, column=1, value=jid)
+            keys_ws.cell(row=len(keys) + 1, column=2, value=h)
+    _update_summaries(book, ws, header, summary, new_rows)
+    _set_watermark(book, last_oid, [h for _, h in keys] if with_keys else None)
+    book.save(excel_path)
+    return ws.max_row - 1
+
+def _keys_sheet(book, ws, header: list) -> Tuple[object, List[tuple]]:
+    """
+    The '_keys' sheet (created hidden if missing) and the (journal_id, row_hash) of each
+    row of the data sheet `ws`, padded with (None, None) for rows written before keys
+    were kept. Keys follow the rows' ID_COL (see align_keys): if rows were sorted or
+    deleted in Drive, '_keys' is rewritten in the new order, and rows missing an id get
+    the one of their positional key.
+    """
+    if KEYS_SHEET in book.sheetnames:
+        keys_ws = book[KEYS_SHEET]
+    else:
+        keys_ws = book.create_sheet(KEYS_SHEET)
+        keys_ws.sheet_state = "hidden"
+    keys_ws["A1"], keys_ws["B1"] = KEY_COLS
+    stored = [(r[0], r[1] if len(r) > 1 else None)
+              for r in keys_ws.iter_rows(min_row=2, max_col=2, values_only=True)]
+    data_rows = ws.max_row - 1
+    positional = stored[:data_rows] + [(None, None)] * (data_rows - len(stored))
+    if ID_COL not in header:
+        return keys_ws, positional
+    col = header.index(ID_COL) + 1
+    ids = [r[0] for r in ws.iter_rows(min_row=2, max_row=data_rows + 1, min_col=col, max_col=col, values_only=True)]
+    keys = align_keys(ids, stored)
+    for pos, (jid, _) in enumerate(keys):
+        if jid and not ids[pos]:
+            ws.cell(row=pos + 2, column=col, value=jid)
+    if keys != positional or len(stored) > data_rows:
+        log.info("🔧 Data rows were moved or deleted in Drive; realigning %s", KEYS_SHEET)
+        keys_ws.delete_rows(2, keys_ws.max_row)
+        for jid, h in keys:
+            keys_ws.append((jid, h))
+    return keys_ws, keys
+
+def _hide_id_column(ws, col: int) -> None:
+    ws.column_dimensions[openpyxl.utils.get_column_letter(col)].hidden = True
+
+def _output_sheet(book, with_ids: bool = False) -> Tuple[object, list]:
+    """
+    The data sheet of an openpyxl book and its header, completed with any missing
+    FINAL_COLS (and with the hidden ID_COL if `with_ids`).
+    """
+    names = [n for n in book.sheetnames if not n.startswith("_")]
+    ws = book[names[0]] if names else book.create_sheet("Sheet1", 0)
+    header = [c.value for c in next(ws.iter_rows(min_row=1, max_row=1))]
+    while header and header[-1] is None:
+        header.pop()
+    if not header:
+        ws.delete_rows(1)
+    # Columns missing from an older file are added to the header; old rows stay blank
+    for c in FINAL_COLS + ([ID_COL] if with_ids else []):
+        if c not in header:
+            header.append(c)
+            ws.cell(row=1, column=len(header), value=c)
+    if ID_COL in header:
+        _hide_id_column(ws, header.index(ID_COL) + 1)
+    return ws, header
+
+def _sheet_values(rows: pd.DataFrame, header: list) -> pd.DataFrame:
+    frame = rows.reindex(columns=header).astype(object)
+    return frame.where(frame.notna(), None)
+
+def _set_watermark(book, last_oid: Optional[str], hashes: Optional[list] = None) -> None:
+    if last_oid:
+        wm = book["_watermark"] if "_watermark" in book.sheetnames else book.create_sheet("_watermark")
+        wm["A1"], wm["A2"] = "last_oid", last_oid
+        if hashes is not None:
+            wm["B1"], wm["B2"] = "digest", output_digest(hashes, last_oid)
+        wm.sheet_state = "hidden"
+
+def merge_output(excel_path: str, content: Optional[bytes], new_rows: pd.DataFrame,
+                 last_oid: Optional[str], summary: str = "none") -> Tuple[int, int, int, bool]:
+    """
+    Upsert `new_rows` (FINAL_COLS + journal_id) into the workbook `content` by journal_id.
+    Each data row's journal_id (hidden ID_COL) and row hash ('_keys', see _keys_sheet)
+    give a dict that locates a journal in O(1): rows whose hash is unchanged are not
+    touched, changed ones are overwritten in place (keeping their manually edited Status)
+    and new ones are appended. Nothing is written when nothing (not even the watermark)
+    changed. The replaced values of updated rows are taken out of incremental summaries.
+    Returns (data rows in the file, rows inserted, rows updated, file written).
+    """
+    new_rows = new_rows.drop_duplicates("journal_id", keep="last")
+    if content:
+        book = openpyxl.load_workbook(io.BytesIO(content))
+    else:
+        book = openpyxl.Workbook()
+        book.active.title = "Sheet1"
+    ws, header = _output_sheet(book, with_ids=True)
+    # Rows written before keys were kept have none: they are left as they are
+    keys_ws, keys = _keys_sheet(book, ws, header)
+    index = {k[0]: i for i, k in enumerate(keys) if k[0]}
+    keep_col = header.index("Status") + 1 if "Status" in header else None
+
+    inserted = updated = 0
+    added, removed = [], []
+    values = _sheet_values(new_rows, header).itertuples(index=False, name=None)
+    for (jid, h), row in zip(output_keys(new_rows).itertuples(index=False, name=None), values):
+        pos = index.get(jid)
+        if pos is not None and keys[pos][1] == h:
+            continue
+        if summary != "none":
+            added.append(row)
+            if pos is not None:
+                removed.append(tuple(c.value for c in ws[pos + 2][:len(header)]))
+        if pos is None:
+            ws.append(row)
+            pos = index[jid] = len(keys)
+            keys.append((jid, h))
+            keys_ws.cell(row=pos + 2, column=1, value=jid)
+            inserted += 1
+        else:
+            for col, v in enumerate(row, 1):
+                if col != keep_col:
+                    ws.cell(row=pos + 2, column=col, value=v)
+            keys[pos] = (jid, h)
+            updated += 1
+        keys_ws.cell(row=pos + 2, column=2, value=h)
+
+    old_watermark = book["_watermark"]["A2"].value if "_watermark" in book.sheetnames else None
+    changed = bool(inserted or updated or not content or (last_oid and last_oid != old_watermark))
+    if changed:
+        _update_summaries(book, ws, header, summary, pd.DataFrame(added, columns=header),
+                          pd.DataFrame(removed, columns=header))
+        _set_watermark(book, last_oid, [h for _, h in keys])
+        book.save(excel_path)
+    return ws.max_row - 1, inserted, updated, changed
+
+def get_watermark(drive, folder_id: str, excel_name: str,
+                  workbook: Optional[DriveWorkbook] = None) -> Optional[str]:
+    """
+    Read watermark from the workbook's hidden sheet (one download, one parse).
     If not found, try migration from journal_id column.
     """
+    workbook = workbook or DriveWorkbook(drive, excel_name, folder_id)
     try:
-        existing = download_excel(drive, excel_name, folder_id)
-        if existing.empty:
+        if not workbook.content():
             return None
-        
-        # Try to download the full Excel file (with all sheets) to check for watermark
-        fid = find_file_id(drive, excel_name, folder_id)
-        if not fid:
-            return None
-        
-        buf = io.BytesIO()
-        req = drive.files().get_media(fileId=fid)
-        downloader = MediaIoBaseDownload(buf, req)
-        done = False
-        while True:
-            try:
-                _, done = downloader.next_chunk()
-                if done: break
-            except HttpError:
-                break
-        buf.seek(0)
-        
-        # Save to temp file to read with openpyxl
-        tmp_read = "tmp_read.xlsx"
-        with open(tmp_read, "wb") as f:
-            f.write(buf.read())
-        
+
         # Try to get watermark from hidden sheet
-        watermark = get_watermark_from_excel(tmp_read)
+        watermark = workbook.watermark()
         if watermark:
             log.info("ℹ️ Found watermark in Excel: %s", watermark)
             return watermark
         
         # Migration: Try to get from journal_id column
         log.info("ℹ️ No watermark found. Attempting migration from journal_id column...")
+        existing = workbook.data_frame()
         if not existing.empty and "journal_id" in existing.columns:
-            oids = []
-            for s in existing["journal_id"].astype(str):
-                try:
-                    oids.append(ObjectId(s))
-                except Exception:
-                    continue
-            if oids:
-                last_oid = str(max(oids))
+            # Hex ObjectIds of one length sort like the ObjectIds themselves
+            oids = existing["journal_id"].dropna().astype(str).str.lower()
+            oids = oids[oids.str.fullmatch(r"[0-9a-f]{24}")]
+            if not oids.empty:
+                last_oid = oids.max()
                 log.info("✅ Migrated watermark from journal_id: %s", last_oid)
                 return last_oid
+    except DriveTransferError:
+        # No watermark because Drive failed must not turn into a full refetch
+        raise
     except Exception as e:
         log.warning("Could not read watermark: %s", e)
     
     return None
 
-def fetch(db, last_oid: Optional[str]) -> Tuple[pd.DataFrame, Optional[str]]:
+# --- Pipeline State (watermark outside the workbook) ---
+
+STATE_COL = "pipeline_state"
+STATE_FILE = "pipeline_state.json"
+
+class PipelineState(abc.ABC):
+    """
+    One small record per output (keyed by its base name) holding the watermark.
+    Reads and writes are single O(1) operations that replace the record atomically,
+    so the workbook is not needed to know where to resume. The hidden '_watermark'
+    sheet is still written with the data, but only read to migrate from.
+    """
+    backend = ""
+
+    def __init__(self, key: str):
+        self.key = key
+
+    @abc.abstractmethod
+    def load(self) -> dict:
+        """The output's record ({} if there is none)."""
+
+    @abc.abstractmethod
+    def save(self, **values) -> None:
+        """Set `values` in the output's record."""
+
+    def watermark(self) -> Optional[str]:
+        return self.load().get("last_oid")
+
+    def set_watermark(self, last_oid: Optional[str]) -> None:
+        if last_oid:
+            self.save(last_oid=last_oid, updated_at=datetime.now(timezone.utc).isoformat())
+
+class MongoState(PipelineState):
+    """A document per output in the `pipeline_state` collection (lookup by _id)."""
+    backend = "mongo"
+
+    def __init__(self, db, key: str):
+        super().__init__(key)
+        self.coll = db[STATE_COL]
+
+    def load(self) -> dict:
+        return self.coll.find_one({"_id": self.key}, {"_id": 0}) or {}
+
+    def save(self, **values) -> None:
+        self.coll.update_one({"_id": self.key}, {"$set": values}, upsert=True)
+
+class FileState(PipelineState):
+    """A local JSON file ({key: record}), replaced atomically on every save."""
+    backend = "file"
+    _lock = threading.Lock()  # concurrent runs (run_batch) may share the file
+
+    def __init__(self, path: str, key: str):
+        super().__init__(key)
+        self.path = path
+
+    def _records(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def load(self) -> dict:
+        return self._records().get(self.key, {})
+
+    def save(self, **values) -> None:
+        with self._lock:
+            records = self._records()
+            records[self.key] = {**records.get(self.key, {}), **values}
+            _write_atomic(self.path, json.dumps(records, indent=2))
+
+class DriveState(PipelineState):
+    """appProperties of the output file itself: no extra storage, but no state before the file exists."""
+    backend = "drive"
+
+    def __init__(self, workbook: DriveWorkbook):
+        super().__init__(workbook.name)
+        self.workbook = workbook
+
+    def load(self) -> dict:
+        if not self.workbook.file_id:
+            return {}
+        r = self.workbook.drive.files().get(fileId=self.workbook.file_id, fields="appProperties").execute()
+        return r.get("appProperties") or {}
+
+    def save(self, **values) -> None:
+        self.workbook.drive.files().update(fileId=self.workbook.file_id, body={"appProperties": values},
+                                           fields="id").execute()
+
+def open_state(backend: str, key: str, db=None, workbook: Optional[DriveWorkbook] = None,
+               path: str = STATE_FILE) -> Optional[PipelineState]:
+    """STATE_BACKEND: excel (legacy, no separate state), mongo, file or drive."""
+    if backend in ("", "excel"):
+        return None
+    if backend == "mongo":
+        return MongoState(db, key)
+    if backend == "file":
+        return FileState(path, key)
+    if backend == "drive":
+        return DriveState(workbook)
+    raise SystemExit(f"Unknown STATE_BACKEND: {backend} (excel, mongo, file or drive)")
+
+def read_watermark(state: Optional[PipelineState], legacy: Callable[[], Optional[str]]) -> Optional[str]:
+    """
+    Watermark from the state store. Only if it has none is `legacy` (the workbook's
+    '_watermark' sheet) read, and its value migrated into the store.
+    """
+    if state:
+        watermark = state.watermark()
+        if watermark:
+            log.info("ℹ️ Found watermark in %s state: %s", state.backend, watermark)
+            return watermark
+    watermark = legacy()
+    if state and watermark:
+        state.set_watermark(watermark)
+        log.info("📦 Migrated watermark to %s state", state.backend)
+    return watermark
+
+# --- Flat View (JOIN_ENGINE=flat) ---
+# `journals_flat` holds agg_pipeline's joined rows, one document per finished journal
+# (keyed by its _id), maintained on the server with $merge. Each run only merges the
+# journals past the view's own watermark plus those whose user or location changed, so
+# the export itself is an indexed read with no $lookup.
+
+FLAT_COL = "journals_flat"
+# (dimension collection, fields the rows use, journal field referencing it)
+FLAT_DIMENSIONS = ((USERS_COL, USER_FIELDS, "uid"), (LOCATIONS_COL, LOCATION_FIELDS, "locationId"))
+FLAT_MERGE_IDS = 1000
+
+def flat_pipeline(match: dict, limit: Optional[int] = None):
+    return _range_head(match, limit) + [{"$project": {"end_time": 0}}]
+
+def merge_flat(db, match: dict) -> None:
+    """Join the journals matching `match` and upsert their rows into journals_flat."""
+    db[JOURNALS_COL].aggregate(agg_pipeline(match) + [
+        {"$addFields": {"_id": {"$toObjectId": "$journal_id"}, "end_time": "$End Date Time"}},
+        {"$merge": {"into": FLAT_COL, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True)
+
+def _dimension_changes(db, coll: str, fields: dict) -> Tuple[List[dict], List[ObjectId]]:
+    """
+    (changed, deleted) documents of a dimension since the last refresh, found by comparing
+    the fields the rows use with a snapshot collection (`journals_flat_<coll>`).
+    """
+    snapshot = f"{FLAT_COL}_{coll}"
+    changed = list(db[coll].aggregate([
+        {"$project": {"v": {k: f"${k}" for k in fields}}},
+        {"$lookup": {"from": snapshot, "localField": "_id", "foreignField": "_id", "as": "prev"}},
+        {"$unwind": {"path": "$prev", "preserveNullAndEmptyArrays": True}},
+        {"$match": {"$expr": {"$ne": ["$v", {"$ifNull": ["$prev.v", None]}]}}},
+        {"$project": {"prev": 0}},
+    ], allowDiskUse=True))
+    deleted = [d["_id"] for d in db[snapshot].aggregate([
+        {"$lookup": {"from": coll, "localField": "_id", "foreignField": "_id", "as": "src"}},
+        {"$match": {"src": []}},
+        {"$project": {"_id": 1}},
+    ])]
+    return changed, deleted
+
+def _store_snapshot(db, coll: str, changed: List[dict], deleted: List[ObjectId]) -> None:
+    snapshot = db[f"{FLAT_COL}_{coll}"]
+    ops = [pymongo.ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in changed]
+    ops += [pymongo.DeleteOne({"_id": i}) for i in deleted]
+    for i in range(0, len(ops), FLAT_MERGE_IDS):
+        snapshot.bulk_write(ops[i:i + FLAT_MERGE_IDS], ordered=False)
+
+def refresh_flat_view(db, rebuild: bool = False) -> Optional[str]:
+    """
+    Bring journals_flat up to date: merge the journals newer than its watermark (kept in
+    pipeline_state under "journals_flat"), then re-merge the journals of every user or
+    location changed since the last refresh. Journals passed by the watermark while
+    still in progress are kept in the same record ("pending") and merged once they
+    have an end_time. Dimension snapshots are stored last, so a change made during the
+    refresh is picked up by the next one. rebuild=True re-merges every journal.
+    Returns the watermark.
+    """
+    state = MongoState(db, FLAT_COL)
+    record = {} if rebuild else state.load()
+    last = record.get("last_oid")
+    db[FLAT_COL].create_index([("end_time", 1), ("_id", 1)], name="end_time_id")
+    changes = {coll: _dimension_changes(db, coll, fields) for coll, fields, _ in FLAT_DIMENSIONS}
+    # Journals still in progress at an earlier refresh: merged now if they have finished
+    pending = [ObjectId(x) for x in record.get("pending", [])]
+    for i in range(0, len(pending), FLAT_MERGE_IDS):
+        merge_flat(db, {"end_time": {"$ne": None}, "_id": {"$in": pending[i:i + FLAT_MERGE_IDS]}})
+    pending = [d["_id"] for d in db[JOURNALS_COL].find({"_id": {"$in": pending}, "end_time": None}, {"_id": 1})]
+    # Newest finished journal, as in the export's own watermark
+    newest = db[JOURNALS_COL].find_one({"end_time": {"$ne": None}}, {"_id": 1}, sort=[("_id", -1)])
+    if newest and (not last or newest["_id"] > ObjectId(last)):
+        merge_flat(db, _fetch_match(last, {"$lte": newest["_id"]}))
+        passed = {"$lt": newest["_id"], **({"$gt": ObjectId(last)} if last else {})}
+        pending += [d["_id"] for d in db[JOURNALS_COL].find({"_id": passed, "end_time": None}, {"_id": 1})]
+    if last:
+        # A first build already joined the current dimensions
+        for coll, _, ref in FLAT_DIMENSIONS:
+            changed, deleted = changes[coll]
+            ids = [d["_id"] for d in changed] + deleted
+            for i in range(0, len(ids), FLAT_MERGE_IDS):
+                part = ids[i:i + FLAT_MERGE_IDS]
+                merge_flat(db, {"end_time": {"$ne": None}, ref: {"$in": part + [str(x) for x in part]}})
+    for coll, (changed, deleted) in changes.items():
+        _store_snapshot(db, coll, changed, deleted)
+    state.save(pending=[str(x) for x in pending])
+    if newest:
+        state.set_watermark(str(newest["_id"]))
+    log.info("🧩 Refreshed %s up to %s (%s; %d journals in progress)", FLAT_COL, newest["_id"] if newest else None,
+             ", ".join(f"{len(c) + len(d)} {coll} changed" for coll, (c, d) in changes.items()), len(pending))
+    return str(newest["_id"]) if newest else last
+
+def _fetch_match(last_oid: Optional[str], id_bounds: Optional[dict] = None,
+                 journal_filter: Optional[dict] = None) -> dict:
     match = {"end_time": {"$ne": None}}
+    if journal_filter:
+        # Under $and so its own _id/end_time conditions cannot clash with the range below
+        match["$and"] = [journal_filter]
+    if id_bounds:
+        match["_id"] = dict(id_bounds)
     if last_oid:
         try:
-            match["_id"] = {"$gt": ObjectId(last_oid)}
+            match["_id"] = {**match.get("_id", {}), "$gt": ObjectId(last_oid)}
         except Exception:
             log.warning("Invalid last_oid; running full fetch.")
-    docs = list(db[JOURNALS_COL].aggregate(agg_pipeline(match)))
-    
-    if not docs:
+    return match
+
+def _page_last_oid(doc: dict) -> ObjectId:
+    return doc["_id"] if "_id" in doc else ObjectId(doc["journal_id"])
+
+def iter_pages(coll, make_pipeline, match: dict, page_size: int) -> Iterator[List[dict]]:
+    """
+    Keyset pagination on native `_id`: each page is `_id > last` sorted by `_id`
+    with `$limit page_size`, i.e. an indexed range scan of fixed size.
+    """
+    last = None
+    while True:
+        page_match = dict(match)
+        if last is not None:
+            page_match["_id"] = {**match.get("_id", {}), "$gt": last}
+        page = list(coll.aggregate(make_pipeline(page_match, page_size), batchSize=page_size))
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        last = _page_last_oid(page[-1])
+
+def iter_raw_chunks(db, last_oid: Optional[str], batch_size: int = FETCH_BATCH_SIZE,
+                    join_engine: str = "lookup", caches=None, transform: str = "client",
+                    id_bounds: Optional[dict] = None, journal_filter: Optional[dict] = None
+                    ) -> Iterator[Tuple[pd.DataFrame, str]]:
+    """
+    Stream the journals in pages of `batch_size` documents, in `_id` order.
+    Yields (raw_chunk, chunk_last_oid). Only one page of dicts is alive at a time.
+    join_engine: "lookup" (server-side $lookup), "bulk" (cached $in join, see bulk_join)
+                 or "flat" (read journals_flat, see refresh_flat_view).
+    transform: "server" only applies to the lookup engine (see server_transform_stages).
+    id_bounds: extra `_id` condition, e.g. {"$gte": lo, "$lt": hi} for one backfill range.
+    journal_filter: extra query on the journals (JOURNAL_FILTER; on the rows with "flat").
+    """
+    match = _fetch_match(last_oid, id_bounds, journal_filter)
+    coll = db[JOURNALS_COL]
+    if join_engine == "flat":
+        # Only finished journals are in the view; the _id range alone is the indexed read
+        match.pop("end_time")
+        for page in iter_pages(db[FLAT_COL], flat_pipeline, match, batch_size):
+            yield pd.DataFrame(page, columns=PROJECT_COLS), str(page[-1]["_id"])
+        return
+    if join_engine == "bulk":
+        users, locations = caches or dimension_caches(db)
+        for page in iter_pages(coll, journal_pipeline, match, batch_size):
+            yield bulk_join(page, users, locations), str(page[-1]["_id"])
+        log.info("Dimension cache: users %d hits/%d misses, locations %d hits/%d misses",
+                 users.hits, users.misses, locations.hits, locations.misses)
+        return
+
+    pipeline = lambda m, limit: agg_pipeline(m, limit, transform)
+    for page in iter_pages(coll, pipeline, match, batch_size):
+        yield pd.DataFrame(page), str(_page_last_oid(page[-1]))
+
+def _plan_stages(node, in_winning: bool = False) -> List[str]:
+    stages = []
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == "stage" and in_winning and isinstance(v, str):
+                stages.append(v)
+            elif k != "rejectedPlans":
+                stages += _plan_stages(v, in_winning or k == "winningPlan")
+    elif isinstance(node, list):
+        for v in node:
+            stages += _plan_stages(v, in_winning)
+    return stages
+
+def _plan_values(node, keys: Tuple[str, ...]) -> list:
+    """All values stored under any of `keys`, anywhere in an explain document."""
+    if isinstance(node, dict):
+        return [v for k, v in node.items() if k in keys] + \
+               [x for v in node.values() for x in _plan_values(v, keys)]
+    if isinstance(node, list):
+        return [x for v in node for x in _plan_values(v, keys)]
+    return []
+
+def explain_fetch_plan(db, last_oid: Optional[str] = None, page_size: int = FETCH_BATCH_SIZE) -> List[str]:
+    """
+    Explain the first fetch page and return the winning plan's stage names.
+    An index-friendly plan contains IXSCAN (on `_id`) and no blocking SORT.
+    """
+    cmd = {"aggregate": JOURNALS_COL, "pipeline": agg_pipeline(_fetch_match(last_oid), page_size), "cursor": {}}
+    return _plan_stages(db.command("explain", cmd, verbosity="queryPlanner"))
+
+def check_fetch_plan(db, last_oid: Optional[str] = None, page_size: int = FETCH_BATCH_SIZE) -> bool:
+    stages = explain_fetch_plan(db, last_oid, page_size)
+    ok = "IXSCAN" in stages and "SORT" not in stages
+    if ok:
+        log.info("Fetch plan uses the _id index: %s", " > ".join(stages))
+    else:
+        log.warning("Fetch plan is not an indexed range scan: %s", " > ".join(stages) or "(no plan)")
+    return ok
+
+def fetch_chunks(db, last_oid: Optional[str], batch_size: int = FETCH_BATCH_SIZE,
+                 join_engine: str = "lookup", transform: str = "client",
+                 id_bounds: Optional[dict] = None, clocks: Optional[Dict] = None,
+                 journal_filter: Optional[dict] = None) -> Iterator[Tuple[pd.DataFrame, str]]:
+    """
+    Yields (cleaned_chunk, chunk_last_oid) per batch. The watermark advances per chunk,
+    so a consumer may commit progress after any chunk it has fully handled.
+    clocks: optional name → StageClock; "fetch" and "clean" get the time spent in each.
+    """
+    clocks = clocks if clocks is not None else {}
+    for name in ("fetch", "clean"):
+        clocks.setdefault(name, StageClock(name))
+    cleaner, transform = _chunk_cleaner(join_engine, transform)
+    raw_chunks = iter_raw_chunks(db, last_oid, batch_size, join_engine, transform=transform, id_bounds=id_bounds,
+                                 journal_filter=journal_filter)
+    for raw, chunk_last_oid in _clocked(raw_chunks, clocks["fetch"]):
+        t0 = time.perf_counter()
+        cleaned = cleaner(raw)
+        clocks["clean"].add(busy=time.perf_counter() - t0, items=1)
+        yield cleaned, chunk_last_oid
+
+def _chunk_cleaner(join_engine: str, transform: str):
+    """(raw chunk → FINAL_COLS function, effective transform) for an engine/transform pair."""
+    if transform == "server" and join_engine == "lookup":
+        return server_rows, "server"
+    return clean, "client"
+
+# --- Parallel Backfill (RUN_MODE=full, BACKFILL_WORKERS > 1) ---
+
+def split_id_ranges(coll, k: int) -> List[dict]:
+    """
+    Split the journals' `_id` space into `k` ranges of equal ObjectId-timestamp width,
+    from two indexed lookups (min and max `_id`). If the ids span too little time for
+    that, fall back to `$bucketAuto` over `_id`. Returns `_id` bounds for each range.
+    """
+    first = coll.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+    last = coll.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if not first:
+        return []
+    lo, hi = first["_id"].generation_time, last["_id"].generation_time
+    step = (hi - lo) / k
+    cuts = sorted({ObjectId.from_datetime(lo + step * i) for i in range(1, k)})
+    cuts = [c for c in cuts if first["_id"] < c <= last["_id"]]
+    if len(cuts) < k - 1:
+        buckets = coll.aggregate([{"$bucketAuto": {"groupBy": "$_id", "buckets": k}}])
+        cuts = [b["_id"]["min"] for b in buckets][1:]
+    edges = [None] + cuts + [None]
+    return [{op: v for op, v in (("$gte", a), ("$lt", b)) if v is not None} for a, b in zip(edges, edges[1:])]
+
+def _backfill_range(mongo_uri: str, db_name: str, id_bounds: dict, batch_size: int,
+                    join_engine: str, transform: str, spill_dir: str,
+                    journal_filter: Optional[dict] = None, target: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Worker: fetch + clean one `_id` range with its own small connection pool. Each
+    cleaned batch is pickled to `spill_dir` as soon as it is ready, so the worker holds
+    one batch at a time. Returns [(file, chunk_last_oid)] in `_id` order.
+    `target` is the batch target being run (log prefix).
+    """
+    _run_context.target = target
+    client = pymongo.MongoClient(mongo_uri, tz_aware=True, maxPoolSize=2)
+    try:
+        parts = []
+        for chunk, chunk_last_oid in fetch_chunks(client[db_name], None, batch_size, join_engine,
+                                                  transform, id_bounds, journal_filter=journal_filter):
+            path = os.path.join(spill_dir, f"{chunk_last_oid}.pkl")
+            chunk[FINAL_COLS + ["journal_id"]].to_pickle(path)
+            parts.append((path, chunk_last_oid))
+        return parts
+    finally:
+        client.close()
+
+def parallel_backfill(mongo_uri: str, db, workers: int, batch_size: int = FETCH_BATCH_SIZE,
+                      join_engine: str = "lookup", transform: str = "client",
+                      journal_filter: Optional[dict] = None) -> Iterator[Tuple[pd.DataFrame, str]]:
+    """
+    Full backfill across `workers` processes, one `_id` range each. Yields
+    (cleaned_chunk, chunk_last_oid) in `_id` order, like fetch_chunks. Workers spill
+    their batches to a temp directory and the batches are read back one at a time:
+    a range finished ahead of its turn waits on disk, not in memory, so peak memory
+    is about one batch per process whatever the collection size.
+    """
+    ranges = split_id_ranges(db[JOURNALS_COL], workers)
+    log.info("Backfill: %d _id ranges across %d workers", len(ranges), workers)
+    ctx = multiprocessing.get_context("spawn")  # no fork of a live MongoClient
+    spill_dir = tempfile.mkdtemp(prefix="nc-backfill-")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [pool.submit(_backfill_range, mongo_uri, db.name, bounds, batch_size, join_engine,
+                                   transform, spill_dir, journal_filter, getattr(_run_context, "target", None))
+                       for bounds in ranges]
+            try:
+                for f in futures:
+                    for path, last in f.result():
+                        chunk = pd.read_pickle(path)
+                        os.remove(path)
+                        yield chunk, last
+            finally:
+                # Stopped early (an error, or the consumer gave up): ranges not started are dropped
+                pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+# --- Staged Executor (PIPELINE_OVERLAP) ---
+# fetch (Mongo pages) → clean workers → write (the caller), joined by bounded queues.
+# pymongo releases the GIL while waiting on the socket, so cleaning overlaps network time.
+
+_DONE = object()
+
+class StageClock:
+    """Busy (working) vs idle (blocked on a neighbouring stage) seconds of one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.busy = self.idle = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float = 0.0, idle: float = 0.0, items: int = 0):
+        with self._lock:
+            self.busy += busy
+            self.idle += idle
+            self.items += items
+
+    def summary(self) -> str:
+        return f"{self.name}: busy {self.busy:.2f}s, idle {self.idle:.2f}s, {self.items} items"
+
+def stage_clocks(*names: str) -> Dict[str, StageClock]:
+    return {n: StageClock(n) for n in names}
+
+def _clocked(items, clock: StageClock):
+    """Yield from `items`, adding the time spent producing each one to `clock`."""
+    it = iter(items)
+    while True:
+        t0 = time.perf_counter()
+        item = next(it, _DONE)
+        clock.add(busy=time.perf_counter() - t0)
+        if item is _DONE:
+            return
+        clock.add(items=1)
+        yield item
+
+def _put(q: queue.Queue, item, clock: StageClock, stop: threading.Event) -> bool:
+    """Blocking put that gives up (False) once `stop` is set; waiting time counts as idle."""
+    t0 = time.perf_counter()
+    try:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    finally:
+        clock.add(idle=time.perf_counter() - t0)
+
+def _get(q: queue.Queue, clock: StageClock, stop: threading.Event):
+    """Blocking get that returns _DONE once `stop` is set; waiting time counts as idle."""
+    t0 = time.perf_counter()
+    try:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+    finally:
+        clock.add(idle=time.perf_counter() - t0)
+
+def staged_chunks(raw_chunks: Iterator[Tuple[pd.DataFrame, str]], cleaner, workers: int = 2,
+                  depth: int = 4, clocks: Optional[Dict[str, StageClock]] = None
+                  ) -> Iterator[Tuple[pd.DataFrame, str]]:
+    """
+    Overlapped `(cleaner(raw), last) for raw, last in raw_chunks`: one thread drains
+    `raw_chunks`, `workers` threads clean, and chunks are yielded in fetch order.
+    At most `depth` chunks wait between two stages, so memory stays bounded when one
+    stage is slower than the other. Busy/idle time goes to clocks "fetch", "clean"
+    and "write" (the caller's time between chunks).
+    """
+    clocks = clocks if clocks is not None else {}
+    for name in ("fetch", "clean", "write"):
+        clocks.setdefault(name, StageClock(name))
+    fetch_clock, clean_clock, write_clock = clocks["fetch"], clocks["clean"], clocks["write"]
+    raw_q, out_q = queue.Queue(depth), queue.Queue(depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for seq, item in enumerate(_clocked(raw_chunks, fetch_clock)):
+                if not _put(raw_q, (seq,) + tuple(item), fetch_clock, stop):
+                    break
+        except BaseException as e:
+            _put(out_q, (None, None, None, e), fetch_clock, stop)
+        finally:
+            for _ in range(workers):
+                _put(raw_q, _DONE, fetch_clock, stop)
+
+    def work():
+        while True:
+            item = _get(raw_q, clean_clock, stop)
+            if item is _DONE:
+                break
+            seq, raw, last = item
+            t0 = time.perf_counter()
+            try:
+                result = (seq, cleaner(raw), last, None)
+            except BaseException as e:
+                result = (seq, None, None, e)
+            clean_clock.add(busy=time.perf_counter() - t0, items=1)
+            if not _put(out_q, result, clean_clock, stop) or result[3] is not None:
+                break
+        _put(out_q, _DONE, clean_clock, stop)
+
+    threads = [threading.Thread(target=_in_run_context(produce), name="nc-fetch", daemon=True)]
+    threads += [threading.Thread(target=_in_run_context(work), name=f"nc-clean-{i}", daemon=True)
+                for i in range(workers)]
+    for t in threads:
+        t.start()
+    pending, next_seq, finished = {}, 0, 0
+    try:
+        while finished < workers:
+            item = _get(out_q, write_clock, stop)
+            if item is _DONE:
+                finished += 1
+                continue
+            seq, cleaned, last, err = item
+            if err is not None:
+                raise err
+            pending[seq] = (cleaned, last)
+            while next_seq in pending:
+                t0 = time.perf_counter()
+                yield pending.pop(next_seq)
+                write_clock.add(busy=time.perf_counter() - t0, items=1)
+                next_seq += 1
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+def fetch_chunks_staged(db, last_oid: Optional[str], batch_size: int = FETCH_BATCH_SIZE,
+                        join_engine: str = "lookup", transform: str = "client", workers: int = 2,
+                        depth: int = 4, clocks: Optional[Dict[str, StageClock]] = None,
+                        journal_filter: Optional[dict] = None) -> Iterator[Tuple[pd.DataFrame, str]]:
+    """fetch_chunks with fetching and cleaning overlapped (see staged_chunks)."""
+    cleaner, transform = _chunk_cleaner(join_engine, transform)
+    raw = iter_raw_chunks(db, last_oid, batch_size, join_engine, transform=transform, journal_filter=journal_filter)
+    return staged_chunks(raw, cleaner, workers, depth, clocks)
+
+# --- Run Metrics (RUN_REPORT_PATH / RUN_HISTORY_PATH / METRICS_PROM_PATH) ---
+
+REGRESSION_WINDOW, REGRESSION_RATIO = 20, 2.0
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+
+def mongo_stats(db, last_oid: Optional[str] = None, page_size: int = FETCH_BATCH_SIZE,
+                explain: bool = False) -> dict:
+    """
+    Journals collection size from $collStats and, if `explain`, the server's execution
+    time for the first fetch page (explain executionStats re-runs that page).
+    """
+    stats = {}
+    try:
+        cs = next(db[JOURNALS_COL].aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+        stats["collection"] = {k: cs.get(k) for k in ("count", "size", "avgObjSize", "storageSize")}
+        if explain:
+            cmd = {"aggregate": JOURNALS_COL, "pipeline": agg_pipeline(_fetch_match(last_oid), page_size), "cursor": {}}
+            plan = db.command("explain", cmd, verbosity="executionStats")
+            found = _plan_values(plan, ("executionTimeMillis", "executionTimeMillisEstimate"))
+            stats["first_page_server_ms"] = max(found) if found else None
+    except Exception as e:
+        log.warning("Could not read Mongo stats: %s", e)
+    return stats
+
+class RunMetrics:
+    """
+    Timers, counters and resource usage of one run, written as a JSON report.
+    `stage(name)` times a block; the StageClocks in `clocks` are shared with the
+    fetch/clean stages so overlapped runs report busy and idle time per stage.
+    """
+
+    def __init__(self, run_mode: str):
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self.run_mode = run_mode
+        self.status = "RUNNING"
+        self.new_records = self.total_records = 0
+        self.watermark = self.error = None
+        self.clocks = stage_clocks("connect", "watermark", "drive", "fetch", "clean", "write", "serialise", "upload")
+        self.mongo = {}
+        self.transfers = []
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.clocks.setdefault(name, StageClock(name)).add(busy=time.perf_counter() - t0, items=1)
+
+    def report(self) -> dict:
+        stages = {n: {"busy_seconds": round(c.busy, 3), "idle_seconds": round(c.idle, 3), "items": c.items}
+                  for n, c in self.clocks.items() if c.items}
+        downloads = [m for m in self.transfers if m["kind"] == "download"]
+        if downloads:
+            stages["download"] = {"busy_seconds": round(sum(m["seconds"] for m in downloads), 3),
+                                  "idle_seconds": 0.0, "items": len(downloads)}
+        return {
+            "status": self.status,
+            "run_mode": self.run_mode,
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": round(time.perf_counter() - self._t0, 3),
+            "new_records": self.new_records,
+            "total_records": self.total_records,
+            "watermark": self.watermark,
+            "error": self.error,
+            "stages": stages,
+            "drive": {kind: {"bytes": sum(m["bytes"] for m in self.transfers if m["kind"] == kind),
+                             "retries": sum(m["retries"] for m in self.transfers if m["kind"] == kind)}
+                      for kind in ("download", "upload")},
+            "peak_rss_mb": _peak_rss_mb(),
+            "mongo": self.mongo,
+        }
+
+    def write(self, report_path: str, history_path: str = "", prom_path: str = "") -> dict:
+        report = self.report()
+        if history_path:
+            report["regression"] = check_regression(report, history_path)
+            with open(history_path, "a") as f:
+                f.write(json.dumps(report) + "\n")
+        if report_path:
+            _write_atomic(report_path, json.dumps(report, indent=2))
+        if prom_path:
+            _write_atomic(prom_path, prometheus_text(report))
+        return report
+
+def _write_atomic(path: str, text: str) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def check_regression(report: dict, history_path: str) -> Optional[dict]:
+    """Compare this run's duration with the median of recent successful runs of the same mode."""
+    if report["status"] != "SUCCESS" or not os.path.exists(history_path):
+        return None
+    with open(history_path) as f:
+        past = [json.loads(line) for line in f if line.strip()]
+    durations = sorted(r["duration_seconds"] for r in past[-REGRESSION_WINDOW:]
+                       if r.get("status") == "SUCCESS" and r.get("run_mode") == report["run_mode"])
+    if len(durations) < 5:
+        return None
+    median = durations[len(durations) // 2]
+    ratio = report["duration_seconds"] / median if median else 0.0
+    if ratio >= REGRESSION_RATIO:
+        log.warning("🐢 Run took %.2fs, %.1fx the median of the last %d runs (%.2fs)",
+                    report["duration_seconds"], ratio, len(durations), median)
+    return {"median_seconds": median, "ratio": round(ratio, 2), "slow": ratio >= REGRESSION_RATIO}
+
+def prometheus_text(report: dict) -> str:
+    """The report as Prometheus textfile-collector gauges."""
+    lines = []
+    def gauge(name: str, value, labels: str = "", help_text: str = ""):
+        if value is None:
+            return
+        if help_text:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+        lines.append(f"{name}{labels} {value}")
+    gauge("nc_pipeline_success", int(report["status"] in ("SUCCESS", "NO_UPDATES")), help_text="1 if the last run succeeded")
+    gauge("nc_pipeline_last_run_timestamp_seconds", int(datetime.fromisoformat(report["started_at"]).timestamp()),
+          help_text="Start of the last run")
+    gauge("nc_pipeline_duration_seconds", report["duration_seconds"], help_text="Wall time of the last run")
+    gauge("nc_pipeline_rows", report["new_records"], '{kind="new"}', "Rows fetched / in the output file")
+    gauge("nc_pipeline_rows", report["total_records"], '{kind="total"}')
+    first = True
+    for name, s in report["stages"].items():
+        gauge("nc_pipeline_stage_busy_seconds", s["busy_seconds"], f'{{stage="{name}"}}',
+              "Busy time per stage" if first else "")
+        first = False
+    for kind, d in report["drive"].items():
+        gauge("nc_pipeline_drive_bytes", d["bytes"], f'{{direction="{kind}"}}',
+              "Bytes moved to/from Drive" if kind == "download" else "")
+    gauge("nc_pipeline_peak_rss_megabytes", report["peak_rss_mb"], help_text="Peak resident memory")
+    return "\n".join(lines) + "\n"
+
+def fetch(db, last_oid: Optional[str], join_engine: str = "lookup") -> Tuple[pd.DataFrame, Optional[str]]:
+    """Non-streaming fetch: the whole result as one raw DataFrame (kept for ad-hoc use)."""
+    chunks, new_last_oid = [], last_oid
+    for raw, chunk_last_oid in iter_raw_chunks(db, last_oid, join_engine=join_engine):
+        chunks.append(raw)
+        new_last_oid = chunk_last_oid
+    if not chunks:
         return pd.DataFrame(), last_oid
+    return pd.concat(chunks, ignore_index=True), new_last_oid
 
-    # Find the max ID in this batch to update watermark
-    # (Assuming sorted by journal_id in pipeline)
-    new_last_oid = docs[-1]["journal_id"]
-    return pd.DataFrame(docs), new_last_oid
+def _log_stages(clocks: Dict[str, StageClock]) -> None:
+    for clock in clocks.values():
+        if clock.items:
+            log.info("⏱️ Stage %s", clock.summary())
 
 def run_once(cfg: Dict = None):
     """
     Runs one end-to-end pass using cfg (dict) or env vars.
     Required keys/envs: MONGO_URI, DRIVE_FOLDER_ID, SA_JSON_PATH or DRIVE_SA_JSON
-    Optional: OUTPUT_NAME (default NC-DA-Journal-Data.xlsx), RUN_MODE (full|inc)
+    Optional: OUTPUT_NAME (default NC-DA-Journal-Data.xlsx), RUN_MODE (full|inc),
+              DB_NAME (default NC_dev_db), JOURNAL_FILTER (extra journals query, dict or Extended JSON),
+              FETCH_BATCH_SIZE (documents per streamed chunk, default 5000),
+              JOIN_ENGINE (lookup|bulk|flat, default lookup; flat refreshes and reads journals_flat),
+              CHECK_PLAN (true → log whether the fetch uses an _id IXSCAN),
+              OUTPUT_WRITE_MODE (rewrite|append|merge, default rewrite; merge upserts by journal_id),
+              OUTPUT_WRITER (frame|stream, default frame; stream writes rewrite-mode output
+                             chunk by chunk in constant memory, see StreamingOutputWriter),
+              OUTPUT_ROTATE (none|month, default none),
+              SUMMARY_SHEETS (none|incremental|full, default none; per user/park/state/month sheets),
+              TRANSFORM (client|server, default client; server needs JOIN_ENGINE=lookup),
+              STAGING_DIR (Parquet store of record; Excel is exported from it),
+              EXCEL_WINDOW_MONTHS (with STAGING_DIR: export only the newest N months, 0 = all),
+              DRIVE_MAX_ATTEMPTS / DRIVE_MAX_SECONDS / DRIVE_CHUNK_MB (Drive transfer retry budget),
+              BACKFILL_WORKERS (RUN_MODE=full: fetch/clean _id ranges in N processes, default 1),
+              PIPELINE_OVERLAP (true → overlap Drive prefetch, fetch and clean; see staged_chunks),
+              CLEAN_WORKERS / QUEUE_DEPTH (with PIPELINE_OVERLAP, default 2 / 4),
+              RUN_REPORT_PATH (JSON run report, default run_report.json; empty = off),
+              RUN_HISTORY_PATH (append each report as a JSON line; flags slow runs),
+              METRICS_PROM_PATH (Prometheus textfile), METRICS_EXPLAIN (true → Mongo server time)
+    RUN_MODE=stream hands over to run_stream (long-running, change stream driven).
     """
-    import time
     start_time = time.time()
-    
+    cfg = cfg or {}
+    if (cfg.get("RUN_MODE") or os.getenv("RUN_MODE", "inc")).lower() == "stream":
+        return run_stream(cfg)
+    metrics = RunMetrics((cfg.get("RUN_MODE") or os.getenv("RUN_MODE", "inc")).lower())
+    clocks = metrics.clocks
+    drive_bg = transfer = writer = None
+
     try:
-        cfg = cfg or {}
         mongo_uri       = _require(cfg, "MONGO_URI")
         drive_folder_id = _require(cfg, "DRIVE_FOLDER_ID")
         output_name     = cfg.get("OUTPUT_NAME") or os.getenv("OUTPUT_NAME", "NC-DA-Journal-Data.xlsx")
         run_mode        = (cfg.get("RUN_MODE") or os.getenv("RUN_MODE", "inc")).lower()
+        batch_size      = int(_setting(cfg, "FETCH_BATCH_SIZE", str(FETCH_BATCH_SIZE)))
+        join_engine     = _setting(cfg, "JOIN_ENGINE", "lookup").lower()
+        check_plan      = _setting(cfg, "CHECK_PLAN", "false").lower() == "true"
+        write_mode      = _setting(cfg, "OUTPUT_WRITE_MODE", "rewrite").lower()
+        rotate          = _setting(cfg, "OUTPUT_ROTATE", "none").lower()
+        transform       = _setting(cfg, "TRANSFORM", "client").lower()
+        staging_dir     = _setting(cfg, "STAGING_DIR", "")
+        window_months   = int(_setting(cfg, "EXCEL_WINDOW_MONTHS", "0"))
+        workers         = int(_setting(cfg, "BACKFILL_WORKERS", "1"))
+        overlap         = _setting(cfg, "PIPELINE_OVERLAP", "false").lower() == "true"
+        clean_workers   = int(_setting(cfg, "CLEAN_WORKERS", "2"))
+        queue_depth     = int(_setting(cfg, "QUEUE_DEPTH", "4"))
+        explain_stats   = _setting(cfg, "METRICS_EXPLAIN", "false").lower() == "true"
+        cache_dir       = _setting(cfg, "WORKBOOK_CACHE_DIR", "") or None
+        state_backend   = _setting(cfg, "STATE_BACKEND", "excel").lower()
+        state_path      = _setting(cfg, "STATE_PATH", STATE_FILE)
+        mongo_pool_size = int(_setting(cfg, "MONGO_MAX_POOL_SIZE", "10"))
+        mongo_compressors = _setting(cfg, "MONGO_COMPRESSORS", "zstd,snappy")
+        compact         = _setting(cfg, "COMPACT_FRAMES", "false").lower() == "true"
+        output_writer   = _setting(cfg, "OUTPUT_WRITER", "frame").lower()
+        summary_mode    = _setting(cfg, "SUMMARY_SHEETS", "none").lower()
+        db_name         = _setting(cfg, "DB_NAME", DB_NAME)
+        journal_filter  = _journal_filter(cfg)
+        if transform == "server" and join_engine != "lookup":
+            log.warning("TRANSFORM=server needs JOIN_ENGINE=lookup; cleaning on the client instead.")
+            transform = "client"
+        streaming = output_writer == "stream" and write_mode == "rewrite" and not staging_dir
+        if output_writer == "stream" and not streaming:
+            log.warning("OUTPUT_WRITER=stream applies to OUTPUT_WRITE_MODE=rewrite without STAGING_DIR; using frames.")
 
         sa_path = _ensure_sa_file(cfg)
-        drive, sa_email = _drive_client(sa_path)
+        drive, sa_email = clients.drive(sa_path)
+        transfer = DriveTransfer.from_cfg(cfg)
+
+        # Monthly rotation keeps each file (and so each run's cost) bounded
+        base_name = output_name
+        if rotate == "month":
+            output_name = partition_name(base_name, datetime.now(timezone.utc))
+
+        # One handle per run: the workbook is downloaded and parsed at most once
+        workbook = DriveWorkbook(drive, output_name, drive_folder_id, transfer, cache_dir)
+        store = ParquetStore(staging_dir) if staging_dir else None
+
+        def prepare_drive(prefetch: bool):
+            t0 = time.perf_counter()
+            try:
+                drive.files().get(fileId=drive_folder_id, fields="id").execute()
+            except gapi_errors.HttpError as e:
+                raise SystemExit(f"Drive folder not accessible. Share {drive_folder_id} with {sa_email} (Editor). Details: {e}")
+            if prefetch:
+                workbook.content()
+            clocks["drive"].add(busy=time.perf_counter() - t0, items=1)
+
+        # With PIPELINE_OVERLAP the folder check and workbook download run in one
+        # background thread while Mongo connects and fetches. The Drive client is not
+        # thread-safe, so the main thread touches Drive only after drive_ready().
+        drive_bg = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nc-drive") if overlap else None
+        drive_task = drive_bg.submit(_in_run_context(prepare_drive), not store or store.is_empty()) if overlap else None
+
+        def drive_ready():
+            t0 = time.perf_counter()
+            if drive_task:
+                drive_task.result()
+            clocks["write"].add(idle=time.perf_counter() - t0)
 
         # Connectivity checks
         try:
-            client = MongoClient(mongo_uri, tz_aware=True)
-            client.admin.command("ping")
+            with metrics.stage("connect"):
+                client = clients.mongo(mongo_uri, mongo_pool_size, mongo_compressors)
+                client.admin.command("ping")
         except Exception as e:
             raise SystemExit(f"Mongo connection failed. Check MONGO_URI. Details: {e}")
 
-        try:
-            drive.files().get(fileId=drive_folder_id, fields="id").execute()
-        except HttpError as e:
-            raise SystemExit(f"Drive folder not accessible. Share {drive_folder_id} with {sa_email} (Editor). Details: {e}")
+        if not overlap:
+            prepare_drive(False)
+
+        db = client[db_name]
+        state_store = open_state(state_backend, base_name, db, workbook, state_path)
+
+        if store and store.is_empty():
+            drive_ready()
+        if store and store.is_empty() and workbook.content():
+            # One-time bootstrap: the Drive workbook's history becomes the first partition files
+            store.write(workbook.data_frame(), "bootstrap")
+            store.commit()
+            log.info("📦 Imported existing workbook into staging store %s", staging_dir)
 
-        db = client[DB_NAME]
-        
         # Determine start point
-        last_oid = None
-        if run_mode == "inc":
-            last_oid = get_watermark(drive, drive_folder_id, output_name)
+        with metrics.stage("watermark"):
+            last_oid = store.last_oid() if store and run_mode == "inc" else None
 
-        raw, new_watermark = fetch(db, last_oid)
-        
-        if raw is None or raw.empty:
+            def workbook_watermark():
+                drive_ready()
+                wm_book = workbook
+                if rotate == "month" and not workbook.file_id:
+                    # First run of a month: carry the watermark over from the newest partition
+                    prev = find_latest_partition(drive, base_name, drive_folder_id)
+                    wm_book = DriveWorkbook(drive, prev[0] if prev else base_name, drive_folder_id, transfer, cache_dir)
+                    if prev:
+                        wm_book.file_id = prev[1]
+                wm = get_watermark(drive, drive_folder_id, wm_book.name, wm_book)
+                if wm_book is not workbook:
+                    wm_book.close()
+                return wm
+
+            if run_mode == "inc" and not last_oid:
+                if state_store and state_store.backend == "drive":
+                    drive_ready()
+                # With a state store the workbook is not downloaded just to learn the watermark
+                last_oid = read_watermark(state_store, workbook_watermark)
+
+        if check_plan:
+            check_fetch_plan(db, last_oid, batch_size)
+        if join_engine == "flat":
+            with metrics.stage("flat_refresh"):
+                refresh_flat_view(db, rebuild=run_mode == "full")
+
+        # Stream cleaned chunks; raw dicts of a chunk are released once it is cleaned.
+        # With a staging store each chunk goes straight to Parquet instead of memory.
+        run_id = new_run_id()
+        chunks, fetched, new_watermark = [], 0, None
+        # OUTPUT_WRITER=stream: existing rows are copied and each chunk written as it arrives
+        tmp_path = f"NC-out-{os.getpid()}-{threading.get_ident()}.xlsx"  # concurrent runs (run_batch)
+        writer, known_keys, unchanged = None, set(), 0
+        if run_mode == "full" and workers > 1:
+            source = parallel_backfill(mongo_uri, db, workers, batch_size, join_engine, transform, journal_filter)
+        elif overlap:
+            source = fetch_chunks_staged(db, last_oid, batch_size, join_engine, transform,
+                                         clean_workers, queue_depth, clocks, journal_filter)
+        else:
+            source = fetch_chunks(db, last_oid, batch_size, join_engine, transform, clocks=clocks,
+                                  journal_filter=journal_filter)
+        try:
+            for cleaned_chunk, chunk_last_oid in source:
+                if store:
+                    store.write(cleaned_chunk, run_id)
+                elif streaming:
+                    if writer is None:
+                        drive_ready()
+                        with metrics.stage("serialise"):
+                            writer = StreamingOutputWriter(tmp_path)
+                            base = workbook.summaries() if summary_mode == "incremental" else None
+                            if summary_mode != "none" and base is None:
+                                writer.summarise()  # full: every row written, existing ones included
+                            for values, key in workbook.iter_rows(FINAL_COLS):
+                                writer.append(values, key)
+                                known_keys.add(key)
+                            if base is not None:
+                                writer.summarise(base)  # incremental: only the rows added from here
+                    with metrics.stage("serialise"):
+                        fresh = drop_unchanged(cleaned_chunk, known_keys)
+                        unchanged += len(cleaned_chunk) - len(fresh)
+                        writer.write(fresh)
+                else:
+                    if compact:
+                        compact_frame(cleaned_chunk, STAGING_COLS)
+                    chunks.append(cleaned_chunk[STAGING_COLS])
+                fetched += len(cleaned_chunk)
+                new_watermark = chunk_last_oid
+        except BaseException:
+            if store:
+                store.abort()
+            raise
+        if store:
+            store.commit()
+        drive_ready()
+        metrics.new_records, metrics.watermark = fetched, new_watermark or last_oid
+        metrics.mongo = mongo_stats(db, last_oid, batch_size, explain_stats)
+
+        # A staged run whose upload failed last time still owes Drive an export
+        if not fetched and not (store and store.pending_export()):
+            workbook.close()
+            _log_stages(clocks)
+            metrics.status = "NO_UPDATES"
             log.info("ℹ️ No new data; nothing to upload.")
             duration = time.time() - start_time
             log.info(f"Pipeline completed in {duration:.2f} seconds")
             return
 
-        log.info(f"📊 Fetched {len(raw)} new records from MongoDB")
-        
-        cleaned = clean(raw)
-        log.info(f"✨ Cleaned {len(cleaned)} records")
-        
-        # Download existing to append
-        existing = download_excel(drive, output_name, drive_folder_id)
-        
-        # If existing has journal_id (old format), we might want to drop it or keep it?
-        # The user wants the NEW format. So we should probably just align columns.
-        # If existing is empty or columns mismatch, pandas concat handles it (filling NaN).\n        # We only keep FINAL_COLS.
-        
-        if not existing.empty:
-            # Ensure existing has all final cols
-            for c in FINAL_COLS:
-                if c not in existing.columns:
-                    existing[c] = ""
-            existing = existing[FINAL_COLS]
-        
-        out = pd.concat([existing, cleaned[FINAL_COLS]], ignore_index=True) if not existing.empty else cleaned[FINAL_COLS]
+        log.info(f"📊 Fetched {fetched} new records from MongoDB")
         
-        # Save locally then upload
-        tmp_path = "NC-out.xlsx"
+        cleaned = concat_frames(chunks) if chunks else pd.DataFrame(columns=STAGING_COLS)
+        chunks = None
+        log.info(f"✨ Cleaned {fetched} records")
+
+        if unchanged:
+            log.info("♻️ %d fetched records already in %s unchanged", unchanged, output_name)
+        if not store and not streaming and write_mode in ("rewrite", "append"):
+            # Rows already in the workbook with the same content hash (a rerun, or a full
+            # run over an up-to-date file) are not written a second time
+            known = workbook.keys()
+            fresh = drop_unchanged(cleaned, known)
+            if len(fresh) < len(cleaned):
+                log.info("♻️ %d fetched records already in %s unchanged", len(cleaned) - len(fresh), output_name)
+            cleaned = fresh
+
+        # Save locally then upload: data + watermark in one file, one upload.
+        # The watermark is committed only if that upload succeeds. Nothing is written
+        # or uploaded when the output would be identical to the one in Drive.
         try:
-            out.to_excel(tmp_path, index=False)
-            upload_excel(drive, tmp_path, output_name, drive_folder_id)
-            log.info("✅ Uploaded %s (%d rows)", output_name, len(out))
-            
-            # Update watermark ONLY after successful upload
-            if run_mode == "inc" and new_watermark:
-                save_watermark_to_excel(tmp_path, new_watermark)
-                upload_excel(drive, tmp_path, output_name, drive_folder_id)
-                log.info("💾 Updated watermark in Excel")
+            with metrics.stage("serialise"):
+                written, digest = True, None
+                if store:
+                    # Excel is an export of the store (optionally only a recent window)
+                    new_watermark = store.last_oid() or new_watermark
+                    out = store.read(window_months)
+                    keys = output_keys(out)
+                    digest = output_digest(keys["row_hash"], new_watermark)
+                    written = digest != store.exported_digest()
+                    if written:
+                        # Status is edited in Drive, not the store: it comes from the current file
+                        carry_statuses(out, workbook.statuses())
+                        # The export (or its window) is in memory: summaries are recomputed
+                        write_output(tmp_path, out[FINAL_COLS], new_watermark, keys,
+                                     summarise(out) if summary_mode != "none" else None)
+                    total_rows = len(out)
+                elif write_mode == "merge":
+                    # Upsert by journal_id; reruns and full runs do not duplicate rows
+                    total_rows, inserted, updated, written = merge_output(tmp_path, workbook.content(),
+                                                                          cleaned, new_watermark, summary_mode)
+                    log.info("🔀 Merged by journal_id: %d new, %d updated", inserted, updated)
+                elif write_mode == "append":
+                    # Only the new rows are added (no pandas rebuild); the book is still loaded whole
+                    written = not cleaned.empty or (new_watermark or None) != workbook.watermark()
+                    total_rows = len(known)
+                    if written:
+                        total_rows = append_output(tmp_path, workbook.content(), cleaned, new_watermark,
+                                                   summary_mode)
+                elif writer is not None:
+                    total_rows = writer.rows
+                    written = writer.close(new_watermark) != workbook.digest()
+                else:
+                    # Existing rows come from the same in-memory workbook (no second download)
+                    existing = workbook.data_frame()
+                    if not existing.empty:
+                        # Ensure existing has all final cols
+                        for c in FINAL_COLS:
+                            if c not in existing.columns:
+                                existing[c] = ""
+                        if compact:
+                            compact_frame(existing, FINAL_COLS)
+                        existing = existing[FINAL_COLS]
+                    out = concat_frames([existing, cleaned[FINAL_COLS]]) \
+                        if not existing.empty else cleaned[FINAL_COLS]
+                    keys = pd.concat([known, output_keys(cleaned)], ignore_index=True)
+                    written = output_digest(keys["row_hash"], new_watermark) != workbook.digest()
+                    summaries = None
+                    if written and summary_mode != "none":
+                        base = workbook.summaries() if summary_mode == "incremental" else None
+                        summaries = combine_summaries(base, summarise(cleaned)) if base is not None \
+                            else summarise(out)
+                    if written:
+                        write_output(tmp_path, out, new_watermark, keys, summaries)
+                    total_rows = len(out)
+                workbook.close()
+
+            if not written:
+                metrics.status, metrics.total_records, metrics.watermark = "NO_UPDATES", total_rows, new_watermark
+                log.info("ℹ️ No new data: %s is unchanged (%d rows); skipping upload.", output_name, total_rows)
+            else:
+                with metrics.stage("upload"):
+                    workbook.file_id = transfer.upload(drive, tmp_path, output_name, drive_folder_id, workbook.file_id)
+                if cache_dir:
+                    # The next run finds this version in the local cache instead of downloading it
+                    with open(tmp_path, "rb") as f:
+                        workbook.set_content(f.read())
+                    workbook.close()
+                metrics.status, metrics.total_records, metrics.watermark = "SUCCESS", total_rows, new_watermark
+                log.info("✅ Uploaded %s (%d rows)", output_name, total_rows)
+                if new_watermark:
+                    log.info("💾 Saved watermark to Excel: %s", new_watermark)
+                if store:
+                    store.mark_exported(new_watermark, digest)
+                if state_store and new_watermark:
+                    state_store.set_watermark(new_watermark)
+                    log.info("💾 Saved watermark to %s state", state_store.backend)
         finally:
             # Clean up temp file
             if os.path.exists(tmp_path):
                 os.remove(tmp_path)
         
+        _log_stages(clocks)
         duration = time.time() - start_time
         log.info(f"✅ Pipeline completed in {duration:.2f} seconds")
         
+    except SystemExit as e:
+        metrics.error = str(e)
+        raise
     except Exception as e:
         duration = time.time() - start_time
         log.error(f"❌ Pipeline failed after {duration:.2f} seconds: {e}")
+        metrics.error = str(e)
+        raise
+    finally:
+        if drive_bg:
+            drive_bg.shutdown(wait=True)
+        if writer is not None:
+            writer.abort()  # a failed run: its sheets' temp files and a partial file
+        if metrics.status == "RUNNING":
+            metrics.status = "FAILED"
+        metrics.transfers = transfer.metrics if transfer else []
+        _run_context.report = metrics.report()
+        try:
+            metrics.write(_setting(cfg, "RUN_REPORT_PATH", "run_report.json"),
+                          _setting(cfg, "RUN_HISTORY_PATH", ""), _setting(cfg, "METRICS_PROM_PATH", ""))
+        except Exception as e:
+            log.warning("Could not write run report: %s", e)
+
+# --- Stream Mode (RUN_MODE=stream) ---
+# Long-running alternative to the daily batch: a change stream on journals feeds
+# micro-batches into the output. It also picks up journals whose end_time is set
+# after the watermark has passed their _id, which `_id > watermark` scans never see.
+
+STREAM_TOKEN_FILE = "stream_resume_token.json"
+CHANGE_STREAM_HISTORY_LOST = (280, 286)
+
+def journal_changes_pipeline() -> list:
+    """Change events that make a journal exportable: inserted finished, or end_time set later."""
+    return [
+        {"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace"]}, "fullDocument.end_time": {"$ne": None}},
+            {"operationType": "update", "updateDescription.updatedFields.end_time": {"$exists": True, "$ne": None}},
+        ]}},
+        {"$project": {"operationType": 1, "documentKey": 1}},
+    ]
+
+def load_resume_token(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get("resume_token")
+
+def save_resume_token(path: str, token: Optional[dict]) -> None:
+    if token:
+        _write_atomic(path, json.dumps({"resume_token": token, "saved_at": datetime.now(timezone.utc).isoformat()}))
+
+def iter_change_batches(coll, resume_token: Optional[dict] = None, flush_rows: int = 500,
+                        flush_seconds: float = 60.0, max_seconds: float = 0.0,
+                        on_open=None) -> Iterator[Tuple[Dict[ObjectId, str], Optional[dict]]]:
+    """
+    Micro-batches from a change stream on journals: ({journal _id: last operationType},
+    resume token after the batch). A batch is yielded at `flush_rows` journals or once its
+    oldest change is `flush_seconds` old; while idle an empty batch is yielded every
+    `flush_seconds` so the caller can checkpoint the token. Persist a token only after its
+    batch is exported (at-least-once). `max_seconds` > 0 ends the stream (after a final
+    batch); `on_open(token)` runs once the stream is open, before any batch.
+    """
+    started = last = time.monotonic()
+    pending, first_at = {}, None
+    with coll.watch(journal_changes_pipeline(), resume_after=resume_token, max_await_time_ms=1000) as stream:
+        # Opening the stream already fixes its position (postBatchResumeToken)
+        if on_open:
+            on_open(stream.resume_token)
+        change = stream.try_next()
+        while True:
+            if change is not None:
+                pending[change["documentKey"]["_id"]] = change["operationType"]
+                first_at = first_at or time.monotonic()
+            now = time.monotonic()
+            stopping = bool(max_seconds and now - started >= max_seconds) or not stream.alive
+            if stopping or len(pending) >= flush_rows or now - (first_at or last) >= flush_seconds:
+                yield pending, stream.resume_token
+                pending, first_at, last = {}, None, now
+            if stopping:
+                return
+            change = stream.try_next()
+
+def run_stream(cfg: Dict = None):
+    """
+    RUN_MODE=stream: follow journals through a change stream (needs a replica set or
+    Atlas) and append micro-batches to the output. Same settings as run_once, plus
+    STREAM_FLUSH_SECONDS (default 60), STREAM_FLUSH_ROWS (default 500),
+    STREAM_TOKEN_PATH (resume token file, default stream_resume_token.json),
+    STREAM_MAX_SECONDS (stop after this long, default 0 = until interrupted).
+    OUTPUT_WRITE_MODE=merge makes end_time corrections update their row in place.
+    Without a resume token an incremental run_once catches up first.
+    """
+    cfg = cfg or {}
+    mongo_uri       = _require(cfg, "MONGO_URI")
+    drive_folder_id = _require(cfg, "DRIVE_FOLDER_ID")
+    output_name     = cfg.get("OUTPUT_NAME") or os.getenv("OUTPUT_NAME", "NC-DA-Journal-Data.xlsx")
+    batch_size      = int(_setting(cfg, "FETCH_BATCH_SIZE", str(FETCH_BATCH_SIZE)))
+    join_engine     = _setting(cfg, "JOIN_ENGINE", "lookup").lower()
+    transform       = _setting(cfg, "TRANSFORM", "client").lower()
+    staging_dir     = _setting(cfg, "STAGING_DIR", "")
+    window_months   = int(_setting(cfg, "EXCEL_WINDOW_MONTHS", "0"))
+    merge           = _setting(cfg, "OUTPUT_WRITE_MODE", "rewrite").lower() == "merge"
+    summary_mode    = _setting(cfg, "SUMMARY_SHEETS", "none").lower()
+    journal_filter  = _journal_filter(cfg)
+    flush_seconds   = float(_setting(cfg, "STREAM_FLUSH_SECONDS", "60"))
+    flush_rows      = int(_setting(cfg, "STREAM_FLUSH_ROWS", "500"))
+    token_path      = _setting(cfg, "STREAM_TOKEN_PATH", STREAM_TOKEN_FILE)
+    max_seconds     = float(_setting(cfg, "STREAM_MAX_SECONDS", "0"))
+    state_backend   = _setting(cfg, "STATE_BACKEND", "excel").lower()
+    state_path      = _setting(cfg, "STATE_PATH", STATE_FILE)
+
+    drive, _ = clients.drive(_ensure_sa_file(cfg))
+    transfer = DriveTransfer.from_cfg(cfg)
+    db = clients.mongo(mongo_uri, int(_setting(cfg, "MONGO_MAX_POOL_SIZE", "10")),
+                       _setting(cfg, "MONGO_COMPRESSORS", "zstd,snappy"))[_setting(cfg, "DB_NAME", DB_NAME)]
+    store = ParquetStore(staging_dir) if staging_dir else None
+    workbook = DriveWorkbook(drive, output_name, drive_folder_id, transfer,
+                             _setting(cfg, "WORKBOOK_CACHE_DIR", "") or None)
+    state_store = open_state(state_backend, output_name, db, workbook, state_path)
+    token = load_resume_token(token_path)
+    state = {"watermark": None, "flushes": 0}
+
+    def catch_up(start_token):
+        # Changes from here on wait in the stream while the batch run catches up
+        if token is None:
+            log.info("🔁 No stream resume token; catching up with an incremental run first")
+            run_once(dict(cfg, RUN_MODE="inc"))
+            save_resume_token(token_path, start_token)
+        state["watermark"] = store.last_oid() if store else read_watermark(
+            state_store, lambda: get_watermark(drive, drive_folder_id, output_name, workbook))
+        log.info("📡 Streaming journal changes (flush every %ss / %d rows)", flush_seconds, flush_rows)
+
+    def flush(changes: Dict[ObjectId, str]):
+        # Inserts at or below the watermark are already in the output (caught up, or
+        # exported before a restart replayed them); late end_time updates never are
+        wm = ObjectId(state["watermark"]) if state["watermark"] else None
+        ids = [i for i, op in changes.items() if op == "update" or wm is None or i > wm]
+        if not ids:
+            return
+        if join_engine == "flat":
+            merge_flat(db, {"_id": {"$in": ids}, "end_time": {"$ne": None}})
+        chunks = [c[STAGING_COLS] for c, _ in fetch_chunks(db, None, batch_size, join_engine, transform,
+                                                           id_bounds={"$in": ids}, journal_filter=journal_filter)]
+        rows = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=STAGING_COLS)
+        if not store and not merge:
+            # An update that changed none of the output columns is not appended again
+            rows = drop_unchanged(rows, workbook.keys())
+        if rows.empty:
+            return
+        new_watermark = str(max(ids + ([wm] if wm else [])))
+        state["flushes"] += 1
+        tmp_path = "NC-stream-out.xlsx"
+        try:
+            digest = None
+            if store:
+                store.write(rows, new_run_id())
+                store.commit()
+                new_watermark = store.last_oid() or new_watermark
+                out = store.read(window_months)
+                keys = output_keys(out)
+                digest = output_digest(keys["row_hash"], new_watermark)
+                if digest == store.exported_digest():
+                    return
+                # Status may have been edited in Drive since the last flush: read the current file
+                workbook.close()
+                carry_statuses(out, workbook.statuses())
+                write_output(tmp_path, out[FINAL_COLS], new_watermark, keys,
+                             summarise(out) if summary_mode != "none" else None)
+                total_rows = len(out)
+            elif merge:
+                total_rows, inserted, updated, written = merge_output(tmp_path, workbook.content(), rows,
+                                                                      new_watermark, summary_mode)
+                if not written:
+                    return
+                log.info("🔀 Merged by journal_id: %d new, %d updated", inserted, updated)
+            else:
+                total_rows = append_output(tmp_path, workbook.content(), rows, new_watermark, summary_mode)
+            workbook.file_id = transfer.upload(drive, tmp_path, output_name, drive_folder_id, workbook.file_id)
+            with open(tmp_path, "rb") as f:
+                workbook.set_content(f.read())  # the next flush appends to this version
+            log.info("📊 Streamed %d changed journals", len(rows))
+            log.info("✅ Uploaded %s (%d rows)", output_name, total_rows)
+            log.info("💾 Saved watermark to Excel: %s", new_watermark)
+            if store:
+                store.mark_exported(new_watermark, digest)
+            if state_store:
+                state_store.set_watermark(new_watermark)
+            state["watermark"] = new_watermark
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    try:
+        for changes, resume_token in iter_change_batches(db[JOURNALS_COL], token, flush_rows, flush_seconds,
+                                                         max_seconds, on_open=catch_up):
+            flush(changes)
+            save_resume_token(token_path, resume_token)
+    except pymongo_errors.OperationFailure as e:
+        if e.code in CHANGE_STREAM_HISTORY_LOST and token is not None:
+            # The oplog no longer reaches back to the token: catch up by batch and start over
+            log.warning("⚠️ Stream resume token expired (%s); catching up from the watermark", e)
+            os.remove(token_path)
+            return run_stream(cfg)
+        if "replica set" in str(e).lower() or e.code == 40573:
+            raise SystemExit(f"Change streams need a replica set (or Atlas). Details: {e}")
         raise
+    except KeyboardInterrupt:
+        log.info("Stream stopped; resume token saved at %s", token_path)
+    finally:
+        workbook.close()
+
+# --- Batch Runs (TARGETS / TARGETS_PATH) ---
+# Several outputs (databases, regions) exported by one process: targets run concurrently
+# on a bounded thread pool and share the MongoClient pool of each URI and the Drive
+# credentials, instead of one job per target re-importing and reconnecting. A target's
+# failure is recorded in the batch report and does not stop the others.
+
+BATCH_REPORT_FILE = "batch_report.json"
+# Per-run files that would collide between targets: "<stem>-<target><ext>" unless the target sets them
+TARGET_PATH_SETTINGS = {"RUN_REPORT_PATH": "run_report.json", "RUN_HISTORY_PATH": "", "METRICS_PROM_PATH": "",
+                        "STATE_PATH": STATE_FILE}
+
+def load_targets(cfg: Dict = None) -> List[Dict]:
+    """TARGETS (a list in cfg, or inline JSON) or TARGETS_PATH (a JSON file): one settings dict per target."""
+    cfg = cfg or {}
+    targets = cfg.get("TARGETS") or os.getenv("TARGETS", "")
+    path = _setting(cfg, "TARGETS_PATH", "")
+    if not targets and path:
+        with open(path) as f:
+            targets = f.read()
+    targets = json.loads(targets) if isinstance(targets, str) and targets.strip() else targets or []
+    names = [t.get("NAME") for t in targets]
+    if not all(names) or len(set(names)) != len(names):
+        raise SystemExit("Every target needs a unique NAME")
+    return targets
+
+def _target_path(path: str, name: str) -> str:
+    stem, ext = os.path.splitext(path)
+    return f"{stem}-{name}{ext}"
+
+def target_config(cfg: Dict, target: Dict) -> Dict:
+    """Settings of one target: the shared `cfg` overridden by the target's own keys."""
+    out = {**cfg, **target}
+    name = target["NAME"]
+    for key, default in TARGET_PATH_SETTINGS.items():
+        path = _setting(cfg, key, default)
+        if key not in target and path:
+            out[key] = _target_path(path, name)
+    staging_dir = _setting(cfg, "STAGING_DIR", "")
+    if "STAGING_DIR" not in target and staging_dir:
+        out["STAGING_DIR"] = os.path.join(staging_dir, name)
+    return out
+
+def _run_target(cfg: Dict, target: Dict) -> dict:
+    """Worker: one target's run_once, isolated; returns its row of the batch report."""
+    name = target["NAME"]
+    _run_context.target, _run_context.report = name, None
+    t0 = time.perf_counter()
+    error = None
+    try:
+        target_cfg = target_config(cfg, target)
+        if (target_cfg.get("RUN_MODE") or os.getenv("RUN_MODE", "inc")).lower() == "stream":
+            raise SystemExit("RUN_MODE=stream cannot run as a batch target")
+        run_once(target_cfg)
+    except (SystemExit, Exception) as e:
+        error = str(e)
+        log.error("❌ Target failed: %s", e)
+    finally:
+        _run_context.target = None
+    report = _run_context.report or {}
+    return {
+        "target": name,
+        "status": "FAILED" if error else report.get("status", "FAILED"),
+        "seconds": round(time.perf_counter() - t0, 3),
+        "new_records": report.get("new_records", 0),
+        "total_records": report.get("total_records", 0),
+        "error": error or report.get("error"),
+        "stages": {n: s["busy_seconds"] for n, s in report.get("stages", {}).items()},
+    }
+
+def run_batch(targets: List[Dict], cfg: Dict = None) -> List[dict]:
+    """
+    Run every target (see load_targets) with run_once, BATCH_WORKERS (default 4) at a
+    time. Each target's settings are `cfg` overridden by its own (DB_NAME,
+    JOURNAL_FILTER, DRIVE_FOLDER_ID, OUTPUT_NAME, ...). Writes BATCH_REPORT_PATH
+    (default batch_report.json) and returns one result per target, in order.
+    Targets write their own run reports (see TARGET_PATH_SETTINGS); RUN_REPORT_PATH
+    gets the batch report too, with the status and counts over all targets, so
+    send_email.py reports a batch like a single run.
+    """
+    cfg = cfg or {}
+    workers = max(1, int(_setting(cfg, "BATCH_WORKERS", "4")))
+    started_at = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    try:
+        # Written once up front; the targets only read it
+        cfg = {**cfg, "SA_JSON_PATH": _ensure_sa_file(cfg)}
+    except SystemExit as e:
+        log.warning("%s (targets must set their own)", e)
+    log.info("🗂️ Running %d targets, %d at a time", len(targets), workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nc-target") as pool:
+        results = list(pool.map(lambda t: _run_target(cfg, t), targets))
+    for r in results:
+        log.info("%s %s: %s in %.2fs (%d new, %d total)%s", "✅" if r["status"] != "FAILED" else "❌",
+                 r["target"], r["status"], r["seconds"], r["new_records"], r["total_records"],
+                 f" – {r['error']}" if r["error"] else "")
+    statuses = {r["status"] for r in results}
+    failed = [r for r in results if r["status"] == "FAILED"]
+    report = {
+        "status": "FAILED" if failed else "SUCCESS" if "SUCCESS" in statuses else "NO_UPDATES",
+        "run_mode": "batch",
+        "started_at": started_at.isoformat(),
+        "duration_seconds": round(time.perf_counter() - t0, 3),
+        "new_records": sum(r["new_records"] for r in results),
+        "total_records": sum(r["total_records"] for r in results),
+        "watermark": None,
+        "error": "; ".join(f"{r['target']}: {r['error']}" for r in failed) or None,
+        "workers": workers,
+        "targets": results,
+    }
+    paths = {_setting(cfg, "BATCH_REPORT_PATH", BATCH_REPORT_FILE), _setting(cfg, "RUN_REPORT_PATH", "run_report.json")}
+    for path in filter(None, paths):
+        try:
+            _write_atomic(path, json.dumps(report, indent=2))
+        except Exception as e:
+            log.warning("Could not write batch report %s: %s", path, e)
+    return results
 
 if __name__ == "__main__":
     # Fallback to env-only run
@@ -462,4 +2998,13 @@ if __name__ == "__main__":
         "SA_JSON_PATH":    os.getenv("SA_JSON_PATH", "drive-sa.json"),
         "DRIVE_SA_JSON":   os.getenv("DRIVE_SA_JSON", ""),
     }
-    run_once(cfg_env)
+    try:
+        batch = load_targets()
+        if batch:
+            failed = [r["target"] for r in run_batch(batch, cfg_env) if r["status"] == "FAILED"]
+            if failed:
+                raise SystemExit(f"Targets failed: {', '.join(failed)}")
+        else:
+            run_once(cfg_env)
+    finally:
+        clients.close()
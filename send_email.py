@@ -1,4 +1,5 @@
 import os
+import json
 import smtplib
 import ssl
 import re
@@ -55,6 +56,36 @@ def parse_pipeline_log(log_path="pipeline.log"):
     
     return metrics
 
+def load_run_report(report_path="run_report.json"):
+    """Read metrics from the pipeline's JSON run report (a batch run's has every target); None if there is no report"""
+    if not os.path.exists(report_path):
+        return None
+    try:
+        with open(report_path, "r") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    targets = report.get("targets", [])
+    if targets:
+        errors = [f"{t['target']}: {t['error']}" for t in targets if t.get("error")]
+    else:
+        errors = [report["error"]] if report.get("error") else []
+
+    return {
+        "status": report.get("status", "UNKNOWN"),
+        "new_records": report.get("new_records", 0),
+        "total_records": report.get("total_records", 0),
+        "watermark": report.get("watermark"),
+        "duration": report.get("duration_seconds"),
+        "errors": errors,
+        "targets": targets,
+        "stages": report.get("stages", {}),
+        "drive": report.get("drive", {}),
+        "peak_rss_mb": report.get("peak_rss_mb"),
+        "regression": report.get("regression"),
+    }
+
 def format_email_body(metrics):
     """Format a nice email body from metrics"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
@@ -107,6 +138,28 @@ Run Time: {timestamp}
                 body += f"  {error}\n"
         body += "\n⚠️ Please check the full logs in GitHub Actions\n"
     
+    if metrics.get("targets"):
+        body += "\nTargets:\n"
+        for t in metrics["targets"]:
+            body += f"  • {t['target']}: {t['status']} in {t['seconds']:.2f}s ({t['new_records']} new, {t['total_records']} total)\n"
+
+    if metrics.get("stages"):
+        body += "\nTimings:\n"
+        for name, stage in metrics["stages"].items():
+            body += f"  • {name}: {stage['busy_seconds']:.2f}s"
+            if stage.get("idle_seconds"):
+                body += f" (idle {stage['idle_seconds']:.2f}s)"
+            body += "\n"
+        drive = metrics.get("drive", {})
+        if drive:
+            body += f"  • Drive: {drive.get('download', {}).get('bytes', 0)} bytes down, {drive.get('upload', {}).get('bytes', 0)} bytes up\n"
+        if metrics.get("peak_rss_mb"):
+            body += f"  • Peak memory: {metrics['peak_rss_mb']:.0f} MB\n"
+
+    regression = metrics.get("regression")
+    if regression and regression.get("slow"):
+        body += f"\n🐢 This run was {regression['ratio']:.1f}x slower than the recent median ({regression['median_seconds']:.2f}s)\n"
+
     body += f"""
 {'=' * 50}
 Dashboard: https://github.com/prathikmakthala/data_pipline_test/actions
@@ -126,8 +179,8 @@ def send_email():
         print("Skipping email: Missing EMAIL_USER, EMAIL_PASSWORD, or EMAIL_RECIPIENTS.")
         return
     
-    # Parse pipeline metrics
-    metrics = parse_pipeline_log("pipeline.log")
+    # Pipeline metrics: the JSON run report, or the log for runs that wrote none
+    metrics = load_run_report(os.getenv("RUN_REPORT_PATH", "run_report.json")) or parse_pipeline_log("pipeline.log")
     
     # Generate subject based on status
     status_text = metrics["status"].replace("_", " ").title()
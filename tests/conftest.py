@@ -0,0 +1,87 @@
+# conftest.py
+# Shared fixtures. Tests run without a mongod: mongomock for MongoDB (JOIN_ENGINE=bulk;
+# mongomock lacks $convert/$merge) and FakeDriveHttp for Drive. Tests of $lookup,
+# TRANSFORM=server and the flat view need a real server: set TEST_MONGO_URI to a
+# scratch mongod (CI starts one), otherwise they are skipped.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline_bench as bench  # noqa: E402
+import pipeline_project as pp  # noqa: E402
+
+TEST_DB = "NC_test_db"
+FOLDER = "test-folder"
+
+@pytest.fixture
+def mock_client():
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient(tz_aware=True)
+
+@pytest.fixture
+def mock_db(mock_client):
+    """Seeded mongomock database (bench.seed: production-like shapes)."""
+    db = mock_client[TEST_DB]
+    bench.seed(db, 400, rng_seed=1)
+    return db
+
+@pytest.fixture
+def mongod_client():
+    """Client for the mongod at TEST_MONGO_URI; TEST_DB is dropped afterwards."""
+    uri = os.getenv("TEST_MONGO_URI")
+    if not uri:
+        pytest.skip("needs a mongod: set TEST_MONGO_URI")
+    client = pp.pymongo.MongoClient(uri, tz_aware=True)
+    client.drop_database(TEST_DB)
+    yield client
+    client.drop_database(TEST_DB)
+    client.close()
+
+@pytest.fixture
+def mongod_db(mongod_client):
+    """Seeded database on the mongod at TEST_MONGO_URI."""
+    db = mongod_client[TEST_DB]
+    bench.seed(db, 2000, rng_seed=1)
+    return db
+
+@pytest.fixture
+def fake_drive(tmp_path):
+    """(drive, FakeDriveHttp) with an empty FOLDER."""
+    drive, http = bench.fake_drive(str(tmp_path / "drive"))
+    http.add_folder(FOLDER)
+    return drive, http
+
+@pytest.fixture
+def pipeline_cfg(mock_client, mock_db, fake_drive, tmp_path, monkeypatch):
+    """Settings for run_once / run_batch against mock_db and the fake Drive FOLDER (cwd is tmp_path)."""
+    drive, _ = fake_drive
+    monkeypatch.setattr(pp, "clients", pp.ClientManager())
+    monkeypatch.setattr(pp.clients, "mongo", lambda *a, **k: mock_client)
+    monkeypatch.setattr(pp.clients, "drive", lambda sa_path: (drive, "sa@example.com"))
+    sa_path = tmp_path / "sa.json"
+    sa_path.write_text("{}")
+    monkeypatch.chdir(tmp_path)
+    return {"MONGO_URI": "mongodb://mock", "DRIVE_FOLDER_ID": FOLDER, "SA_JSON_PATH": str(sa_path),
+            "DB_NAME": TEST_DB, "JOIN_ENGINE": "bulk", "RUN_MODE": "inc", "RUN_REPORT_PATH": "",
+            "FETCH_BATCH_SIZE": "100"}
+
+@pytest.fixture
+def run_pipeline(pipeline_cfg, fake_drive):
+    """
+    run_pipeline(**settings) runs run_once with pipeline_cfg; returns the output as a
+    DriveWorkbook read back from Drive.
+    """
+    drive, _ = fake_drive
+
+    def run(**settings):
+        cfg = dict(pipeline_cfg, **settings)
+        pp.run_once(cfg)
+        book = pp.DriveWorkbook(drive, cfg.get("OUTPUT_NAME", "NC-DA-Journal-Data.xlsx"), FOLDER)
+        book.file_id = pp.find_file_id(drive, book.name, FOLDER)
+        return book
+
+    return run
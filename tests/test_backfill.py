@@ -0,0 +1,33 @@
+# BACKFILL_WORKERS: the _id ranges partition the journals, and the parallel backfill
+# yields the serial full fetch's rows in the same order (worker processes need a real
+# server: TEST_MONGO_URI).
+
+import glob
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+from conftest import bench, pp
+
+def in_range(oid, bounds):
+    return ("$gte" not in bounds or oid >= bounds["$gte"]) and ("$lt" not in bounds or oid < bounds["$lt"])
+
+@pytest.mark.parametrize("k", [1, 2, 4, 7])
+def test_split_id_ranges_partition_the_ids(mock_db, k):
+    ranges = pp.split_id_ranges(mock_db[pp.JOURNALS_COL], k)
+    assert len(ranges) == k
+    for doc in mock_db[pp.JOURNALS_COL].find({}, {"_id": 1}):
+        assert sum(in_range(doc["_id"], r) for r in ranges) == 1
+
+def test_parallel_backfill_matches_serial(mongod_db):
+    chunks = list(pp.parallel_backfill(os.environ["TEST_MONGO_URI"], mongod_db, 3, 200, "bulk"))
+    parallel = pd.concat([c[pp.FINAL_COLS] for c, _ in chunks], ignore_index=True)
+    pd.testing.assert_frame_equal(bench._collect(mongod_db, "bulk", 200), parallel, check_dtype=False)
+    # Batches arrive one at a time, in _id order, and the spill directory is gone
+    assert max(len(c) for c, _ in chunks) <= 200
+    assert [last for _, last in chunks] == sorted(last for _, last in chunks)
+    assert chunks[-1][1] == str(mongod_db[pp.JOURNALS_COL].find_one({"end_time": {"$ne": None}},
+                                                                    sort=[("_id", -1)])["_id"])
+    assert not glob.glob(os.path.join(tempfile.gettempdir(), "nc-backfill-*"))
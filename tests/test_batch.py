@@ -0,0 +1,45 @@
+# Batch runs: the aggregate report at RUN_REPORT_PATH that send_email.py reads, and
+# the [target] log prefix on every thread a target's run uses.
+
+import logging
+
+import send_email
+from conftest import pp
+
+TARGET_THREADS = ("nc-target", "nc-fetch", "nc-clean", "nc-drive")
+
+def test_batch_report_for_send_email(pipeline_cfg, mock_db):
+    cfg = dict(pipeline_cfg, RUN_REPORT_PATH="run_report.json")
+    targets = [{"NAME": "all", "OUTPUT_NAME": "all.xlsx"},
+               {"NAME": "walks", "OUTPUT_NAME": "walks.xlsx", "JOURNAL_FILTER": '{"activity": "walk"}'},
+               {"NAME": "broken", "DRIVE_FOLDER_ID": "no-such-folder"}]
+    results = pp.run_batch(targets, cfg)
+    assert [r["status"] for r in results] == ["SUCCESS", "SUCCESS", "FAILED"]
+
+    metrics = send_email.load_run_report("run_report.json")
+    assert metrics["status"] == "FAILED"
+    assert metrics["new_records"] == results[0]["new_records"] + results[1]["new_records"] > 0
+    assert [t["target"] for t in metrics["targets"]] == ["all", "walks", "broken"]
+    assert len(metrics["errors"]) == 1 and metrics["errors"][0].startswith("broken: ")
+    # Each target keeps its own report as well
+    assert send_email.load_run_report("run_report-all.json")["status"] == "SUCCESS"
+    body = send_email.format_email_body(metrics)
+    assert "walks: SUCCESS" in body and "broken: FAILED" in body
+
+    results = pp.run_batch(targets[:2], cfg)
+    assert send_email.load_run_report("run_report.json")["status"] == "NO_UPDATES"
+
+def test_worker_threads_log_with_target_prefix(pipeline_cfg, mock_db, caplog):
+    cfg = dict(pipeline_cfg, PIPELINE_OVERLAP="true", CLEAN_WORKERS="2")
+    targets = [{"NAME": "a", "OUTPUT_NAME": "a.xlsx"}, {"NAME": "b", "OUTPUT_NAME": "b.xlsx"}]
+    held = list(mock_db[pp.JOURNALS_COL].find().sort("_id", -1).limit(20))
+    mock_db[pp.JOURNALS_COL].delete_many({"_id": {"$in": [d["_id"] for d in held]}})
+    pp.run_batch(targets, cfg)
+    # Second run: the workbook download runs on the nc-drive thread
+    mock_db[pp.JOURNALS_COL].insert_many(held)
+    with caplog.at_level(logging.INFO, logger="nc-pipeline"):
+        pp.run_batch(targets, cfg)
+    assert any(r.threadName.startswith("nc-drive") for r in caplog.records)
+    for record in caplog.records:
+        if record.threadName.startswith(TARGET_THREADS):
+            assert record.getMessage().startswith(("[a] ", "[b] ")), (record.threadName, record.getMessage())
@@ -0,0 +1,31 @@
+# decide_country_vec must match the scalar decide_country row for row.
+
+import pandas as pd
+import pytest
+
+from conftest import bench, pp
+
+@pytest.mark.parametrize("address, state, country, expected", [
+    ("", "", " usa ", "USA"),
+    ("", "", "United States of America", "USA"),
+    ("", "", "Canada", "Canada"),
+    ("", " ny ", "", "USA"),
+    ("Toronto, ON M5V", "ON", "", ""),
+    ("123 Main St, Austin, TX 78701", "", "", "USA"),
+    ("ca90210", "", "", "USA"),
+    ("Paris", "", "", ""),
+    (None, None, None, ""),
+])
+def test_decide_country_rules(address, state, country, expected):
+    assert pp.decide_country(address, state, country) == expected
+    vec = pp.decide_country_vec(pd.Series([address], dtype=object), pd.Series([state], dtype=object),
+                                pd.Series([country], dtype=object))
+    assert vec.tolist() == [expected]
+
+@pytest.mark.parametrize("noise_ratio", [0.0, 0.5, 1.0])
+def test_decide_country_vec_matches_scalar(noise_ratio):
+    address, state, country = bench.country_inputs(20000, noise_ratio=noise_ratio, rng_seed=7)
+    expected = [pp.decide_country(a, s, c) for a, s, c in zip(address, state, country)]
+    got = pp.decide_country_vec(address, state, country)
+    assert got.tolist() == expected
+    assert got.index.equals(country.index)
@@ -0,0 +1,109 @@
+# DriveTransfer against FakeDriveHttp: transient failures are retried and the content
+# arrives intact; fatal ones fail at once; the attempt cap and time budget give up.
+
+import json
+import os
+import socket
+
+import pytest
+
+from conftest import FOLDER, pp
+
+def http_error(status: int, reason: str = None):
+    errors = [{"reason": reason, "message": "x"}] if reason else []
+    content = json.dumps({"error": {"code": status, "message": "x", "errors": errors}}).encode()
+    return pp.gapi_errors.HttpError(pp.httplib2.Response({"status": str(status)}), content)
+
+@pytest.mark.parametrize("error, retryable", [
+    (http_error(503), True),
+    (http_error(500), True),
+    (http_error(429), True),
+    (http_error(408), True),
+    (http_error(403, "userRateLimitExceeded"), True),
+    (http_error(403, "rateLimitExceeded"), True),
+    (http_error(403, "insufficientFilePermissions"), False),
+    (http_error(403), False),
+    (http_error(404), False),
+    (http_error(400), False),
+    (ConnectionResetError("reset by peer"), True),
+    (TimeoutError(), True),
+    (socket.timeout("timed out"), True),
+    (socket.gaierror("name resolution"), True),
+    (pp.httplib2.ServerNotFoundError("Unable to find the server"), True),
+    (pp.google_auth_errors.TransportError("token refresh"), True),
+    (PermissionError("denied"), False),
+    (FileNotFoundError("missing"), False),
+    (ValueError("bug"), False),
+])
+def test_is_retryable(error, retryable):
+    assert pp._is_retryable(error) is retryable
+
+@pytest.fixture
+def payload(tmp_path):
+    data = os.urandom(3 * 1024 * 1024)
+    path = tmp_path / "payload.xlsx"
+    path.write_bytes(data)
+    return str(path), data
+
+@pytest.mark.parametrize("faults", [
+    [],
+    [dict(status=503, times=2), dict(status=500)],
+    # Mid-transfer: the upload resumes from the bytes Drive confirmed, the download from its offset
+    [dict(status=503, after=2)],
+    [dict(status=403, reason="userRateLimitExceeded", times=2)],
+    [dict(status=429)],
+    [dict(error=ConnectionResetError("reset by peer"), after=2)],
+    [dict(error=pp.httplib2.ServerNotFoundError("Unable to find the server"))],
+    [dict(error=socket.timeout("timed out"))],
+], ids=["none", "5xx", "5xx-mid-transfer", "403-rate-limit", "429", "connection-reset", "dns", "timeout"])
+def test_transient_failures_are_retried(fake_drive, payload, faults):
+    drive, http = fake_drive
+    path, data = payload
+    for kind in ("upload", "download"):
+        for fault in faults:
+            http.fail(kind, **fault)
+    sleeps = []
+    transfer = pp.DriveTransfer(chunk_mb=1, sleep=sleeps.append)
+    fid = transfer.upload(drive, path, "payload.xlsx", FOLDER)
+    assert transfer.download(drive, fid) == data
+    expected = 2 * sum(f.get("times", 1) for f in faults)
+    assert sum(m["retries"] for m in transfer.metrics) == expected == len(sleeps)
+    assert all(m["bytes"] == len(data) for m in transfer.metrics)
+
+@pytest.mark.parametrize("fault", [
+    dict(status=403, reason="insufficientFilePermissions"),
+    dict(status=404),
+    dict(error=PermissionError("denied")),
+], ids=["403-forbidden", "404", "local-PermissionError"])
+def test_fatal_failures_are_not_retried(fake_drive, payload, fault):
+    drive, http = fake_drive
+    http.fail("upload", **fault)
+    sleeps = []
+    transfer = pp.DriveTransfer(chunk_mb=1, sleep=sleeps.append)
+    with pytest.raises(pp.DriveTransferError, match="failed"):
+        transfer.upload(drive, payload[0], "payload.xlsx", FOLDER)
+    assert sleeps == []
+
+def test_attempt_cap(fake_drive, payload):
+    drive, http = fake_drive
+    http.fail("upload", status=503, times=100)
+    sleeps = []
+    transfer = pp.DriveTransfer(max_attempts=3, chunk_mb=1, sleep=sleeps.append)
+    with pytest.raises(pp.DriveTransferError, match="gave up after 3 attempts"):
+        transfer.upload(drive, payload[0], "payload.xlsx", FOLDER)
+    assert len(sleeps) == 2
+
+def test_time_budget(fake_drive, payload, monkeypatch):
+    drive, http = fake_drive
+    http.fail("upload", status=502, times=1000)
+    clock = [0.0]
+    monkeypatch.setattr(pp.time, "monotonic", lambda: clock[0])
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    transfer = pp.DriveTransfer(max_attempts=1000, max_seconds=5.0, base_delay=1.0, chunk_mb=1, sleep=sleep)
+    with pytest.raises(pp.DriveTransferError, match=r"gave up after \d+ attempts / 5s"):
+        transfer.upload(drive, payload[0], "payload.xlsx", FOLDER)
+    # Backoff never sleeps past the budget
+    assert clock[0] <= 5.0
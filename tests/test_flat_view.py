@@ -0,0 +1,64 @@
+# JOIN_ENGINE=flat: journals_flat must give the rows the $lookup engine gives after a
+# build, a no-op refresh, dimension changes, and a journal the view's watermark passed
+# while it was in progress. $merge needs a real server (TEST_MONGO_URI).
+
+import random
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+from conftest import bench, pp
+
+def assert_matches_lookup(db):
+    pd.testing.assert_frame_equal(bench._collect(db, "lookup", 500), bench._collect(db, "flat", 500),
+                                  check_dtype=False)
+
+def newest_time(db):
+    return db[pp.JOURNALS_COL].find_one(sort=[("_id", -1)])["_id"].generation_time
+
+def finished_template(db):
+    return {k: v for k, v in db[pp.JOURNALS_COL].find_one({"end_time": {"$ne": None}}).items() if k != "_id"}
+
+def test_refresh_matches_lookup(mongod_db):
+    db = mongod_db
+    pp.refresh_flat_view(db)
+    built = db[pp.FLAT_COL].count_documents({})
+    assert built == db[pp.JOURNALS_COL].count_documents({"end_time": {"$ne": None}})
+    pp.refresh_flat_view(db)
+    assert db[pp.FLAT_COL].count_documents({}) == built
+    assert_matches_lookup(db)
+
+    rng = random.Random(1)
+    users = [u["_id"] for u in db[pp.USERS_COL].find({}, {"_id": 1}).limit(5)]
+    db[pp.USERS_COL].update_many({"_id": {"$in": users}}, {"$set": {"name": "Renamed User"}})
+    db[pp.LOCATIONS_COL].update_one({}, {"$set": {"city": "Moved City"}})
+    t = newest_time(db)
+    db[pp.JOURNALS_COL].insert_many([
+        {**{k: v for k, v in j.items() if k != "_id"}, "_id": ObjectId.from_datetime(t + timedelta(seconds=i + 1)),
+         "activity": rng.choice(["walk", "hike"])}
+        for i, j in enumerate(db[pp.JOURNALS_COL].find({"end_time": {"$ne": None}}).limit(100))])
+    pp.refresh_flat_view(db)
+    assert db[pp.FLAT_COL].count_documents({}) == built + 100
+    assert_matches_lookup(db)
+
+@pytest.mark.parametrize("rebuild", [False, True], ids=["incremental", "rebuild"])
+def test_journal_finished_late_is_merged(mongod_db, rebuild):
+    db = mongod_db
+    pp.refresh_flat_view(db)
+    t = newest_time(db) + timedelta(hours=1)
+    in_progress = ObjectId.from_datetime(t)
+    template = finished_template(db)
+    db[pp.JOURNALS_COL].insert_many([{**template, "_id": in_progress, "end_time": None},
+                                     {**template, "_id": ObjectId.from_datetime(t + timedelta(seconds=1))}])
+    # The watermark passes the journal in progress; it is kept as pending
+    pp.refresh_flat_view(db, rebuild=rebuild)
+    assert db[pp.FLAT_COL].count_documents({"_id": in_progress}) == 0
+    assert str(in_progress) in pp.MongoState(db, pp.FLAT_COL).load()["pending"]
+
+    db[pp.JOURNALS_COL].update_one({"_id": in_progress}, {"$set": {"end_time": t + timedelta(minutes=30)}})
+    pp.refresh_flat_view(db)
+    assert db[pp.FLAT_COL].count_documents({"_id": in_progress}) == 1
+    assert str(in_progress) not in pp.MongoState(db, pp.FLAT_COL).load()["pending"]
+    assert_matches_lookup(db)
@@ -0,0 +1,110 @@
+# JOIN_ENGINE=bulk must produce the rows agg_pipeline's $lookup/$project produce.
+# Hand-built documents cover the edge cases (id types, dangling and malformed ids,
+# the three coordinate formats, null/missing fields); the expected rows follow the
+# $lookup semantics. With a mongod the same documents also go through $lookup.
+
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+from conftest import TEST_DB, bench, pp
+
+T0 = datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+U1, U2 = ObjectId(), ObjectId()
+L1, L2, L3, L4 = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+DANGLING = "0" * 24
+
+USERS = [
+    {"_id": U1, "name": "Ann", "email": "ann@example.com"},
+    {"_id": U2, "email": None},
+]
+LOCATIONS = [
+    {"_id": L1, "name": "Pine Park", "city": "Austin", "stateInitials": "TX", "state": "Texas", "zip": "78701",
+     "address": "1 Main St", "coordinates": {"lat": 30.1, "lng": -97.7}, "parkNumber": 12, "category": ["A"]},
+    {"_id": L2, "name": "Lake", "city": "Toronto", "state": "ON", "country": "Canada",
+     "coordinates": {"latitude": 43.6, "longitude": -79.4}, "category": ["Provincial", "X"]},
+    {"_id": L3, "name": "Geo", "country": None, "coordinates": {"type": "Point", "coordinates": [-120.5, 38.2]},
+     "category": []},
+    {"_id": L4, "coordinates": "n/a"},
+]
+
+def journal(i, **fields):
+    start = T0 + timedelta(hours=i)
+    return {"_id": ObjectId.from_datetime(start), "start_time": start, "end_time": start + timedelta(seconds=90),
+            **fields}
+
+JOURNALS = [
+    journal(0, uid=U1, locationId=str(L1), activity="walk", notes=None),
+    journal(1, uid=str(U2), locationId=L2, notes="quiet"),
+    journal(2, uid="not-an-id", locationId=str(L3)),
+    journal(3, locationId=DANGLING, activity=None),
+    journal(4, uid=123, locationId=L4),
+]
+
+NO_LOCATION = {"n_Name": "", "City": "", "State": "", "Zip": "", "LocCountry": "", "Address": "",
+               "n_Place": ",  ", "n_Lati": None, "n_Long": None, "n_park_nbr": None}
+
+def expected_rows():
+    rows = [
+        {"User Name": "Ann", "User email": "ann@example.com", "n_Name": "Pine Park", "City": "Austin",
+         "State": "TX", "Zip": "78701", "LocCountry": "", "Address": "1 Main St", "n_Place": "Pine Park, Austin TX",
+         "n_Lati": 30.1, "n_Long": -97.7, "n_park_nbr": 12, "n_activity": "walk", "n_notes": ""},
+        {"User Name": "", "User email": "", "n_Name": "Lake", "City": "Toronto", "State": "ON", "Zip": "",
+         "LocCountry": "Canada", "Address": "", "n_Place": "Lake, Toronto ON", "n_Lati": 43.6, "n_Long": -79.4,
+         "n_park_nbr": "Provincial", "n_activity": "", "n_notes": "quiet"},
+        {"User Name": "", "User email": "", "n_Name": "Geo", "City": "", "State": "", "Zip": "", "LocCountry": "",
+         "Address": "", "n_Place": "Geo,  ", "n_Lati": 38.2, "n_Long": -120.5, "n_park_nbr": None,
+         "n_activity": "", "n_notes": ""},
+        {"User Name": "", "User email": "", **NO_LOCATION, "n_activity": "", "n_notes": ""},
+        {"User Name": "", "User email": "", **NO_LOCATION, "n_activity": "", "n_notes": ""},
+    ]
+    for j, row in zip(JOURNALS, rows):
+        row.update({"journal_id": str(j["_id"]), "Timestamp": j["start_time"], "End Date Time": j["end_time"],
+                    "n_Duration": 1.5})
+    return [{c: row[c] for c in pp.PROJECT_COLS} for row in rows]
+
+def records(df: pd.DataFrame) -> list:
+    df = df[pp.PROJECT_COLS].astype(object)
+    return df.where(df.notna(), None).to_dict("records")
+
+def insert_fixture_docs(db):
+    db[pp.USERS_COL].insert_many(USERS)
+    db[pp.LOCATIONS_COL].insert_many(LOCATIONS)
+    db[pp.JOURNALS_COL].insert_many(JOURNALS)
+
+def bulk_rows(db) -> list:
+    users, locations = pp.dimension_caches(db)
+    return records(pp.bulk_join(list(db[pp.JOURNALS_COL].find({}, pp.JOURNAL_FIELDS).sort("_id", 1)),
+                                users, locations))
+
+def test_bulk_join_matches_lookup_semantics(mock_client):
+    db = mock_client["NC_join_test"]
+    insert_fixture_docs(db)
+    assert bulk_rows(db) == expected_rows()
+
+def test_dimension_cache_queries_each_id_once(mock_client):
+    db = mock_client["NC_join_test"]
+    insert_fixture_docs(db)
+    users, locations = pp.dimension_caches(db)
+    for _ in range(2):
+        pp.bulk_join(list(db[pp.JOURNALS_COL].find({}, pp.JOURNAL_FIELDS)), users, locations)
+    # Second batch: every id, dangling ones included, comes from the cache
+    assert (users.queries, locations.queries) == (1, 1)
+    assert locations.rows[ObjectId(DANGLING)] is None
+
+def test_lookup_matches_expected_rows(mongod_client):
+    db = mongod_client[TEST_DB]
+    insert_fixture_docs(db)
+    lookup = pd.DataFrame(list(db[pp.JOURNALS_COL].aggregate(pp.agg_pipeline({}))))
+    assert records(lookup) == expected_rows()
+    assert bulk_rows(db) == expected_rows()
+
+def test_bulk_matches_lookup_on_seeded_data(mongod_db):
+    pd.testing.assert_frame_equal(bench._collect(mongod_db, "lookup", 500), bench._collect(mongod_db, "bulk", 500),
+                                  check_dtype=False)
+
+def test_server_transform_matches_client(mongod_db):
+    pd.testing.assert_frame_equal(bench._collect(mongod_db, "lookup", 500, "client"),
+                                  bench._collect(mongod_db, "lookup", 500, "server"), check_dtype=False)
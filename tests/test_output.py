@@ -0,0 +1,176 @@
+# Output writes against mongomock + FakeDriveHttp: reruns and full runs add no duplicate
+# rows, incremental summary sheets equal a full recompute, hand-edited Status survives,
+# and stream mode's flushes (change batches replayed in-process) behave the same way.
+
+from datetime import timedelta
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from conftest import FOLDER, pp
+
+MODES = [dict(OUTPUT_WRITE_MODE="merge"), dict(OUTPUT_WRITE_MODE="append"), dict(OUTPUT_WRITE_MODE="rewrite"),
+         dict(OUTPUT_WRITE_MODE="rewrite", OUTPUT_WRITER="stream")]
+MODE_IDS = ["merge", "append", "rewrite", "rewrite-stream"]
+
+def status():
+    return pp._run_context.report["status"]
+
+def hold_back(db, n):
+    """Remove the newest `n` journals; returns them for put_back()."""
+    docs = list(db[pp.JOURNALS_COL].find().sort("_id", -1).limit(n))
+    db[pp.JOURNALS_COL].delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+    return docs
+
+def set_status(book, journal_id, value):
+    """Edit a row's Status in Drive, as a user would."""
+    wb = openpyxl.load_workbook(pp.io.BytesIO(book.content()))
+    ws = wb[book.data_sheet()]
+    header = [c.value for c in ws[1]]
+    for row in ws.iter_rows(min_row=2):
+        if row[header.index(pp.ID_COL)].value == journal_id:
+            row[header.index("Status")].value = value
+    path = "edited.xlsx"
+    wb.save(path)
+    pp.DriveTransfer().upload(book.drive, path, book.name, FOLDER, book.file_id)
+
+def assert_summaries_match(book):
+    tables = book.summaries()
+    assert tables is not None
+    full = pp.summarise(book.data_frame())
+    for sheet in pp.SUMMARY_SHEETS:
+        pd.testing.assert_frame_equal(tables[sheet].reset_index(drop=True), full[sheet].reset_index(drop=True),
+                                      check_dtype=False)
+
+@pytest.mark.parametrize("mode", MODES, ids=MODE_IDS)
+def test_reruns_add_no_duplicates(run_pipeline, mock_db, mode):
+    held = hold_back(mock_db, 50)
+    book = run_pipeline(**mode)
+    assert status() == "SUCCESS"
+    first = book.data_frame()
+    assert run_pipeline(**mode).data_frame().equals(first)
+    assert status() == "NO_UPDATES"
+
+    mock_db[pp.JOURNALS_COL].insert_many(held)
+    book = run_pipeline(**mode)
+    assert status() == "SUCCESS"
+    rows = book.data_frame()
+    assert len(rows) == len(first) + len([d for d in held if d.get("end_time")])
+    # A full run over an up-to-date file writes nothing
+    assert run_pipeline(RUN_MODE="full", **mode).data_frame().equals(rows)
+    assert status() == "NO_UPDATES"
+    assert rows[pp.ID_COL].is_unique
+    assert book.keys()["journal_id"].tolist() == rows[pp.ID_COL].tolist()
+
+@pytest.mark.parametrize("mode", MODES, ids=MODE_IDS)
+def test_incremental_summaries_match_full_recompute(run_pipeline, mock_db, mode):
+    held = hold_back(mock_db, 80)
+    assert_summaries_match(run_pipeline(SUMMARY_SHEETS="incremental", **mode))
+    for batch in (held[40:], held[:40]):
+        mock_db[pp.JOURNALS_COL].insert_many(batch)
+        assert_summaries_match(run_pipeline(SUMMARY_SHEETS="incremental", **mode))
+
+def test_merge_updates_rows_and_summaries_in_place(run_pipeline, mock_db):
+    book = run_pipeline(OUTPUT_WRITE_MODE="merge", SUMMARY_SHEETS="incremental")
+    before = book.data_frame()
+    doc = mock_db[pp.JOURNALS_COL].find_one({"end_time": {"$ne": None}}, sort=[("_id", 1)])
+    mock_db[pp.JOURNALS_COL].update_one({"_id": doc["_id"]},
+                                        {"$set": {"end_time": doc["end_time"] + timedelta(minutes=30)}})
+    book = run_pipeline(OUTPUT_WRITE_MODE="merge", SUMMARY_SHEETS="incremental", RUN_MODE="full")
+    after = book.data_frame()
+    assert len(after) == len(before)
+    row = after[after[pp.ID_COL] == str(doc["_id"])]
+    assert len(row) == 1
+    assert float(row["n_Duration"].iloc[0]) > float(before.loc[row.index[0], "n_Duration"])
+    assert_summaries_match(book)
+
+@pytest.mark.parametrize("mode", [dict(OUTPUT_WRITE_MODE="merge"), dict(OUTPUT_WRITE_MODE="append"),
+                                  dict(STAGING_DIR="staging")], ids=["merge", "append", "staging"])
+def test_status_survives_later_runs(run_pipeline, mock_db, mode):
+    held = hold_back(mock_db, 20)
+    book = run_pipeline(**mode)
+    journal_id = book.data_frame()[pp.ID_COL].iloc[3]
+    set_status(book, journal_id, "reviewed")
+    mock_db[pp.JOURNALS_COL].insert_many(held)
+    book = run_pipeline(**mode)
+    assert status() == "SUCCESS"
+    assert {k: v for k, v in book.statuses().items() if v} == {journal_id: "reviewed"}
+
+@pytest.fixture
+def stream(run_pipeline, monkeypatch):
+    """
+    stream(batches, **settings) runs run_stream with the change stream replaced by
+    `batches` ({journal _id: operationType} each); mongomock has no change streams.
+    """
+    def run(batches, **settings):
+        def changes(coll, token, flush_rows, flush_seconds, max_seconds, on_open=None):
+            on_open({"_data": "start"})
+            for i, batch in enumerate(batches):
+                yield batch, {"_data": str(i)}
+
+        monkeypatch.setattr(pp, "iter_change_batches", changes)
+        return run_pipeline(RUN_MODE="stream", **settings)
+
+    return run
+
+@pytest.mark.parametrize("mode", ["merge", "append"])
+def test_stream_flushes(stream, mock_db, mode):
+    held = [d for d in hold_back(mock_db, 30) if d.get("end_time")]
+    late = mock_db[pp.JOURNALS_COL].find_one({"end_time": {"$ne": None}}, sort=[("_id", 1)])
+    mock_db[pp.JOURNALS_COL].update_one({"_id": late["_id"]}, {"$set": {"end_time": None}})
+    caught_up = stream([], OUTPUT_WRITE_MODE=mode, SUMMARY_SHEETS="incremental").data_frame()
+    assert str(late["_id"]) not in set(caught_up[pp.ID_COL])
+
+    mock_db[pp.JOURNALS_COL].insert_many(held)
+    mock_db[pp.JOURNALS_COL].update_one({"_id": late["_id"]}, {"$set": {"end_time": late["end_time"]}})
+    inserts = {d["_id"]: "insert" for d in held}
+    # The second batch replays the first (a restart before its token was saved)
+    book = stream([{**inserts, late["_id"]: "update"}, inserts], OUTPUT_WRITE_MODE=mode,
+                  SUMMARY_SHEETS="incremental")
+    rows = book.data_frame()
+    assert len(rows) == len(caught_up) + len(held) + 1
+    assert rows[pp.ID_COL].is_unique
+    assert book.watermark() == str(max(d["_id"] for d in held))
+    assert_summaries_match(book)
+
+def openpyxl_temp_files():
+    from openpyxl.worksheet._writer import ALL_TEMP_FILES
+    return [f for f in ALL_TEMP_FILES if pp.os.path.exists(f)]
+
+def test_streaming_writer_abort_releases_temp_files(tmp_path):
+    before = openpyxl_temp_files()
+    path = str(tmp_path / "out.xlsx")
+    writer = pp.StreamingOutputWriter(path)
+    writer.append(("",) * len(pp.FINAL_COLS), ("j1", "h1"))
+    assert len(openpyxl_temp_files()) > len(before)
+    writer.abort()
+    assert openpyxl_temp_files() == before
+    assert not pp.os.path.exists(path)
+
+    writer = pp.StreamingOutputWriter(path)
+    writer.append(("",) * len(pp.FINAL_COLS), ("j1", "h1"))
+    writer.close("0" * 24)
+    writer.abort()
+    assert pp.os.path.exists(path)
+    assert openpyxl_temp_files() == before
+
+@pytest.mark.parametrize("fail_in", ["fetch", "close"])
+def test_failed_stream_writer_run_leaves_no_files(run_pipeline, mock_db, tmp_path, monkeypatch, fail_in):
+    held = hold_back(mock_db, 50)
+    run_pipeline(OUTPUT_WRITER="stream")
+    mock_db[pp.JOURNALS_COL].insert_many(held)
+    before = openpyxl_temp_files()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("injected failure")
+
+    if fail_in == "fetch":
+        monkeypatch.setattr(pp, "drop_unchanged", fail)
+    else:
+        monkeypatch.setattr(pp, "write_summaries", fail)
+    with pytest.raises(RuntimeError, match="injected failure"):
+        run_pipeline(OUTPUT_WRITER="stream", SUMMARY_SHEETS="full")
+    assert status() == "FAILED"
+    assert openpyxl_temp_files() == before
+    assert not list(tmp_path.glob("NC-out-*.xlsx"))